@@ -0,0 +1,32 @@
+"""Microbenchmarks for performance sensitive parts of the cogs
+
+Each benchmark is run as a module from the repository root, for example:
+
+    python -m benchmarks.ignore_matcher
+
+Like the tests, these need Red and discord.py installed. `cog_shared` is pointed at this
+repository, and Red is configured to store its data in a throwaway directory.
+"""
+
+import sys
+import tempfile
+import timeit
+import types
+from pathlib import Path
+from typing import Callable
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+if "cog_shared" not in sys.modules:
+    cog_shared = sys.modules["cog_shared"] = types.ModuleType("cog_shared")
+    cog_shared.__path__ = [str(ROOT)]
+
+from logs.replay import _prepare_red  # noqa: E402
+
+_prepare_red(tempfile.mkdtemp(prefix="swift-cogs-bench-"))
+
+
+def bench(func: Callable[[], object], *, repeat: int = 5, number: int = 1) -> float:
+    """Returns the best time out of `repeat` runs of calling `func` `number` times"""
+    return min(timeit.repeat(func, repeat=repeat, number=number))
@@ -0,0 +1,77 @@
+"""Time rendering word diffs of long messages and channel topics
+
+Messages are up to 2000 characters long and topics up to 1024. Each is diffed with a single
+changed word, 10 changed words spread through the text, and a complete rewrite; the last
+hits `MAX_EDITS`, so it's also timed with a few other edit limits. difflib's SequenceMatcher
+is run on the same words for comparison.
+"""
+
+import difflib
+import random
+from typing import Callable, List
+
+from benchmarks import bench
+from logs.core import diff
+from logs.core.diff import render_diff, tokenize
+
+WORDS = (
+    "the quick brown fox jumps over lazy dog moderation channel message role server "
+    "discord member voice topic edit delete update rules welcome announcement"
+).split()
+LENGTHS = (("message", 2000), ("topic", 1024))
+EDIT_LIMITS = (50, 100, 200, 400)
+
+
+def text(rng: random.Random, length: int) -> str:
+    words: List[str] = []
+    while sum(len(x) + 1 for x in words) < length:
+        words.append(rng.choice(WORDS))
+    return " ".join(words)[:length].rstrip()
+
+
+def edit_words(rng: random.Random, original: str, count: int) -> str:
+    words = original.split(" ")
+    for idx in rng.sample(range(len(words)), count):
+        words[idx] = "edited"
+    return " ".join(words)
+
+
+def time_us(func: Callable[[], object]) -> float:
+    return bench(func, number=20) / 20 * 1e6
+
+
+def main():
+    rng = random.Random(0)
+    default_limit = diff.MAX_EDITS
+    print("{:<24} {:>12} {:>14}".format("", "render_diff", "SequenceMatcher"))
+    for name, length in LENGTHS:
+        before = text(rng, length)
+        cases = (
+            ("1 word", edit_words(rng, before, 1)),
+            ("10 words", edit_words(rng, before, 10)),
+            ("rewrite", text(rng, length)),
+        )
+        for case, after in cases:
+            ta, tb = tokenize(before), tokenize(after)
+            ours = time_us(lambda: render_diff(before, after))
+            theirs = time_us(lambda: difflib.SequenceMatcher(None, ta, tb).get_opcodes())
+            print(
+                "{:<24} {:>10.0f}us {:>12.0f}us".format(
+                    "{} ({} chars), {}".format(name, len(before), case), ours, theirs
+                )
+            )
+        # a complete rewrite always hits the edit limit, and so always takes the longest
+        after = cases[-1][1]
+        for limit in EDIT_LIMITS:
+            diff.MAX_EDITS = limit
+            print(
+                "{:<24} {:>10.0f}us".format(
+                    "  rewrite, MAX_EDITS={}".format(limit),
+                    time_us(lambda: render_diff(before, after)),
+                )
+            )
+        diff.MAX_EDITS = default_limit
+
+
+if __name__ == "__main__":
+    main()
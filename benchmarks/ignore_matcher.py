@@ -0,0 +1,92 @@
+"""Compare the compiled ignore matcher against the list based checks it replaced"""
+
+import random
+
+import discord
+
+from benchmarks import bench
+from logs.core.settings import IgnoreMatcher
+from logs.replay import fake
+
+# enough checks per run for per-check timings to be stable
+CHECKS = 10000
+
+
+def legacy_check(item, ignore: dict) -> bool:
+    """The list based check `Module.is_ignored` used before ignore lists were compiled"""
+    if isinstance(item, discord.Member):
+        ignore_roles = ignore.get("member_roles", [])
+        return any(
+            [
+                item.bot,
+                item.id in ignore.get("members", []),
+                *[x.id in ignore_roles for x in item.roles],
+            ]
+        )
+    elif isinstance(item, discord.abc.GuildChannel):
+        channels = ignore.get("channels", [])
+        return any([item.id in channels, getattr(item.category, "id", None) in channels])
+    elif isinstance(item, discord.Role):
+        return item.id in ignore.get("roles", [])
+    elif isinstance(item, discord.VoiceState):
+        return getattr(item.channel, "id", None) in ignore.get("channels", [])
+    elif isinstance(item, discord.Message):
+        return any([legacy_check(item.author, ignore), legacy_check(item.channel, ignore)])
+    return False
+
+
+def build_items(ignore: dict, rng: random.Random) -> list:
+    roles = [fake(discord.Role, id=x) for x in range(1000, 1100)]
+    categories = [fake(discord.CategoryChannel, id=x) for x in range(2000, 2010)]
+    channels = []
+    for channel_id in range(3000, 3100):
+        category = rng.choice(categories)
+        channels.append(
+            fake(discord.TextChannel, id=channel_id, category=category, category_id=category.id)
+        )
+    members = []
+    for member_id in range(4000, 4500):
+        member_roles = rng.sample(roles, 15)
+        members.append(
+            fake(
+                discord.Member,
+                id=member_id,
+                bot=False,
+                roles=member_roles,
+                _roles=[x.id for x in member_roles],
+            )
+        )
+    messages = [
+        fake(discord.Message, author=rng.choice(members), channel=rng.choice(channels))
+        for _ in range(500)
+    ]
+    states = [fake(discord.VoiceState, channel=rng.choice(channels)) for _ in range(100)]
+    items = members + channels + roles + messages + states
+    rng.shuffle(items)
+    return (items * (CHECKS // len(items) + 1))[:CHECKS]
+
+
+def main():
+    rng = random.Random(0)
+    ignore = {
+        "guild": False,
+        "members": rng.sample(range(4000, 4500), 50),
+        "member_roles": rng.sample(range(1000, 1100), 20),
+        "channels": rng.sample(range(3000, 3100), 30) + [2000],
+        "roles": rng.sample(range(1000, 1100), 10),
+    }
+    items = build_items(ignore, rng)
+    matcher = IgnoreMatcher(ignore)
+    assert [matcher.matches(x) for x in items] == [legacy_check(x, ignore) for x in items]
+
+    legacy = bench(lambda: [legacy_check(x, ignore) for x in items])
+    compiled = bench(lambda: [matcher.matches(x) for x in items])
+    build = bench(lambda: IgnoreMatcher(ignore), number=1000) / 1000
+    print("{:,} mixed member, channel, role, voice state and message checks".format(CHECKS))
+    print("  list based checks  {:8.2f} us/check".format(legacy / CHECKS * 1e6))
+    print("  compiled matcher   {:8.2f} us/check".format(compiled / CHECKS * 1e6))
+    print("  building a matcher {:8.2f} us".format(build * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Time loading every quote in a guild with `Quote.all_quotes`
+
+For comparison, this also times loading the same quotes with one `Quote.get` call per quote,
+and the loop `all_quotes` used before quotes were moved out of a single list, which re-read
+the guild's entire quote list for every quote. Both are only timed for the smaller sizes.
+"""
+
+import asyncio
+from types import SimpleNamespace
+from typing import Dict, List
+
+from benchmarks import bench
+from quotes import quote
+from quotes.quote import Quote
+
+SIZES = (1000, 10000, 100000)
+# loading quotes one at a time is only timed up to this many quotes
+MAX_PER_QUOTE = 10000
+# and the old list based loop only up to this many, as it's quadratic
+MAX_LEGACY = 1000
+
+
+def make_quotes(count: int) -> Dict[int, dict]:
+    return {
+        quote_id: {
+            "author_id": 1000 + quote_id % 50,
+            "message_author_id": 2000 + quote_id % 200,
+            "text": "quote number {} with a few more words in it".format(quote_id),
+            "timestamp": 1500000000.0 + quote_id,
+        }
+        for quote_id in range(1, count + 1)
+    }
+
+
+async def populate(guild, count: int) -> None:
+    quotes = make_quotes(count)
+    await quote.quote_group(guild).set({str(k): v for k, v in quotes.items()})
+    quote._migrated.add(guild.id)
+    if count <= MAX_LEGACY:
+        # kept in the legacy list as well, but only read directly by `legacy_all_quotes`
+        await quote.conf.guild(guild).quotes.set(list(quotes.values()))
+
+
+async def per_quote(guild, count: int) -> List[Quote]:
+    return [await Quote.get(guild, quote_id) for quote_id in range(1, count + 1)]
+
+
+async def legacy_all_quotes(guild) -> List[Quote]:
+    """The loop `Quote.all_quotes` originally used, including the old `Quote.get`"""
+    quotes = []
+    for i in range(len(await quote.conf.guild(guild).quotes())):
+        data = list(await quote.conf.guild(guild).quotes())
+        quotes.append(Quote(guild=guild, id=i + 1, **data[i]))
+    return quotes
+
+
+def main():
+    loop = asyncio.get_event_loop()
+    print("{:>8}  {:>11}  {:>11}  {:>11}".format("quotes", "all_quotes", "Quote.get", "old loop"))
+    for guild_id, count in enumerate(SIZES, 1):
+        guild = SimpleNamespace(id=guild_id)
+        loop.run_until_complete(populate(guild, count))
+        assert len(loop.run_until_complete(Quote.all_quotes(guild))) == count
+        row = [bench(lambda: loop.run_until_complete(Quote.all_quotes(guild)))]
+        row.append(
+            bench(lambda: loop.run_until_complete(per_quote(guild, count)), repeat=1)
+            if count <= MAX_PER_QUOTE
+            else None
+        )
+        row.append(
+            bench(lambda: loop.run_until_complete(legacy_all_quotes(guild)), repeat=1)
+            if count <= MAX_LEGACY
+            else None
+        )
+        print(
+            "{:>8,}  ".format(count)
+            + "  ".join(
+                "{:10.3f}s".format(x) if x is not None else "{:>11}".format("-") for x in row
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
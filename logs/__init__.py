@@ -1,6 +1,9 @@
 from redbot.core.bot import Red
-from logs.logs import Logs
 
 
 def setup(bot: Red):
+    # imported here rather than at the top of the module, as importing the cog requires Red's
+    # basic configuration to be loaded, which isn't the case for `python -m logs.replay`
+    from logs.logs import Logs
+
     bot.add_cog(Logs(bot))
@@ -1,5 +1,6 @@
 from .logentry import LogEntry  # noqa
-from .module import Module, get_module, log_event  # noqa
+from .module import Module, get_module, log_event, submit_event  # noqa
 from .i18n import i18n  # noqa
 from . import utils  # noqa
 from .config import config, rebuild_defaults  # noqa
+from .settings import GuildSettings, IgnoreMatcher, get_settings, invalidate  # noqa
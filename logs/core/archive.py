@@ -0,0 +1,616 @@
+"""Persistent log entry archive
+
+Every log entry that's sent in a guild with archiving enabled is also written to a local
+archive, which allows for searching past log entries without scrolling through log channels.
+Archive backends implement the `Archive` interface; `SQLiteArchive` is currently the only
+available backend.
+
+Writes never happen on the send path; entries are buffered by an `ArchiveWriter`
+and written in batches from a background task.
+"""
+
+import asyncio
+import gzip
+import json
+import re
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+import discord
+
+from logs.core.log import log
+
+__all__ = (
+    "Archive",
+    "ArchiveRecord",
+    "ArchiveWriter",
+    "ExportProgress",
+    "SQLiteArchive",
+    "apply_retention",
+    "close_archive",
+    "get_archive",
+    "index_tokens",
+    "open_archive",
+)
+
+# How long entries are buffered for before being written
+FLUSH_INTERVAL = 2.0
+# Buffered entries are written immediately once this many are waiting
+BATCH_SIZE = 250
+# Hard cap on the amount of buffered entries; anything past this is dropped
+MAX_BUFFER = 5000
+# Default amount of days entries are kept for, if a guild hasn't changed it
+DEFAULT_RETENTION = 30
+
+# Words shorter or longer than this aren't indexed
+MIN_TOKEN_LENGTH = 2
+MAX_TOKEN_LENGTH = 40
+
+_writer: Optional["ArchiveWriter"] = None
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def index_tokens(text: str) -> Set[str]:
+    """Split text into the set of lowercase words that are indexed for searching"""
+    return {
+        x for x in _TOKEN_RE.findall(text.lower()) if MIN_TOKEN_LENGTH <= len(x) <= MAX_TOKEN_LENGTH
+    }
+
+
+def _to_epoch(dt: Optional[datetime]) -> float:
+    # embeds without a timestamp have it set to Embed.Empty, which is treated the same as None
+    if not isinstance(dt, datetime):
+        return time.time()
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+class ArchiveRecord:
+    """A single archived log entry"""
+
+    __slots__ = (
+        "id",
+        "guild_id",
+        "module",
+        "event",
+        "channel_id",
+        "member_id",
+        "timestamp",
+        "content",
+        "data",
+    )
+
+    def __init__(
+        self,
+        *,
+        guild_id: int,
+        module: str,
+        event: Optional[str],
+        channel_id: Optional[int],
+        member_id: Optional[int],
+        timestamp: float,
+        content: str,
+        data: Dict[str, Any],
+        id: int = None
+    ):
+        self.id = id
+        self.guild_id = guild_id
+        self.module = module
+        self.event = event
+        self.channel_id = channel_id
+        self.member_id = member_id
+        self.timestamp = timestamp
+        self.content = content
+        self.data = data
+
+    def __repr__(self):
+        return (
+            "<ArchiveRecord id={0.id!r} guild_id={0.guild_id!r} module={0.module!r} "
+            "event={0.event!r}>".format(self)
+        )
+
+    @property
+    def created_at(self) -> datetime:
+        return datetime.utcfromtimestamp(self.timestamp)
+
+    @classmethod
+    def from_entry(cls, entry, guild_id: int) -> "ArchiveRecord":
+        """Build a record from a LogEntry"""
+        data = entry.to_dict()
+        content = [data.get("description", "")]
+        content.extend(x.get("value", "") for x in data.get("fields", []))
+        return cls(
+            guild_id=guild_id,
+            module=entry.module.name,
+            event=entry.event,
+            channel_id=entry.channel_id,
+            member_id=entry.member_id,
+            timestamp=_to_epoch(entry.timestamp),
+            content="\n".join(x for x in content if x),
+            data=data,
+        )
+
+    def to_embed(self) -> discord.Embed:
+        return discord.Embed.from_data(self.data)
+
+
+class ExportProgress:
+    """Progress of a running export
+
+    This is updated from the thread the export runs in, and can be read from anywhere.
+    """
+
+    __slots__ = ("total", "exported")
+
+    def __init__(self):
+        self.total: Optional[int] = None
+        self.exported = 0
+
+    def __repr__(self):
+        return "<ExportProgress exported={0.exported} total={0.total!r}>".format(self)
+
+    @property
+    def percent(self) -> float:
+        return self.exported / self.total * 100 if self.total else 100.0
+
+
+class Archive(ABC):
+    """Base archive backend"""
+
+    @abstractmethod
+    async def write(self, records: List[ArchiveRecord]) -> None:
+        """Write a batch of records to the archive"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def query(
+        self,
+        guild_id: int,
+        *,
+        module: str = None,
+        event: str = None,
+        member_id: int = None,
+        since: float = None,
+        until: float = None,
+        words: Sequence[str] = (),
+        phrases: Sequence[str] = (),
+        before_id: int = None,
+        limit: int = 25
+    ) -> List[ArchiveRecord]:
+        """Retrieve records from the archive, newest first
+
+        Records must contain every word in `words`, and every string in `phrases`.
+        Words are matched against the archive's token index, and as such should be
+        given as returned by `index_tokens`.
+
+        Results are paginated by passing the ID of the last record returned
+        as `before_id` for the next query.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def export(
+        self,
+        guild_id: int,
+        path: Union[str, Path],
+        *,
+        since: float = None,
+        until: float = None,
+        modules: Sequence[str] = (),
+        progress: ExportProgress = None
+    ) -> int:
+        """Write a guild's records to a gzip compressed NDJSON file, oldest first
+
+        Records are streamed from the archive, so memory use doesn't depend on how many
+        records are exported. Returns the amount of exported records.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def purge(self, guild_id: int, before: float = None) -> int:
+        """Delete a guild's records older than the given timestamp, or all of them if
+        no timestamp is given. Returns the amount of deleted records."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def guild_ids(self) -> List[int]:
+        """Returns the ID of every guild that has any archived records"""
+        raise NotImplementedError
+
+    async def compact(self) -> None:
+        """Reclaim space left behind by deleted records"""
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class SQLiteArchive(Archive):
+    """SQLite archive backend
+
+    All database access is done from a single dedicated thread, as sqlite3 connections
+    aren't safe to share between threads.
+    """
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER NOT NULL,
+            module TEXT NOT NULL,
+            event TEXT,
+            channel_id INTEGER,
+            member_id INTEGER,
+            timestamp REAL NOT NULL,
+            content TEXT NOT NULL,
+            data TEXT NOT NULL
+        )
+        """,
+        # Every query is scoped to a single guild, and results are always ordered by ID,
+        # so each index is prefixed with the guild ID and suffixed with the entry ID
+        "CREATE INDEX IF NOT EXISTS entries_guild ON entries (guild_id, id)",
+        "CREATE INDEX IF NOT EXISTS entries_module ON entries (guild_id, module, id)",
+        "CREATE INDEX IF NOT EXISTS entries_member ON entries (guild_id, member_id, id)",
+        "CREATE INDEX IF NOT EXISTS entries_time ON entries (guild_id, timestamp)",
+        # Inverted index of the words contained in each entry's content
+        """
+        CREATE TABLE IF NOT EXISTS entry_tokens (
+            guild_id INTEGER NOT NULL,
+            token TEXT NOT NULL,
+            entry_id INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, token, entry_id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS entry_tokens_entry ON entry_tokens (guild_id, entry_id)",
+    )
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def __repr__(self):
+        return "<SQLiteArchive path={!r}>".format(str(self.path))
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            # auto_vacuum has to be set before any tables are created for it to take effect
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            with conn:
+                for statement in self.SCHEMA:
+                    conn.execute(statement)
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self._executor, func, *args)
+
+    def _write(self, records: List[ArchiveRecord]) -> None:
+        tokens = []
+        with self.conn as conn:
+            for x in records:
+                x.id = conn.execute(
+                    "INSERT INTO entries (guild_id, module, event, channel_id, member_id,"
+                    " timestamp, content, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        x.guild_id,
+                        x.module,
+                        x.event,
+                        x.channel_id,
+                        x.member_id,
+                        x.timestamp,
+                        x.content,
+                        json.dumps(x.data, separators=(",", ":")),
+                    ),
+                ).lastrowid
+                tokens.extend((x.guild_id, token, x.id) for token in index_tokens(x.content))
+            conn.executemany(
+                "INSERT OR IGNORE INTO entry_tokens (guild_id, token, entry_id) VALUES (?, ?, ?)",
+                tokens,
+            )
+
+    async def write(self, records: List[ArchiveRecord]) -> None:
+        if records:
+            await self._run(self._write, records)
+
+    @staticmethod
+    def _row_to_record(row: tuple) -> ArchiveRecord:
+        id_, guild_id, module, event, channel_id, member_id, timestamp, content, data = row
+        return ArchiveRecord(
+            id=id_,
+            guild_id=guild_id,
+            module=module,
+            event=event,
+            channel_id=channel_id,
+            member_id=member_id,
+            timestamp=timestamp,
+            content=content,
+            data=json.loads(data),
+        )
+
+    @staticmethod
+    def _build_query(guild_id: int, limit: int, **filters) -> Tuple[str, List[Any]]:
+        tables, where, params = ["entries e"], ["e.guild_id = ?"], [guild_id]
+        # ordering by the ID column of the table the query is driven by allows SQLite
+        # to walk that table's index in order, instead of sorting every matching row
+        id_column = "e.id"
+
+        # word searches are driven by the token index; the longest word is used as it's
+        # likely to be the least common, and any other words are checked for per-entry
+        words = sorted(set(filters.get("words") or ()), key=len, reverse=True)
+        if words:
+            tables.append("entry_tokens t")
+            id_column = "t.entry_id"
+            where += ["t.guild_id = e.guild_id", "t.token = ?", "t.entry_id = e.id"]
+            params.append(words[0])
+            for word in words[1:]:
+                where.append(
+                    "EXISTS (SELECT 1 FROM entry_tokens WHERE guild_id = e.guild_id"
+                    " AND token = ? AND entry_id = e.id)"
+                )
+                params.append(word)
+
+        for column in ("module", "event", "member_id"):
+            if filters.get(column) is not None:
+                where.append("e.{} = ?".format(column))
+                params.append(filters[column])
+        if filters.get("since") is not None:
+            where.append("e.timestamp >= ?")
+            params.append(filters["since"])
+        if filters.get("until") is not None:
+            where.append("e.timestamp < ?")
+            params.append(filters["until"])
+        for phrase in filters.get("phrases") or ():
+            where.append("e.content LIKE ? ESCAPE '\\'")
+            params.append("%{}%".format(re.sub(r"([%_\\])", r"\\\1", phrase)))
+        if filters.get("before_id") is not None:
+            where.append("{} < ?".format(id_column))
+            params.append(filters["before_id"])
+
+        sql = (
+            "SELECT e.id, e.guild_id, e.module, e.event, e.channel_id, e.member_id, e.timestamp,"
+            " e.content, e.data FROM {} WHERE {} ORDER BY {} DESC LIMIT ?".format(
+                ", ".join(tables), " AND ".join(where), id_column
+            )
+        )
+        params.append(limit)
+        return sql, params
+
+    def _query(self, guild_id: int, limit: int, filters: Dict[str, Any]) -> List[ArchiveRecord]:
+        sql, params = self._build_query(guild_id, limit, **filters)
+        return [self._row_to_record(x) for x in self.conn.execute(sql, params)]
+
+    async def query(self, guild_id: int, *, limit: int = 25, **filters) -> List[ArchiveRecord]:
+        return await self._run(self._query, guild_id, limit, filters)
+
+    def _export(
+        self,
+        guild_id: int,
+        path: Path,
+        since: Optional[float],
+        until: Optional[float],
+        modules: Sequence[str],
+        progress: ExportProgress,
+    ) -> int:
+        where, params = ["guild_id = ?"], [guild_id]
+        if since is not None:
+            where.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("timestamp < ?")
+            params.append(until)
+        if modules:
+            where.append("module IN ({})".format(", ".join("?" * len(modules))))
+            params.extend(modules)
+        where = " AND ".join(where)
+
+        # exports use their own connection, so a long export doesn't hold up archive writes;
+        # reading in a single transaction gives a consistent snapshot of the archive in WAL mode
+        conn = sqlite3.connect(str(self.path))
+        try:
+            conn.execute("BEGIN")
+            progress.total = conn.execute(
+                "SELECT COUNT(*) FROM entries WHERE {}".format(where), params
+            ).fetchone()[0]
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with gzip.open(str(path), "wt", encoding="utf-8") as f:
+                # iterating the cursor steps through the result set one row at a time,
+                # instead of loading every row into memory at once
+                cursor = conn.execute(
+                    "SELECT id, module, event, channel_id, member_id, timestamp, content, data"
+                    " FROM entries WHERE {} ORDER BY timestamp, id".format(where),
+                    params,
+                )
+                for id_, module, event, channel_id, member_id, timestamp, content, data in cursor:
+                    meta = json.dumps(
+                        {
+                            "id": id_,
+                            "module": module,
+                            "event": event,
+                            "channel_id": channel_id,
+                            "member_id": member_id,
+                            "timestamp": datetime.fromtimestamp(
+                                timestamp, timezone.utc
+                            ).isoformat(),
+                            "content": content,
+                        },
+                        separators=(",", ":"),
+                    )
+                    # the embed is already stored as JSON, so it's spliced in as-is
+                    f.write('{},"embed":{}}}\n'.format(meta[:-1], data))
+                    progress.exported += 1
+        finally:
+            conn.close()
+        return progress.exported
+
+    async def export(
+        self,
+        guild_id: int,
+        path: Union[str, Path],
+        *,
+        since: float = None,
+        until: float = None,
+        modules: Sequence[str] = (),
+        progress: ExportProgress = None
+    ) -> int:
+        # ensure the database and its schema exist before opening a second connection to it
+        await self._run(lambda: self.conn)
+        return await asyncio.get_event_loop().run_in_executor(
+            None,
+            self._export,
+            guild_id,
+            Path(path),
+            since,
+            until,
+            list(modules),
+            progress or ExportProgress(),
+        )
+
+    def _purge(self, guild_id: int, before: Optional[float]) -> int:
+        with self.conn as conn:
+            if before is None:
+                conn.execute("DELETE FROM entry_tokens WHERE guild_id = ?", (guild_id,))
+                cursor = conn.execute("DELETE FROM entries WHERE guild_id = ?", (guild_id,))
+            else:
+                conn.execute(
+                    "DELETE FROM entry_tokens WHERE guild_id = ? AND entry_id IN"
+                    " (SELECT id FROM entries WHERE guild_id = ? AND timestamp < ?)",
+                    (guild_id, guild_id, before),
+                )
+                cursor = conn.execute(
+                    "DELETE FROM entries WHERE guild_id = ? AND timestamp < ?", (guild_id, before)
+                )
+            return cursor.rowcount
+
+    async def purge(self, guild_id: int, before: float = None) -> int:
+        return await self._run(self._purge, guild_id, before)
+
+    def _guild_ids(self) -> List[int]:
+        return [x for x, in self.conn.execute("SELECT DISTINCT guild_id FROM entries")]
+
+    async def guild_ids(self) -> List[int]:
+        return await self._run(self._guild_ids)
+
+    def _compact(self) -> None:
+        self.conn.execute("PRAGMA incremental_vacuum")
+        self.conn.execute("PRAGMA optimize")
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    async def compact(self) -> None:
+        await self._run(self._compact)
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def close(self) -> None:
+        await self._run(self._close)
+        self._executor.shutdown(wait=False)
+
+
+class ArchiveWriter:
+    """Buffers archive records and writes them in batches from a background task"""
+
+    def __init__(self, archive: Archive):
+        self.archive = archive
+        self._buffer: List[ArchiveRecord] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"written": 0, "dropped": 0, "failed": 0}
+
+    def __repr__(self):
+        return "<ArchiveWriter archive={0.archive!r} pending={1}>".format(self, len(self._buffer))
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def put(self, record: ArchiveRecord) -> None:
+        """Queue a record to be written. This never blocks."""
+        if len(self._buffer) >= MAX_BUFFER:
+            self.stats["dropped"] += 1
+            return
+        self._buffer.append(record)
+        if len(self._buffer) >= BATCH_SIZE:
+            self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def _run(self):
+        try:
+            while self._buffer:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=FLUSH_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                await self.flush()
+        except asyncio.CancelledError:
+            pass
+
+    async def flush(self) -> None:
+        records, self._buffer = self._buffer, []
+        if not records:
+            return
+        try:
+            await self.archive.write(records)
+        except Exception as e:
+            self.stats["failed"] += len(records)
+            log.exception("Failed to write {} archive records".format(len(records)), exc_info=e)
+        else:
+            self.stats["written"] += len(records)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        await self.archive.close()
+
+
+def get_archive() -> Optional[ArchiveWriter]:
+    return _writer
+
+
+def open_archive(archive: Archive) -> ArchiveWriter:
+    global _writer
+    _writer = ArchiveWriter(archive)
+    return _writer
+
+
+def close_archive() -> None:
+    """Close the current archive, after writing any buffered records"""
+    global _writer
+    if _writer is not None:
+        asyncio.get_event_loop().create_task(_writer.close())
+        _writer = None
+
+
+async def apply_retention(archive: Archive, guilds: Dict[int, Dict[str, Any]]) -> int:
+    """Delete archived records that are past each guild's retention period
+
+    Every guild with archived records is checked, including those that no longer have any
+    settings stored, which use the default retention period. Guilds with a retention period
+    of 0 days keep their records forever. Returns the total amount of deleted records.
+    """
+    deleted = 0
+    now = time.time()
+    for guild_id in await archive.guild_ids():
+        days = guilds.get(guild_id, {}).get("archive", {}).get("retention", DEFAULT_RETENTION)
+        if not days:
+            continue
+        deleted += await archive.purge(guild_id, before=now - days * 86400)
+    if deleted:
+        await archive.compact()
+    return deleted
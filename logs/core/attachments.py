@@ -0,0 +1,350 @@
+import asyncio
+import re
+import shutil
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+import aiohttp
+import discord
+
+from logs.core.log import log
+
+__all__ = (
+    "AttachmentCache",
+    "CachedAttachment",
+    "close_attachment_cache",
+    "get_attachment_cache",
+    "open_attachment_cache",
+)
+
+# Attachments larger than this are never cached, as they couldn't be re-uploaded anyway
+MAX_FILE_SIZE = 8 * 1024 * 1024
+# Total size of the cache across every server, regardless of their individual budgets
+MAX_CACHE_SIZE = 2 * 1024 * 1024 * 1024
+# Default amount of megabytes each server may use, if it hasn't changed it
+DEFAULT_BUDGET = 50
+# Amount of concurrent downloads
+WORKERS = 4
+# Hard cap on the amount of attachments waiting to be downloaded; anything past this is skipped
+MAX_QUEUE = 500
+FETCH_TIMEOUT = 30
+# Size of the chunks attachments are read in while downloading them
+CHUNK_SIZE = 64 * 1024
+
+_cache: Optional["AttachmentCache"] = None
+_UNSAFE_RE = re.compile(r"[^\w.-]")
+
+
+class CachedAttachment:
+    """An attachment that was saved to disk"""
+
+    __slots__ = ("guild_id", "message_id", "filename", "path", "size")
+
+    def __init__(self, guild_id: int, message_id: int, filename: str, path: Path, size: int):
+        self.guild_id = guild_id
+        self.message_id = message_id
+        self.filename = filename
+        self.path = path
+        self.size = size
+
+    def __repr__(self):
+        return "<CachedAttachment message_id={0.message_id} filename={0.filename!r}>".format(self)
+
+
+class AttachmentCache:
+    """Bounded on-disk cache of recently posted attachments
+
+    Attachment URLs stop working as soon as their message is deleted, so attachments posted
+    in servers that opted in are downloaded in the background by a fixed pool of workers,
+    and can then be re-uploaded alongside deletion logs.
+
+    Attachments are kept per message in least recently used order. Each server has its own
+    byte budget, and the cache as a whole is capped at `max_size` bytes; once either is
+    exceeded, the least recently used messages are evicted first.
+
+    The index is only kept in memory. Each cache writes to its own directory under `path`,
+    which is removed when it's closed; anything else in `path` is left over from a previous
+    run, and is removed in the background when the cache is created.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        *,
+        workers: int = WORKERS,
+        max_size: int = MAX_CACHE_SIZE,
+        max_file_size: int = MAX_FILE_SIZE
+    ):
+        self.root = Path(path)
+        # a fresh directory per cache, so that a cache being created on reload can never
+        # clash with the previous one still removing its own files in the background
+        self.path = self.root / uuid.uuid4().hex
+        self.max_size = max_size
+        self.max_file_size = max_file_size
+        self.size = 0
+        # message_id -> attachments, in least recently used order
+        self._entries: "OrderedDict[int, List[CachedAttachment]]" = OrderedDict()
+        # the same order for each server, used for per-server eviction
+        self._guilds: Dict[int, "OrderedDict[int, None]"] = {}
+        self._usage: Dict[int, int] = {}
+        # message_id -> amount of its attachments that are queued or being downloaded
+        self._downloading: Dict[int, int] = {}
+        # messages that were popped or discarded while their attachments were still downloading
+        self._gone: Set[int] = set()
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=MAX_QUEUE)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._workers = [
+            asyncio.get_event_loop().create_task(self._worker()) for _ in range(workers)
+        ]
+        self.stats = {"fetched": 0, "failed": 0, "skipped": 0, "evicted": 0, "uploaded": 0}
+        self._cleanup = asyncio.get_event_loop().run_in_executor(None, self._remove_stale)
+
+    def __repr__(self):
+        return "<AttachmentCache messages={} size={}>".format(len(self), self.size)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, message_id: int):
+        return message_id in self._entries
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def usage(self, guild_id: int) -> int:
+        """Returns the amount of bytes the given server is using"""
+        return self._usage.get(guild_id, 0)
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=FETCH_TIMEOUT)
+            )
+        return self._session
+
+    def put(self, message: discord.Message, budget: int) -> int:
+        """Queue every attachment on the given message that fits in the budget to be downloaded
+
+        This never blocks; attachments are skipped if too many are already waiting.
+        Returns the amount of attachments that were queued.
+        """
+        queued = 0
+        for attachment in message.attachments:
+            if attachment.size > min(self.max_file_size, budget):
+                self.stats["skipped"] += 1
+                continue
+            try:
+                self._queue.put_nowait(
+                    (
+                        message.guild.id,
+                        message.id,
+                        attachment.id,
+                        attachment.filename,
+                        attachment.url,
+                        budget,
+                    )
+                )
+            except asyncio.QueueFull:
+                self.stats["skipped"] += 1
+            else:
+                queued += 1
+                self._downloading[message.id] = self._downloading.get(message.id, 0) + 1
+        return queued
+
+    async def _worker(self):
+        while True:
+            item = await self._queue.get()
+            try:
+                await self._fetch(*item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["failed"] += 1
+                log.debug("failed to cache attachment {!r}: {!r}".format(item[4], e))
+            finally:
+                self._queue.task_done()
+                self._downloaded(item[1])
+
+    def _downloaded(self, message_id: int) -> None:
+        remaining = self._downloading.pop(message_id, 1) - 1
+        if remaining:
+            self._downloading[message_id] = remaining
+        else:
+            self._gone.discard(message_id)
+
+    def _forget(self, message_id: int) -> None:
+        """Make sure attachments still being downloaded for a message are never stored"""
+        if message_id in self._downloading:
+            self._gone.add(message_id)
+
+    async def _fetch(
+        self,
+        guild_id: int,
+        message_id: int,
+        attachment_id: int,
+        filename: str,
+        url: str,
+        budget: int,
+    ) -> None:
+        async with self.session.get(url) as resp:
+            resp.raise_for_status()
+            if (resp.content_length or 0) > self.max_file_size:
+                self.stats["skipped"] += 1
+                return
+            # StreamReader.read(n) only returns whatever happens to be buffered, so the body
+            # has to be read chunk by chunk until it's done, or turns out to be too large
+            data = bytearray()
+            async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                data.extend(chunk)
+                if len(data) > self.max_file_size:
+                    self.stats["skipped"] += 1
+                    return
+        if message_id in self._gone:
+            return
+
+        path = (
+            self.path / str(guild_id) / "{}-{}".format(attachment_id, _UNSAFE_RE.sub("_", filename))
+        )
+        await asyncio.get_event_loop().run_in_executor(None, self._write, path, bytes(data))
+        if message_id in self._gone:
+            # the message was deleted while we were writing its attachment to disk
+            asyncio.get_event_loop().run_in_executor(None, self._unlink, [path])
+            return
+        self._entries.setdefault(message_id, []).append(
+            CachedAttachment(guild_id, message_id, filename, path, len(data))
+        )
+        self._guilds.setdefault(guild_id, OrderedDict())[message_id] = None
+        self._usage[guild_id] = self._usage.get(guild_id, 0) + len(data)
+        self.size += len(data)
+        self.stats["fetched"] += 1
+        self._evict(guild_id, budget)
+
+    def _remove_stale(self) -> None:
+        """Remove everything in our root directory other than our own files"""
+        try:
+            paths = list(self.root.iterdir())
+        except OSError:
+            return
+        for path in paths:
+            if path == self.path:
+                continue
+            if path.is_dir():
+                shutil.rmtree(str(path), ignore_errors=True)
+            else:
+                self._unlink([path])
+
+    @staticmethod
+    def _write(path: Path, data: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+    @staticmethod
+    def _unlink(paths: List[Path]) -> None:
+        for path in paths:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def _remove(self, message_id: int) -> List[CachedAttachment]:
+        attachments = self._entries.pop(message_id, [])
+        if attachments:
+            guild_id = attachments[0].guild_id
+            self._guilds[guild_id].pop(message_id, None)
+            if not self._guilds[guild_id]:
+                del self._guilds[guild_id]
+        for attachment in attachments:
+            self._usage[attachment.guild_id] -= attachment.size
+            if not self._usage[attachment.guild_id]:
+                del self._usage[attachment.guild_id]
+            self.size -= attachment.size
+        return attachments
+
+    def _evict(self, guild_id: int, budget: int) -> None:
+        """Evict the least recently used messages until we're within our limits"""
+        evicted: List[CachedAttachment] = []
+        while self.usage(guild_id) > budget:
+            evicted.extend(self._remove(next(iter(self._guilds[guild_id]))))
+        while self.size > self.max_size and self._entries:
+            evicted.extend(self._remove(next(iter(self._entries))))
+        if evicted:
+            self.stats["evicted"] += len(evicted)
+            asyncio.get_event_loop().run_in_executor(None, self._unlink, [x.path for x in evicted])
+
+    def touch(self, message_id: int) -> None:
+        """Mark a message's attachments as recently used"""
+        attachments = self._entries.get(message_id)
+        if attachments:
+            self._entries.move_to_end(message_id)
+            self._guilds[attachments[0].guild_id].move_to_end(message_id)
+
+    async def pop(self, message_id: int) -> List[Tuple[str, bytes]]:
+        """Remove a message's attachments from the cache, and return their names and contents
+
+        The cached copies are deleted from disk, as the message they belong to is gone.
+        """
+        self._forget(message_id)
+        attachments = self._remove(message_id)
+        if not attachments:
+            return []
+
+        def read() -> List[Tuple[str, bytes]]:
+            files = []
+            for attachment in attachments:
+                try:
+                    files.append((attachment.filename, attachment.path.read_bytes()))
+                except OSError:
+                    continue
+            self._unlink([x.path for x in attachments])
+            return files
+
+        files = await asyncio.get_event_loop().run_in_executor(None, read)
+        self.stats["uploaded"] += len(files)
+        return files
+
+    def discard(self, message_ids) -> None:
+        """Remove the attachments of the given messages without reading them"""
+        message_ids = list(message_ids)
+        for message_id in message_ids:
+            self._forget(message_id)
+        removed = [x.path for message_id in message_ids for x in self._remove(message_id)]
+        if removed:
+            asyncio.get_event_loop().run_in_executor(None, self._unlink, removed)
+
+    async def close(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await self._cleanup
+        if self._session is not None:
+            await self._session.close()
+        self._entries.clear()
+        self._guilds.clear()
+        self._usage.clear()
+        self._downloading.clear()
+        self._gone.clear()
+        self.size = 0
+        await asyncio.get_event_loop().run_in_executor(
+            None, lambda: shutil.rmtree(str(self.path), ignore_errors=True)
+        )
+
+
+def get_attachment_cache() -> Optional[AttachmentCache]:
+    return _cache
+
+
+def open_attachment_cache(path: Union[str, Path], **kwargs) -> AttachmentCache:
+    global _cache
+    _cache = AttachmentCache(path, **kwargs)
+    return _cache
+
+
+def close_attachment_cache() -> None:
+    """Stop downloading attachments, and remove everything that's currently cached"""
+    global _cache
+    if _cache is not None:
+        asyncio.get_event_loop().create_task(_cache.close())
+        _cache = None
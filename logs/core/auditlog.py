@@ -0,0 +1,174 @@
+import asyncio
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Deque, Dict, Optional
+
+import discord
+
+from logs.core.log import log
+
+__all__ = ("AuditLogCache", "get_audit_cache", "clear_audit_caches")
+
+# How long a fetch waits before being sent, to allow for other events to share it
+FETCH_DELAY = 1.0
+# Minimum time between fetches for a single guild; lookups that miss shortly after a fetch
+# wait for the next one, instead of each causing a request of their own
+FETCH_INTERVAL = 3.0
+# Discord may take a moment to write an audit log entry after dispatching the related event;
+# fetches started within this long after an event are not considered to cover it
+WRITE_DELAY = timedelta(seconds=0.5)
+# Entries may appear to be created slightly before the event they belong to, as their
+# timestamps come from Discord's clock rather than ours
+CLOCK_SKEW = timedelta(seconds=2)
+# Amount of entries retrieved per fetch; this is the maximum audit log page size
+FETCH_LIMIT = 100
+# Amount of entries kept per guild
+MAX_ENTRIES = 200
+
+_caches: Dict[int, "AuditLogCache"] = {}
+
+
+def get_audit_cache(guild: discord.Guild) -> "AuditLogCache":
+    cache = _caches.get(guild.id)
+    if cache is None:
+        cache = _caches[guild.id] = AuditLogCache(guild)
+    cache.guild = guild
+    return cache
+
+
+def clear_audit_caches() -> None:
+    for cache in _caches.values():
+        cache.cancel()
+    _caches.clear()
+
+
+class AuditLogCache:
+    """Shared per-guild audit log cache
+
+    Events that want to find their matching audit log entry all share a single audit log
+    request per short window, instead of each making their own request. As an example, a
+    burst of 50 role edits costs a single audit log request. Each guild is only fetched
+    at most once every `FETCH_INTERVAL` seconds, however many lookups miss in between.
+    """
+
+    def __init__(self, guild: discord.Guild):
+        self.guild = guild
+        self._entries: Deque[discord.AuditLogEntry] = deque(maxlen=MAX_ENTRIES)
+        # entry id -> the earliest the entry could have last been changed at; this is usually
+        # when it was created, but some entries (such as message deletions) are updated
+        # in-place when the same action is repeated, instead of new ones being created
+        self._changed: Dict[int, datetime] = {}
+        self._fetch: Optional[asyncio.Task] = None
+        # when the last completed fetch was sent
+        self._last_fetch = datetime.min
+        self.requests = 0
+
+    def __repr__(self):
+        return "<AuditLogCache guild={0.guild!r} entries={1} requests={0.requests}>".format(
+            self, len(self._entries)
+        )
+
+    @property
+    def can_view(self) -> bool:
+        me = getattr(self.guild, "me", None)
+        return me is not None and me.guild_permissions.view_audit_log
+
+    async def find(
+        self,
+        action: discord.AuditLogAction,
+        target_id: int,
+        *,
+        channel_id: int = None,
+        event_time: datetime = None
+    ) -> Optional[discord.AuditLogEntry]:
+        """Find the audit log entry for an action performed on the given target
+
+        Only entries created or updated at or after the event are returned, so that
+        an older action on the same target is never attributed to a newer event.
+
+        Parameters
+        -----------
+        action: discord.AuditLogAction
+            The audit log action to look for
+        target_id: int
+            The ID of the object the action was performed on
+        channel_id: int
+            If given, only entries with a matching `extra.channel` are returned.
+            This is used for message deletions, where the target is the message author.
+        event_time: datetime
+            A naive UTC timestamp of when the event was received.
+            Defaults to the current time.
+        """
+        if not self.can_view:
+            return None
+        if event_time is None:
+            event_time = datetime.utcnow()
+        since = event_time - CLOCK_SKEW
+
+        # a fetch that was already in flight when we started waiting on it may have been sent
+        # before the event, in which case a second one is needed to cover it
+        for _ in range(2):
+            entry = self._match(action, target_id, channel_id, since)
+            if entry is not None or self._last_fetch > event_time + WRITE_DELAY:
+                return entry
+            if self._fetch is None or self._fetch.done():
+                self._fetch = asyncio.get_event_loop().create_task(self._do_fetch())
+            try:
+                await asyncio.shield(self._fetch)
+            except discord.HTTPException:
+                return None
+        return self._match(action, target_id, channel_id, since)
+
+    def _match(
+        self,
+        action: discord.AuditLogAction,
+        target_id: int,
+        channel_id: Optional[int],
+        since: datetime,
+    ) -> Optional[discord.AuditLogEntry]:
+        # entries are stored newest first
+        for entry in self._entries:
+            if self._changed.get(entry.id, entry.created_at) < since:
+                continue
+            if entry.action != action or getattr(entry.target, "id", None) != target_id:
+                continue
+            if channel_id is not None:
+                if getattr(getattr(entry.extra, "channel", None), "id", None) != channel_id:
+                    continue
+            return entry
+        return None
+
+    async def _do_fetch(self):
+        wait = self._last_fetch + timedelta(seconds=FETCH_INTERVAL) - datetime.utcnow()
+        await asyncio.sleep(max(FETCH_DELAY, wait.total_seconds()))
+        previous, started = self._last_fetch, datetime.utcnow()
+        self.requests += 1
+        try:
+            fetched = await self.guild.audit_logs(limit=FETCH_LIMIT).flatten()
+        except discord.HTTPException as e:
+            log.debug("failed to fetch audit log for guild {}: {}".format(self.guild.id, e))
+            raise
+        finally:
+            self._last_fetch = started
+
+        # fetched entries replace any older copies we have of them; an entry whose count went
+        # up since we last saw it was updated at some point after our previous fetch
+        known = {x.id: x for x in self._entries}
+        for entry in fetched:
+            old = known.get(entry.id)
+            if old is not None and _count(old) != _count(entry):
+                self._changed[entry.id] = max(previous, entry.created_at)
+        fetched_ids = {x.id for x in fetched}
+        self._entries = deque(
+            fetched + [x for x in self._entries if x.id not in fetched_ids], maxlen=MAX_ENTRIES
+        )
+        kept = {x.id for x in self._entries}
+        self._changed = {k: v for k, v in self._changed.items() if k in kept}
+
+    def cancel(self) -> None:
+        if self._fetch is not None:
+            self._fetch.cancel()
+
+
+def _count(entry: discord.AuditLogEntry) -> Optional[int]:
+    return getattr(entry.extra, "count", None)
@@ -0,0 +1,129 @@
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from logs.core.log import log
+
+__all__ = ("COALESCED", "Coalescer", "describe_moves", "net_moves")
+
+
+class _Coalesced:
+    def __repr__(self):
+        return "COALESCED"
+
+
+# Returned by module parser functions for events that were handed off to a Coalescer,
+# as opposed to None for events that didn't produce anything to log
+COALESCED = _Coalesced()
+
+
+class Coalescer:
+    """Groups events by key over a short window, and hands each group to a callback
+
+    The window for a key starts when its first event is added, and the callback is called
+    once the window ends with every event that was added in the meantime.
+
+    Memory use is bounded; a key with `max_items` pending events is flushed immediately,
+    and adding a new key while `max_keys` keys are pending flushes the oldest one early.
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[Hashable, List[Any]], Awaitable[Any]],
+        *,
+        delay: float,
+        max_keys: int = 1000,
+        max_items: int = 50
+    ):
+        self.callback = callback
+        self.delay = delay
+        self.max_keys = max_keys
+        self.max_items = max_items
+        self._pending: Dict[Hashable, List[Any]] = OrderedDict()
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def __repr__(self):
+        return "<Coalescer delay={0.delay!r} pending={1}>".format(self, len(self))
+
+    def __len__(self):
+        return len(self._pending)
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return asyncio.get_event_loop()
+
+    def add(self, key: Hashable, item: Any) -> None:
+        items = self._pending.get(key)
+        if items is None:
+            if len(self._pending) >= self.max_keys:
+                self.flush(next(iter(self._pending)))
+            items = self._pending[key] = []
+            self._timers[key] = self.loop.call_later(self.delay, self.flush, key)
+        items.append(item)
+        if len(items) >= self.max_items:
+            self.flush(key)
+
+    def flush(self, key: Hashable) -> Optional[asyncio.Task]:
+        """Immediately hand the pending events for the given key to the callback"""
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        items = self._pending.pop(key, None)
+        if not items:
+            return None
+        task = self.loop.create_task(self._call(key, items))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _call(self, key: Hashable, items: List[Any]):
+        try:
+            await self.callback(key, items)
+        except Exception as e:
+            log.exception("Failed to flush coalesced events for {!r}".format(key), exc_info=e)
+
+    def flush_all(self) -> List[asyncio.Task]:
+        """Immediately flush every pending key, returning the tasks running the callbacks"""
+        tasks = [self.flush(key) for key in list(self._pending.keys())]
+        return [x for x in tasks if x is not None]
+
+    def close(self) -> None:
+        """Drop every pending event without calling the callback"""
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        self._pending.clear()
+
+
+def net_moves(changes: List[Tuple[Any, Any]], attr: str) -> List[Tuple[Any, Any, Any]]:
+    """Reduce a series of (before, after) updates into the net change of an attribute
+
+    Returns a list of (item, first value, last value) tuples for every item where the
+    attribute's value actually changed, in the order each item was first seen. Items are
+    matched by their `id` attribute, and the most recent `after` object is returned for each.
+    """
+    moves: Dict[int, list] = OrderedDict()
+    for before, after in changes:
+        move = moves.get(after.id)
+        if move is None:
+            moves[after.id] = [after, getattr(before, attr), getattr(after, attr)]
+        else:
+            move[0], move[2] = after, getattr(after, attr)
+    return [tuple(x) for x in moves.values() if x[1] != x[2]]
+
+
+def describe_moves(moves: List[Tuple[Any, Any, Any]], *, max_length: int = 1900) -> str:
+    """Format the return value of `net_moves` with one line per moved item"""
+    lines = []
+    length = 0
+    for idx, (item, before, after) in enumerate(moves):
+        line = "{} \N{EM DASH} {} \N{RIGHTWARDS ARROW} {}".format(
+            getattr(item, "mention", item), before, after
+        )
+        if length + len(line) > max_length:
+            lines.append("... ({} more)".format(len(moves) - idx))
+            break
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)
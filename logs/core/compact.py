@@ -0,0 +1,88 @@
+import re
+from typing import List, Optional, Sequence
+
+import discord
+
+__all__ = ("clean_text", "mention_name", "pack_lines", "render_line")
+
+# Discord's message length limit, which each packed code block has to fit into
+MAX_MESSAGE_CHARS = 2000
+# Any single line longer than this is truncated
+MAX_LINE_CHARS = 300
+BLOCK_START = "```\n"
+BLOCK_END = "\n```"
+# The space left for lines in each code block message
+MAX_BLOCK_CHARS = MAX_MESSAGE_CHARS - len(BLOCK_START) - len(BLOCK_END)
+
+_MENTION_RE = re.compile(r"<(@[!&]?|#)(\d+)>")
+_FENCE_RE = re.compile(r"```\w*")
+
+
+def mention_name(guild: Optional[discord.Guild], kind: str, item_id: int) -> str:
+    """Resolve a mention into plain text, as mentions aren't rendered in code blocks
+
+    `kind` is the mention prefix, such as `@`, `@&` or `#`. Items that can't be found
+    are shown by their ID instead.
+    """
+    item = None
+    if guild is not None:
+        if kind == "#":
+            item = guild.get_channel(item_id)
+        elif kind == "@&":
+            item = guild.get_role(item_id)
+        else:
+            item = guild.get_member(item_id)
+    name = getattr(item, "display_name", None) or getattr(item, "name", None) or item_id
+    return "{}{}".format("#" if kind == "#" else "@", name)
+
+
+def clean_text(text: str, guild: Optional[discord.Guild] = None) -> str:
+    """Flatten Markdown text into a single line that's safe to put into a code block"""
+    text = _MENTION_RE.sub(lambda m: mention_name(guild, m.group(1), int(m.group(2))), text)
+    text = _FENCE_RE.sub("", text).replace("`", "'").replace("**", "")
+    return " ".join(text.split())
+
+
+def render_line(
+    entry: discord.Embed,
+    *,
+    icon: str,
+    guild: Optional[discord.Guild] = None,
+    summary: str = None,
+    exclude: Sequence[str] = ()
+) -> str:
+    """Render a log entry as a single line of text
+
+    The line starts with the entry's title and description, followed by every field that
+    isn't named in `exclude`. If a summary is given, it replaces the title and description.
+    """
+    if summary is not None:
+        parts = [summary]
+    else:
+        parts = [entry.author.name if entry.author else None, entry.description]
+    parts.extend("{}: {}".format(x.name, x.value) for x in entry.fields if x.name not in exclude)
+    if entry.footer and entry.footer.text:
+        parts.append(entry.footer.text)
+
+    line = "[{}] {} {}".format(
+        entry.timestamp.strftime("%H:%M") if entry.timestamp else "--:--",
+        icon,
+        " \N{MIDDLE DOT} ".join(clean_text(str(x), guild) for x in parts if x),
+    )
+    if len(line) > MAX_LINE_CHARS:
+        line = line[: MAX_LINE_CHARS - 1] + "\N{HORIZONTAL ELLIPSIS}"
+    return line
+
+
+def pack_lines(lines: List[str], *, limit: int = MAX_BLOCK_CHARS) -> List[str]:
+    """Pack lines into as few code block messages as possible, keeping their order"""
+    messages, current, size = [], [], 0
+    for line in lines:
+        if current and size + len(line) + 1 > limit:
+            messages.append(BLOCK_START + "\n".join(current) + BLOCK_END)
+            current, size = [], 0
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        messages.append(BLOCK_START + "\n".join(current) + BLOCK_END)
+    return messages
@@ -6,10 +6,19 @@ from redbot.core import Config
 from logs.core.log import log
 
 root_defaults = {
-    "ignore": {"channels": [], "members": [], "roles": [], "member_roles": [], "guild": False}
+    "ignore": {"channels": [], "members": [], "roles": [], "member_roles": [], "guild": False},
+    # retention is the amount of days archived log entries are kept for; 0 keeps them forever
+    "archive": {"enabled": False, "retention": 30},
+    # budget is the amount of megabytes of attachments that are cached for deletion logs
+    "attachments": {"enabled": False, "budget": 50},
 }
 
 config = Config.get_conf(None, cog_name="Logs", identifier=2401248235421)
+config.register_global(
+    workers=4,
+    # see logs.core.ratelimit
+    rate_limit={"guild_rate": 10.0, "guild_burst": 100, "module_rate": 5.0, "module_burst": 50},
+)
 
 
 def rebuild_defaults() -> None:
@@ -23,7 +32,7 @@ def rebuild_defaults() -> None:
         if mod.config_scope not in defaults:
             defaults[mod.config_scope] = deepcopy(root_defaults)
 
-        mod_defaults = {**mod.defaults, "_log_channel": None}
+        mod_defaults = {**mod.defaults, "_log_channel": None, "_webhook": None, "_compact": False}
         defaults[mod.config_scope][mod.name] = mod_defaults
 
     for scope, values in defaults.items():
@@ -0,0 +1,438 @@
+import asyncio
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import discord
+
+from logs.core import stats
+from logs.core.archive import ArchiveRecord, get_archive
+from logs.core.compact import MAX_BLOCK_CHARS, pack_lines
+from logs.core.i18n import i18n
+from logs.core.log import log
+from logs.core.logentry import LogEntry
+from logs.core.webhooks import is_dead, send_webhook
+
+__all__ = (
+    "Batcher",
+    "LineBatcher",
+    "SummaryEntry",
+    "get_batcher",
+    "close_batchers",
+    "delivery_stats",
+    "embed_size",
+)
+
+# Discord's limits for the amount of embeds in a single message, and the total character
+# count of every embed contained in said message
+MAX_EMBEDS = 10
+MAX_EMBED_CHARS = 6000
+# How long entries are held before being sent, if a batch doesn't fill up before then
+FLUSH_INTERVAL = 1.5
+# How long entries are held back for audit log lookups to finish before they're sent without them
+AUDIT_TIMEOUT = 5.0
+# Once this many entries are waiting to be sent to a single destination, all pending entries
+# are collapsed into summaries of how many entries of each kind were suppressed
+HIGH_WATER = 50
+# Hard cap on the amount of pending entries per destination; anything past this is dropped
+MAX_PENDING = 100
+# The same limits for destinations using the compact text format, which fits far more
+# entries into a single message
+LINE_HIGH_WATER = 200
+LINE_MAX_PENDING = 400
+
+_batchers: Dict[Tuple[int, Optional[str], bool], "Batcher"] = {}
+
+
+def embed_size(embed: discord.Embed) -> int:
+    """Count the characters in an embed that count towards Discord's total embed size limit"""
+    data = embed.to_dict()
+    size = len(data.get("title", "")) + len(data.get("description", ""))
+    size += len(data.get("footer", {}).get("text", ""))
+    size += len(data.get("author", {}).get("name", ""))
+    for field in data.get("fields", []):
+        size += len(field.get("name", "")) + len(field.get("value", ""))
+    return size
+
+
+def get_batcher(
+    channel: discord.TextChannel, webhook: str = None, *, compact: bool = False
+) -> "Batcher":
+    """Get the batcher for the given destination
+
+    If a webhook URL is given, entries are sent through that webhook whenever possible.
+    If `compact` is True, entries are sent in the compact text format instead of as embeds.
+    """
+    key = (channel.id, webhook, compact)
+    batcher = _batchers.get(key)
+    if batcher is None:
+        batcher = _batchers[key] = (LineBatcher if compact else Batcher)(channel, webhook)
+    else:
+        # ensure we don't keep holding onto a stale channel object
+        batcher.channel = channel
+    return batcher
+
+
+def close_batchers() -> List[asyncio.Task]:
+    """Stop all destination workers, and schedule a final flush of any pending entries
+
+    The returned tasks complete once every final flush is done.
+    """
+    tasks = [batcher.close() for batcher in _batchers.values()]
+    _batchers.clear()
+    return [x for x in tasks if x is not None]
+
+
+def delivery_stats() -> Dict[str, int]:
+    """Returns the combined counters of every destination queue"""
+    totals = {"destinations": len(_batchers), "pending": 0}
+    for batcher in _batchers.values():
+        totals["pending"] += len(batcher)
+        for key, value in batcher.stats.items():
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+class SummaryEntry(LogEntry):
+    """Placeholder entry for log entries that were suppressed due to a destination overload"""
+
+    def __init__(self, module, event: str, channel_id: Optional[int]):
+        super().__init__(module, colour=discord.Colour.orange(), require_fields=False)
+        self.event = event
+        self.channel_id = channel_id
+        self.count = 0
+        self.set_author(name=i18n("Log Entries Suppressed"), icon_url=module.icon_uri())
+
+    def add(self, amount: int = 1) -> None:
+        self.count += amount
+        if self.channel_id is not None:
+            self.description = i18n(
+                "**{count}** {module} {event} entries in <#{channel}> were suppressed "
+                "due to a high volume of events"
+            )
+        else:
+            self.description = i18n(
+                "**{count}** {module} {event} entries were suppressed "
+                "due to a high volume of events"
+            )
+        self.description = self.description.format(
+            count=self.count,
+            module=self.module.friendly_name.lower(),
+            event=str(self.event).replace("_", " "),
+            channel=self.channel_id,
+        )
+
+
+class Batcher:
+    """Per-destination log entry queue
+
+    Entries are sent by a background worker either when a batch is full or after a short
+    delay, and are always sent in the order they were given.
+
+    The queue is bounded; once it passes `HIGH_WATER` entries, everything that's waiting
+    to be sent is collapsed into a summary entry per module, event and channel.
+
+    If the destination has a webhook, each batch is packed into a single message of up to
+    10 embeds within Discord's total embed size limit, and sent through it. Bot accounts
+    can only send one embed per message, so batches are otherwise sent one entry at a time,
+    which is also what's done if the webhook send fails. Without a webhook, there's nothing
+    to be gained from waiting for a batch to fill up, so entries are sent right away.
+    """
+
+    high_water = HIGH_WATER
+    max_pending = MAX_PENDING
+
+    def __init__(self, channel: discord.TextChannel, webhook: str = None):
+        self.channel = channel
+        self.webhook = webhook
+        self._pending: Deque[LogEntry] = deque()
+        self._summaries: Dict[Tuple[str, str, Optional[int]], SummaryEntry] = OrderedDict()
+        self._wakeup = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        self.stats = {
+            "queued": 0,
+            "sent": 0,
+            "webhook": 0,
+            "failed": 0,
+            "summarized": 0,
+            "dropped": 0,
+        }
+
+    def __repr__(self):
+        return "<Batcher channel={0.channel!r} pending={1}>".format(self, len(self))
+
+    def __len__(self):
+        return len(self._pending)
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return asyncio.get_event_loop()
+
+    @property
+    def is_full(self) -> bool:
+        return len(self._pending) >= MAX_EMBEDS
+
+    @property
+    def packs_batches(self) -> bool:
+        """If holding entries back for a batch to fill up lets them share a message"""
+        return bool(self.webhook) and not is_dead(self.webhook)
+
+    @property
+    def overloaded(self) -> bool:
+        return len(self._pending) >= self.high_water
+
+    def put(self, entry: LogEntry) -> None:
+        """Queue a log entry to be sent
+
+        This never blocks; if the destination is backed up, the entry may instead be
+        collapsed into a summary, or dropped entirely.
+        """
+        if self.overloaded:
+            self._summarize()
+        if len(self._pending) >= self.max_pending:
+            self.stats["dropped"] += 1
+            stats.incr(entry.module.name, entry.event, "dropped")
+            return
+
+        self._pending.append(entry)
+        self.stats["queued"] += 1
+        self._wakeup.set()
+        if self._worker is None or self._worker.done():
+            self._worker = self.loop.create_task(self._run())
+
+    def _summarize(self) -> None:
+        """Collapse all pending entries into summaries"""
+        pending, self._pending = self._pending, deque()
+        for entry in pending:
+            # entries with attachments are kept, as they can't be reproduced in a summary
+            if isinstance(entry, SummaryEntry) or entry.attachments:
+                self._pending.append(entry)
+                continue
+            key = (entry.module.name, entry.event, entry.channel_id)
+            summary = self._summaries.get(key)
+            if summary is None:
+                summary = self._summaries[key] = SummaryEntry(
+                    entry.module, entry.event, entry.channel_id
+                )
+                self._pending.append(summary)
+            summary.add()
+            self.stats["summarized"] += 1
+            stats.incr(entry.module.name, entry.event, "summarized")
+        log.debug(
+            "destination {!r} is overloaded; collapsed {} pending entries into {}".format(
+                self.channel, len(pending), len(self._pending)
+            )
+        )
+
+    def _take_batch(self) -> List[LogEntry]:
+        batch, size = [], 0
+        while self._pending:
+            entry = self._pending[0]
+            entry_size = embed_size(entry)
+            if batch and (
+                len(batch) >= MAX_EMBEDS or size + entry_size > MAX_EMBED_CHARS or entry.attachments
+            ):
+                break
+            batch.append(self._pending.popleft())
+            size += entry_size
+            if isinstance(entry, SummaryEntry):
+                # no further entries can be merged into this summary once it's been sent
+                self._summaries.pop((entry.module.name, entry.event, entry.channel_id), None)
+            elif entry.attachments:
+                # entries with attachments are always sent on their own
+                break
+        return batch
+
+    async def _run(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                if self.packs_batches and not self.is_full:
+                    await asyncio.sleep(FLUSH_INTERVAL)
+                await self.flush()
+                if not self._pending:
+                    self._wakeup.clear()
+                    return
+        except asyncio.CancelledError:
+            pass
+
+    async def flush(self) -> None:
+        """Send all currently pending entries"""
+        while self._pending:
+            # audit log lookups can still add fields to entries, which changes how they're
+            # batched; they're all waited on together, as they usually share the same request
+            await asyncio.gather(*(x.resolve(AUDIT_TIMEOUT) for x in list(self._pending)))
+            if not self._pending:
+                break
+            batch = self._take_batch()
+            with stats.timed("send"):
+                await self._send(batch)
+
+    async def _send_webhook(self, batch: List[LogEntry]) -> bool:
+        """Attempt to send a batch through the destination's webhook"""
+        me = self.channel.guild.me
+        try:
+            await send_webhook(
+                self.webhook,
+                batch,
+                files=[f for entry in batch for f in await entry.make_files()],
+                username=me.display_name,
+                avatar_url=str(me.avatar_url_as(format="png")),
+            )
+        except discord.HTTPException as e:
+            log.debug(
+                "webhook send to {!r} failed ({}); sending normally".format(self.channel, e.status)
+            )
+            return False
+        except Exception:
+            log.exception("Unexpected error sending to the webhook for {!r}".format(self.channel))
+            return False
+        self._sent(batch)
+        self.stats["webhook"] += len(batch)
+        return True
+
+    async def _send(self, batch: List[LogEntry]) -> None:
+        if self.webhook and not is_dead(self.webhook):
+            if await self._send_webhook(batch):
+                return
+        for idx, entry in enumerate(batch):
+            try:
+                await entry.send(self.channel)
+            except discord.HTTPException as e:
+                self._log_failure(e, [entry])
+                if isinstance(e, (discord.Forbidden, discord.NotFound)):
+                    self._failed(batch[idx + 1 :])
+                    return
+            except Exception:
+                # a single broken entry shouldn't take every other pending entry down with it
+                log.exception("Failed to send log entry to {!r}".format(self.channel))
+                self._failed([entry])
+            else:
+                self._sent([entry])
+
+    def _sent(self, entries: List[LogEntry]) -> None:
+        self.stats["sent"] += len(entries)
+        stats.record_entries(entries, "sent")
+        # entries are only archived once they've actually made it to their log channel,
+        # so anything that was dropped, summarized or failed to send isn't searchable later
+        archive = get_archive()
+        if archive is not None:
+            for entry in entries:
+                if entry.archive_guild_id is not None:
+                    archive.put(ArchiveRecord.from_entry(entry, entry.archive_guild_id))
+
+    def _failed(self, entries: List[LogEntry]) -> None:
+        self.stats["failed"] += len(entries)
+        stats.record_entries(entries, "failed")
+
+    def _log_failure(self, e: discord.HTTPException, entries: List[LogEntry]):
+        self._failed(entries)
+        if isinstance(e, discord.Forbidden):
+            log.warning(
+                "Encountered forbidden error while logging to {!r}: {}".format(self.channel, e.text)
+            )
+        elif e.status == 400:
+            log.exception("Failed to send log entry to {!r}".format(self.channel), exc_info=e)
+
+    def close(self) -> Optional[asyncio.Task]:
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        if self._pending:
+            return self.loop.create_task(self.flush())
+        return None
+
+
+class LineBatcher(Batcher):
+    """Per-destination queue for log entries using the compact text format
+
+    Each entry is rendered as a single line by its module's `compact_line`, and lines are
+    packed into code block messages of up to 2000 characters instead of being sent as embeds.
+    Batches are sent once they fill a message, or after the same short delay as `Batcher`.
+    """
+
+    high_water = LINE_HIGH_WATER
+    max_pending = LINE_MAX_PENDING
+
+    @staticmethod
+    def render(entry: LogEntry) -> str:
+        return entry.module.compact_line(entry)
+
+    @property
+    def packs_batches(self) -> bool:
+        # lines are packed into shared messages whether or not they're sent through a webhook
+        return True
+
+    @property
+    def is_full(self) -> bool:
+        size = 0
+        for entry in self._pending:
+            size += len(self.render(entry)) + 1
+            if size >= MAX_BLOCK_CHARS:
+                return True
+        return False
+
+    def _take_batch(self) -> List[LogEntry]:
+        batch, size = [], 0
+        while self._pending:
+            entry = self._pending[0]
+            line_size = len(self.render(entry)) + 1
+            if batch and (size + line_size > MAX_BLOCK_CHARS or entry.attachments):
+                break
+            batch.append(self._pending.popleft())
+            size += line_size
+            if isinstance(entry, SummaryEntry):
+                self._summaries.pop((entry.module.name, entry.event, entry.channel_id), None)
+            elif entry.attachments:
+                break
+        return batch
+
+    async def _send(self, batch: List[LogEntry]) -> None:
+        # lines are only ever split over multiple messages if one batch somehow overflows
+        # a single message, in which case any files are sent alongside the last message
+        messages = pack_lines([self.render(x) for x in batch])
+        via_webhook = True
+        for idx, content in enumerate(messages):
+            last = idx == len(messages) - 1
+            try:
+                via_webhook &= await self._send_content(content, batch if last else [])
+            except discord.HTTPException as e:
+                self._log_failure(e, batch)
+                return
+            except Exception:
+                log.exception("Failed to send log entries to {!r}".format(self.channel))
+                self._failed(batch)
+                return
+        self._sent(batch)
+        if via_webhook:
+            self.stats["webhook"] += len(batch)
+
+    async def _send_content(self, content: str, attach: List[LogEntry]) -> bool:
+        """Send a single message, returning True if it was sent through the webhook
+
+        Any files attached to the entries in `attach` are uploaded alongside it.
+        """
+        if self.webhook and not is_dead(self.webhook):
+            me = self.channel.guild.me
+            try:
+                await send_webhook(
+                    self.webhook,
+                    content=content,
+                    files=[f for entry in attach for f in await entry.make_files()],
+                    username=me.display_name,
+                    avatar_url=str(me.avatar_url_as(format="png")),
+                )
+            except discord.HTTPException as e:
+                log.debug(
+                    "webhook send to {!r} failed ({}); sending normally".format(
+                        self.channel, e.status
+                    )
+                )
+            except Exception:
+                log.exception(
+                    "Unexpected error sending to the webhook for {!r}".format(self.channel)
+                )
+            else:
+                return True
+        files = [f for entry in attach for f in await entry.make_files()]
+        await self.channel.send(content, files=files or None)
+        return False
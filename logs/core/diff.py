@@ -0,0 +1,239 @@
+"""Size-capped diff rendering for log entries
+
+Diffs are computed with Myers' O(ND) algorithm, after stripping any common prefix and
+suffix from the compared sequences. Since most edits are small, this is effectively
+linear for the content we deal with, and the edit distance is capped to avoid the
+worst case on completely rewritten content.
+"""
+
+import re
+from typing import List, Optional, Sequence, Tuple, Union
+
+__all__ = ("diff_opcodes", "render_diff", "tokenize")
+
+# Maximum edit distance searched for before giving up on producing a fine-grained diff;
+# this is counted in tokens, where replacing a word is two edits. A word diff of a long
+# message already fills an embed field with 10 to 20 changed words, and searching further
+# is where nearly all of the time spent on completely rewritten text goes
+MAX_EDITS = 100
+# Amount of unchanged words shown on either side of a change
+CONTEXT_WORDS = 4
+# Leaves room for the surrounding code block in a 1024 character embed field
+MAX_LENGTH = 1024 - len("```diff\n\n```")
+
+_TOKEN_RE = re.compile(r"\s+|\S+")
+
+Opcode = Tuple[str, int, int, int, int]
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into alternating word and whitespace tokens"""
+    return _TOKEN_RE.findall(text)
+
+
+def _myers(a: Sequence, b: Sequence, max_edits: int) -> Optional[List[Tuple[int, int, str]]]:
+    """Returns the edit path as (x, y, op) steps, or None if the edit limit is reached"""
+    n, m = len(a), len(b)
+    limit = min(n + m, max_edits)
+    offset = limit + 1
+    v = [0] * (2 * limit + 3)
+    trace = []
+
+    for d in range(limit + 1):
+        trace.append(list(v))
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, n, m, offset)
+    return None
+
+
+def _backtrack(trace: List[List[int]], x: int, y: int, offset: int) -> List[Tuple[int, int, str]]:
+    path = []
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[offset + prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            path.append((x, y, "equal"))
+        if d > 0:
+            if x == prev_x:
+                path.append((x, prev_y, "insert"))
+            else:
+                path.append((prev_x, y, "delete"))
+        x, y = prev_x, prev_y
+    path.reverse()
+    return path
+
+
+def diff_opcodes(a: Sequence, b: Sequence, max_edits: int = None) -> Optional[List[Opcode]]:
+    """Compute difflib-style opcodes between two sequences
+
+    Returns None if the sequences differ by more than `max_edits` insertions and deletions,
+    which defaults to `MAX_EDITS`.
+    """
+    if max_edits is None:
+        max_edits = MAX_EDITS
+    prefix = 0
+    while prefix < len(a) and prefix < len(b) and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while (
+        suffix < len(a) - prefix
+        and suffix < len(b) - prefix
+        and a[len(a) - suffix - 1] == b[len(b) - suffix - 1]
+    ):
+        suffix += 1
+
+    mid_a, mid_b = a[prefix : len(a) - suffix], b[prefix : len(b) - suffix]
+    path = _myers(mid_a, mid_b, max_edits)
+    if path is None:
+        return None
+
+    opcodes: List[Opcode] = []
+
+    def push(tag: str, i1: int, i2: int, j1: int, j2: int):
+        if opcodes and opcodes[-1][0] == tag:
+            _, pi1, _, pj1, _ = opcodes[-1]
+            opcodes[-1] = (tag, pi1, i2, pj1, j2)
+        else:
+            opcodes.append((tag, i1, i2, j1, j2))
+
+    if prefix:
+        push("equal", 0, prefix, 0, prefix)
+    for x, y, op in path:
+        x, y = x + prefix, y + prefix
+        if op == "equal":
+            push("equal", x, x + 1, y, y + 1)
+        elif op == "delete":
+            push("delete", x, x + 1, y, y)
+        else:
+            push("insert", x, x, y, y + 1)
+    if suffix:
+        push("equal", len(a) - suffix, len(a), len(b) - suffix, len(b))
+    return opcodes
+
+
+def _clean(text: str) -> str:
+    # keep each rendered change on a single line, and ensure nothing can break out of
+    # the code block the diff is rendered in
+    return re.sub(r"\s*\n\s*", " \N{RETURN SYMBOL} ", text).replace(
+        "`", "\N{MODIFIER LETTER GRAVE ACCENT}"
+    )
+
+
+def _hunk_line(sign: str, tokens: List[str], start: int, end: int) -> str:
+    return "{} {}{}{}".format(
+        sign,
+        "..." if start > 0 else "",
+        _clean("".join(tokens[start:end]).strip()),
+        "..." if end < len(tokens) else "",
+    )
+
+
+def _trim(lines: List[str], max_length: int) -> str:
+    """Join the given lines, dropping any that don't fit in `max_length` characters"""
+    built, length = [], 0
+    for idx, line in enumerate(lines):
+        remaining = len(lines) - idx
+        # always leave room to note how many lines were left out
+        reserved = len("\n... ({} more)".format(remaining)) if remaining > 1 else 0
+        if length + len(line) + reserved > max_length:
+            if len(line) > 40 and length + 40 + reserved < max_length:
+                built.append(line[: max_length - length - reserved - 3] + "...")
+                remaining -= 1
+            if remaining:
+                built.append("... ({} more)".format(remaining))
+            break
+        built.append(line)
+        length += len(line) + 1
+    return "\n".join(built)
+
+
+def _render_list(a: Sequence[str], b: Sequence[str], max_length: int) -> str:
+    removed = set(a) - set(b)
+    added = set(b) - set(a)
+    lines = ["- {}".format(_clean(str(x))) for x in a if x in removed]
+    lines += ["+ {}".format(_clean(str(x))) for x in b if x in added]
+    return _trim(lines, max_length)
+
+
+def _render_text(a: str, b: str, max_length: int) -> str:
+    ta, tb = tokenize(a), tokenize(b)
+    opcodes = diff_opcodes(ta, tb)
+    if opcodes is None:
+        # too many changes to be worth showing a word diff for; just show both versions
+        half = max_length // 2 - 4
+        before, after = _clean(a), _clean(b)
+        return "- {}\n+ {}".format(
+            before if len(before) <= half else before[: half - 3] + "...",
+            after if len(after) <= half else after[: half - 3] + "...",
+        )
+
+    # context is counted in tokens, and each word is followed by a whitespace token
+    context = CONTEXT_WORDS * 2
+    # each hunk is [i1, i2, j1, j2, has_deletions, has_insertions]; changes separated
+    # by less than twice the amount of context shown are merged into a single hunk
+    hunks: List[list] = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            continue
+        if hunks and i1 - hunks[-1][1] <= context * 2:
+            hunk = hunks[-1]
+            hunk[1], hunk[3] = i2, j2
+        else:
+            hunk = [i1, i2, j1, j2, False, False]
+            hunks.append(hunk)
+        hunk[4] = hunk[4] or tag == "delete"
+        hunk[5] = hunk[5] or tag == "insert"
+
+    lines = []
+    for i1, i2, j1, j2, deleted, inserted in hunks:
+        start_a, end_a = max(0, i1 - context), min(len(ta), i2 + context)
+        start_b, end_b = max(0, j1 - context), min(len(tb), j2 + context)
+        if deleted:
+            lines.append(_hunk_line("-", ta, start_a, end_a))
+        if inserted:
+            lines.append(_hunk_line("+", tb, start_b, end_b))
+    return _trim(lines, max_length)
+
+
+def render_diff(
+    before: Union[str, Sequence[str], None],
+    after: Union[str, Sequence[str], None],
+    *,
+    max_length: int = MAX_LENGTH
+) -> str:
+    """Render a compact diff between two strings or sequences of strings
+
+    Strings are compared at word granularity, and only the changed words and a small amount
+    of surrounding context are shown. Sequences, such as role lists, are compared by item.
+
+    The returned string is always at most `max_length` characters long, and is empty
+    if there are no changes.
+    """
+    before, after = before or "", after or ""
+    if before == after:
+        return ""
+    if isinstance(before, str) and isinstance(after, str):
+        return _render_text(before, after, max_length)
+    if isinstance(before, str):
+        before = before.splitlines()
+    if isinstance(after, str):
+        after = after.splitlines()
+    return _render_list(list(before), list(after), max_length)
@@ -1,37 +1,20 @@
+import asyncio
+import inspect
 from datetime import datetime
-from difflib import Differ, SequenceMatcher
-from typing import List, Any, Dict, Sequence, Callable
+import io
+from typing import List, Any, Awaitable, Dict, Optional, Sequence, Callable, Tuple, Union
 
 import discord
 
 from redbot.core.utils.chat_formatting import box
 
+from logs.core.diff import render_diff
 from logs.core.i18n import i18n
+from logs.core.log import log
 
 __all__ = ["LogEntry"]
 
 
-class SimpleDiffer(Differ):
-    """A variation of Differ without a fancy replace"""
-
-    def compare(self, a, b):
-        cruncher = SequenceMatcher(self.linejunk, a, b)
-        for tag, alo, ahi, blo, bhi in cruncher.get_opcodes():
-            if tag == "replace":
-                yield from self._dump("-", a, alo, ahi)
-                g = self._dump("+", b, blo, bhi)
-            elif tag == "delete":
-                g = self._dump("-", a, alo, ahi)
-            elif tag == "insert":
-                g = self._dump("+", b, blo, bhi)
-            elif tag == "equal":
-                g = self._dump(" ", a, alo, ahi)
-            else:
-                raise ValueError("unknown tag {!r}".format(tag))
-
-            yield from g
-
-
 def translate_common_types(var):
     if var is None:
         return i18n("None")
@@ -50,6 +33,18 @@ class LogEntry(discord.Embed):
         self.module: Module = module
         self.require_fields = kwargs.pop("require_fields", True)
         self.ignore_fields = kwargs.pop("ignore_fields", [])
+        # The following are filled in by Module.log if they aren't given here
+        self.event: Optional[str] = kwargs.pop("event", None)
+        self.channel_id: Optional[int] = kwargs.pop("channel_id", None)
+        self.member_id: Optional[int] = kwargs.pop("member_id", None)
+        # ID of the guild this entry is archived under once it's been sent, if the guild
+        # has archiving enabled; set by Module.dispatch
+        self.archive_guild_id: Optional[int] = None
+        # callables creating each file to upload alongside this entry; see make_files
+        self.attachments: List[Callable[[], discord.File]] = []
+        # audit log lookups started by add_audit_info which haven't been waited on yet,
+        # along with the name of the field their result is added as
+        self._audit: List[Tuple[asyncio.Future, Optional[str]]] = []
         kwargs["timestamp"] = kwargs.pop("timestamp", datetime.utcnow())
         super().__init__(**kwargs)
 
@@ -65,8 +60,78 @@ class LogEntry(discord.Embed):
     async def send(self, send_to: discord.abc.Messageable, **kwargs):
         if not self.is_valid:
             return
+        if self.attachments:
+            kwargs["files"] = await self.make_files()
         await send_to.send(embed=self, **kwargs)
 
+    def attach_file(self, filename: str, data: bytes):
+        """Attach a file to be uploaded alongside this entry"""
+        return self.attach_generated(lambda: discord.File(io.BytesIO(data), filename=filename))
+
+    def attach_generated(self, factory: Callable[[], discord.File]):
+        """Attach a file that's generated by the given callable whenever this entry is sent
+
+        The callable is run in a worker thread, and should return a new file every time.
+        """
+        self.attachments.append(factory)
+        return self
+
+    async def make_files(self) -> List[discord.File]:
+        """Create the files to upload alongside this entry
+
+        discord.py closes files once a send is done with them, even if it failed, so new
+        file objects have to be created for every attempt at sending this entry.
+        """
+        return await asyncio.get_event_loop().run_in_executor(
+            None, lambda: [factory() for factory in self.attachments]
+        )
+
+    def add_audit_info(
+        self,
+        entry: Union[Optional[discord.AuditLogEntry], Awaitable[Optional[discord.AuditLogEntry]]],
+        *,
+        name: str = None
+    ):
+        """Add a field noting who performed the action this entry is for
+
+        If given an awaitable, such as from `Module.audit_entry`, the lookup is left to
+        finish in the background, and the field is only added once `resolve` is called.
+        """
+        if inspect.isawaitable(entry):
+            self._audit.append((asyncio.ensure_future(entry), name))
+            return self
+        if entry is None or entry.user is None:
+            return self
+        value = "{user.mention} ({user.id})".format(user=entry.user)
+        if entry.reason:
+            value += "\n" + i18n("**Reason:** {}").format(entry.reason)
+        return self.add_field(name=name or i18n("Moderator"), value=value)
+
+    async def resolve(self, timeout: float = None) -> None:
+        """Wait for any audit log lookups started by `add_audit_info`, and add their results
+
+        Lookups that haven't finished after `timeout` seconds are given up on.
+        """
+        # lookups are only removed once they're handled, so that they aren't lost if this
+        # is cancelled, and concurrent calls both wait for them
+        pending = list(self._audit)
+        if not pending:
+            return
+        done, _ = await asyncio.wait([x for x, _ in pending], timeout=timeout)
+        for item in pending:
+            if item not in self._audit:
+                continue
+            self._audit.remove(item)
+            future, name = item
+            if future not in done:
+                future.cancel()
+            elif future.cancelled():
+                continue
+            elif future.exception() is not None:
+                log.exception("Failed to look up audit log entry", exc_info=future.exception())
+            else:
+                self.add_audit_info(future.result(), name=name)
+
     async def add_multiple_changed(self, before, after, checks: List[Dict[str, Any]]):
         for check in checks:
             values = check.pop("value").split(".")
@@ -122,17 +187,10 @@ class LogEntry(discord.Embed):
         diff: bool = False
     ):
         if diff:
-            if isinstance(before, str):
-                before = before.splitlines()
-            if isinstance(after, str):
-                after = after.splitlines()
-
-            changed = SimpleDiffer().compare(before, after)
+            changed = render_diff(before, after)
             if not changed:
                 return self
-            return self.add_field(
-                name=name, value=box("\n".join(changed), lang="diff"), inline=inline
-            )
+            return self.add_field(name=name, value=box(changed, lang="diff"), inline=inline)
 
         before, after = (translate_common_types(before), translate_common_types(after))
         if box_lang is not None:
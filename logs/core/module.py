@@ -1,20 +1,34 @@
+import asyncio
 import re
 from abc import ABC, abstractmethod
-from typing import Iterable, Optional, Union, MutableMapping
+from typing import Awaitable, Dict, Iterable, List, Optional, Sequence, Union, MutableMapping
 
 import discord
 from redbot.core import Config
 from redbot.core.bot import Red
 from redbot.core.config import Group, Value
+from redbot.core.data_manager import cog_data_path
 
 from cog_shared.swift_libs import flatten, flatten_values
 from logs.core.i18n import i18n
 from logs.core.logentry import LogEntry
 from logs.core.utils import add_descriptions, replace_dict_items
 from logs.core.config import config
-from logs.core.log import log
+from logs.core.archive import SQLiteArchive, close_archive, open_archive
+from logs.core.attachments import close_attachment_cache, open_attachment_cache
+from logs.core.auditlog import clear_audit_caches, get_audit_cache
+from logs.core.coalesce import COALESCED
+from logs.core.compact import render_line
+from logs.core.delivery import close_batchers, get_batcher
+from logs.core.msgstore import message_store
+from logs.core.pipeline import Pipeline, find_guild
+from logs.core.ratelimit import clear_throttles, get_throttle
+from logs.core import stats
+from logs.core.settings import GuildSettings, IgnoreMatcher, get_settings, invalidate
+from logs.core.webhooks import close_session, is_dead
 
 bot: Red = None
+pipeline: Optional[Pipeline] = None
 _TOGGLE_REGEX = re.compile("(?P<KEY>([a-z0-9]:?)+)=?(?P<VALUE>[a-z]+)?", re.IGNORECASE)
 
 
@@ -25,41 +39,71 @@ def get_module(module_id: str, *args, **kwargs) -> "Module":
 
 
 async def log_event(module: str, event: str, *args, use_guild: discord.Guild = None, **kwargs):
-    arguments = args + tuple(kwargs.values())
-    guild = use_guild
+    guild = use_guild or find_guild(*args, *kwargs.values())
     if guild is None:
-        for arg in arguments:
-            if isinstance(arg, discord.Guild):
-                guild = arg
-            else:
-                try:
-                    guild = getattr(arg, "guild")
-                except AttributeError:
-                    continue
-            break
-        if guild is None:
-            raise RuntimeError("could not extract a guild object from any of the arguments passed")
+        raise RuntimeError("could not extract a guild object from any of the arguments passed")
     return await get_module(module, guild).log(event, *args, **kwargs)
 
 
+def get_pipeline() -> Optional[Pipeline]:
+    return pipeline
+
+
+def submit_event(module: str, event: str, *args, **kwargs) -> bool:
+    """Submit an event to the ingestion pipeline to be logged by a worker
+
+    This should be used by listeners instead of awaiting `log_event` directly.
+    """
+    if pipeline is None:
+        return False
+    return pipeline.submit(module, event, *args, **kwargs)
+
+
 def load(red: Red):
     from logs import modules
 
-    global bot
+    global bot, pipeline
     bot = red
+    pipeline = Pipeline(log_event)
+    pipeline.start(red.loop)
+    open_archive(SQLiteArchive(cog_data_path(raw_name="Logs") / "archive.sqlite3"))
+    open_attachment_cache(cog_data_path(raw_name="Logs") / "attachments")
 
     for mod in modules.default_modules:
         modules.register(mod)
 
 
+async def _close_delivery(flushes: List[asyncio.Task]):
+    # the webhook session has to stay open until any final flushes are done with it
+    if flushes:
+        await asyncio.wait(flushes)
+    await close_session()
+
+
 def unload():
     from logs import modules
 
     for module in list(modules.modules.values()):
         modules.unregister(module)
 
-    global bot
+    global bot, pipeline
+    if pipeline is not None:
+        pipeline.stop()
+        pipeline = None
     bot = None
+    invalidate()
+    clear_audit_caches()
+    clear_throttles()
+    close_archive()
+    close_attachment_cache()
+    asyncio.get_event_loop().create_task(_close_delivery(close_batchers()))
+    message_store.clear()
+
+
+def _resolved(value) -> asyncio.Future:
+    future = asyncio.get_event_loop().create_future()
+    future.set_result(value)
+    return future
 
 
 # noinspection PyTypeChecker
@@ -120,6 +164,15 @@ class Module(ABC):
         """Descriptions of the module's config settings"""
         raise NotImplementedError
 
+    # Attributes that each update-style event compares between its `before` and `after`
+    # arguments, mapped to the config option that enables logging changes to them.
+    # This is used by `log` to skip events that can't produce any output before building
+    # a log entry; events not listed here are always passed to their parser function.
+    tracked_attributes: Dict[str, Dict[str, Sequence[str]]] = {}
+
+    # Icon shown at the start of every line in the compact text log format
+    compact_icon = "\N{MEMO}"
+
     @property
     def is_global(self) -> bool:
         return False
@@ -165,15 +218,98 @@ class Module(ABC):
             _opt = _opt.get_attr(opt)
         return _opt
 
+    async def guild_settings(self) -> Optional[GuildSettings]:
+        """Retrieve the current guild's settings snapshot
+
+        This returns None for global modules, which always read directly from Config.
+        """
+        if self.is_global:
+            return None
+        return await get_settings(self.guild)
+
+    def invalidate_settings(self) -> None:
+        """Drop the current guild's settings snapshot after a module settings change"""
+        if not self.is_global:
+            invalidate(self.guild, ignore=False)
+
     async def is_opt_enabled(self, *opts: str):
-        return await self.get_config_value(*opts)()
+        settings = await self.guild_settings()
+        if settings is None:
+            return await self.get_config_value(*opts)()
+        return settings.get(self.name, *opts)
 
     async def log_destination(self) -> Optional[discord.TextChannel]:
         """Retrieve the log channel that should be used for logging the current module"""
-        return self.bot.get_channel(await self.get_config_value("_log_channel")())
+        settings = await self.guild_settings()
+        if settings is None:
+            return self.bot.get_channel(await self.get_config_value("_log_channel")())
+        return self.bot.get_channel(settings.destination(self.name))
 
     async def set_destination(self, destination: Optional[discord.TextChannel] = None):
         await self.get_config_value("_log_channel").set(getattr(destination, "id", None))
+        self.invalidate_settings()
+
+    async def webhook_url(self) -> Optional[str]:
+        """Retrieve the webhook URL the current module sends log entries through, if any
+
+        Webhooks that have since been deleted are cleared from the module's settings,
+        and None is returned instead.
+        """
+        settings = await self.guild_settings()
+        if settings is None:
+            url = await self.get_config_value("_webhook")()
+        else:
+            url = settings.webhook(self.name)
+        if url is not None and is_dead(url):
+            await self.set_webhook(None)
+            return None
+        return url
+
+    async def set_webhook(self, url: Optional[str]):
+        await self.get_config_value("_webhook").set(url)
+        self.invalidate_settings()
+
+    async def uses_compact(self) -> bool:
+        """Check if the current module logs in the compact text format instead of with embeds"""
+        settings = await self.guild_settings()
+        if settings is None:
+            return await self.get_config_value("_compact")()
+        return settings.compact(self.name)
+
+    async def set_compact(self, toggle: bool):
+        await self.get_config_value("_compact").set(toggle)
+        self.invalidate_settings()
+
+    def compact_line(self, entry: LogEntry) -> str:
+        """Render a log entry as a single line for the compact text log format
+
+        Modules can override this to give a more concise summary of their own entries.
+        """
+        return render_line(entry, icon=self.compact_icon, guild=self.guild)
+
+    def audit_entry(
+        self, action: discord.AuditLogAction, target_id: int, *, channel_id: int = None
+    ) -> Awaitable[Optional[discord.AuditLogEntry]]:
+        """Find the audit log entry responsible for an event
+
+        Lookups share a cached per-guild audit log, which is only refreshed at most once
+        every short window. The lookup resolves to None if the bot can't view the guild's
+        audit log, or if no matching entry was found.
+
+        This doesn't wait for the lookup; pass the returned awaitable to
+        `LogEntry.add_audit_info`, which leaves it to finish while the entry is waiting
+        to be sent, instead of holding up the worker processing this event.
+        """
+        if self.is_global or self.guild is None:
+            return _resolved(None)
+        # entries are only matched if they're at least as new as the event that's being logged
+        record = pipeline.current() if pipeline is not None else None
+        return get_audit_cache(self.guild).find(
+            action,
+            target_id,
+            channel_id=channel_id,
+            event_time=record.received_at if record is not None else None,
+        )
 
     def icon_uri(self, member: discord.Member = None):
         """Helper function for embed icon_url fields"""
@@ -215,6 +351,8 @@ class Module(ABC):
             else:
                 await conf_val.set(val)
 
+        self.invalidate_settings()
+
     async def config_embed(self):
         """Get the current module's settings embed"""
         module_opts = {
@@ -264,7 +402,15 @@ class Module(ABC):
     async def log(self, fn_name: str, *args, **kwargs):
         """Attempt to log an event
 
-        All extra parameters are passed directly to
+        All extra parameters are passed directly to the module parser function.
+
+        Events are subject to per-server and per-module rate limits; once a server is over its
+        limit, only a sample of its events are passed to parser functions.
+
+        Any log entries returned are queued in the log destination's batcher, and as such
+        may not have been sent yet when this returns. This never waits on the destination;
+        if it's backed up, entries may be collapsed into summaries or dropped. Any HTTP errors
+        encountered while sending are logged instead of being raised.
 
         Parameters
         -----------
@@ -275,35 +421,151 @@ class Module(ABC):
         -------
         AttributeError
             Raised if no method from the value of `fn_name` exists on the current module
-        discord.HTTPException
-            An HTTP exception was encountered while trying to send the log event.
-            Currently only 400 errors are raised, and all others are swallowed.
         """
+        stats.incr(self.name, fn_name, "received")
+        with stats.timed("settings"):
+            await self.guild_settings()
         dest = await self.log_destination()
-        if dest is None or await self.is_ignored(*args, **kwargs):
+        if dest is None or not await self.can_log(fn_name, *args):
+            stats.incr(self.name, fn_name, "filtered")
+            return
+        if await self.is_ignored(*args, **kwargs):
+            stats.incr(self.name, fn_name, "ignored")
+            return
+        if not self.is_global and not get_throttle(self.guild).allow(self.name, self.guild):
+            stats.incr(self.name, fn_name, "throttled")
             return
 
-        data: Union[LogEntry, Iterable] = await discord.utils.maybe_coroutine(
-            getattr(self, fn_name), *args, **kwargs
+        with stats.timed("build"):
+            data: Union[LogEntry, Iterable] = await discord.utils.maybe_coroutine(
+                getattr(self, fn_name), *args, **kwargs
+            )
+        if data is COALESCED:
+            stats.incr(self.name, fn_name, "coalesced")
+            return
+        queued = await self.dispatch(
+            data, event=fn_name, args=args + tuple(kwargs.values()), destination=dest
         )
-        if not isinstance(data, Iterable):
-            data: Iterable[LogEntry] = [data]
+        if not queued:
+            stats.incr(self.name, fn_name, "filtered")
 
-        for embed in data:
-            if not embed:
+    async def log_coalesced(
+        self, entries: Union[LogEntry, Iterable[LogEntry], None], *, event: str, args: Sequence = ()
+    ) -> int:
+        """Log entries built from events that were coalesced by a parser function
+
+        The entries go through the same rate limit as those returned by parser functions,
+        and are counted under the given event. Returns the amount of entries that were queued.
+        """
+        if not self.is_global and not get_throttle(self.guild).allow(self.name, self.guild):
+            stats.incr(self.name, event, "throttled")
+            return 0
+        queued = await self.dispatch(entries, event=event, args=args)
+        if not queued:
+            stats.incr(self.name, event, "filtered")
+        return queued
+
+    async def dispatch(
+        self,
+        entries: Union[LogEntry, Iterable[LogEntry], None],
+        *,
+        event: str = None,
+        args: Sequence = (),
+        destination: discord.TextChannel = None
+    ) -> int:
+        """Queue already built log entries to be sent to the module's log destination
+
+        This is called by `log` with the return value of parser functions, and can also be
+        used for entries that are built outside of a parser function, such as entries
+        aggregated from multiple events.
+
+        Any entries that don't have their event, channel ID or member ID set have them
+        filled in from `event` and `args`. Returns the amount of entries that were queued.
+        """
+        if destination is None:
+            destination = await self.log_destination()
+            if destination is None:
+                return 0
+        if not isinstance(entries, Iterable):
+            entries: Iterable[LogEntry] = [entries]
+
+        batcher = get_batcher(
+            destination, await self.webhook_url(), compact=await self.uses_compact()
+        )
+        settings = await self.guild_settings()
+        archive = settings is not None and settings.archive.get("enabled", False)
+        channel_id = member_id = None
+        queued = 0
+        for embed in entries:
+            if not embed or not embed.is_valid:
+                continue
+            if embed.event is None:
+                embed.event = event
+            if embed.channel_id is None:
+                if channel_id is None:
+                    channel_id = self.event_channel_id(*args)
+                embed.channel_id = channel_id
+            if embed.member_id is None:
+                if member_id is None:
+                    member_id = self.event_member_id(*args)
+                embed.member_id = member_id
+            if archive:
+                embed.archive_guild_id = self.guild.id
+            batcher.put(embed)
+            queued += 1
+        return queued
+
+    async def can_log(self, fn_name: str, *args) -> bool:
+        """Cheaply check if the given event could produce any log output
+
+        This only considers events declared in `tracked_attributes`, and returns True
+        if any tracked attribute that has its option enabled differs between the first
+        two arguments given.
+        """
+        tracked = self.tracked_attributes.get(fn_name)
+        if not tracked or len(args) < 2:
+            return True
+        settings = await self.guild_settings()
+        before, after = args[:2]
+        for attr, opt in tracked.items():
+            if settings is not None and not settings.get(self.name, *opt):
                 continue
-            try:
-                await embed.send(dest)
-            except discord.HTTPException as e:
-                if e.status in (400,):
-                    raise
-
-                if isinstance(e, discord.Forbidden):
-                    log.warning(
-                        "Encountered forbidden error while logging result of {}.{}: {}".format(
-                            self.__class__.__name__, fn_name, dest, e.text
-                        )
-                    )
+            if getattr(before, attr, None) != getattr(after, attr, None):
+                return True
+        return False
+
+    def changed_attributes(self, fn_name: str, before, after) -> List[str]:
+        """Returns the attributes tracked for the given event that differ between objects"""
+        return [
+            attr
+            for attr in self.tracked_attributes.get(fn_name, {})
+            if getattr(before, attr, None) != getattr(after, attr, None)
+        ]
+
+    @staticmethod
+    def event_channel_id(*args) -> Optional[int]:
+        """Returns the ID of the first channel found in the given event arguments"""
+        for arg in args:
+            if isinstance(arg, discord.abc.GuildChannel):
+                return arg.id
+            channel = getattr(arg, "channel", None)
+            if isinstance(channel, discord.abc.GuildChannel):
+                return channel.id
+        return None
+
+    @staticmethod
+    def event_member_id(*args) -> Optional[int]:
+        """Returns the ID of the first member or user found in the given event arguments"""
+        for arg in args:
+            if isinstance(arg, discord.abc.User):
+                return arg.id
+            author = getattr(arg, "author", None)
+            if isinstance(author, discord.abc.User):
+                return author.id
+            author_id = getattr(arg, "author_id", None)
+            if author_id is not None:
+                return author_id
+        return None
 
     async def is_ignored(self, *args, **kwargs) -> list:
         """Checks if the current guild, or any arguments passed, are set to be ignored from logging.
@@ -314,34 +576,12 @@ class Module(ABC):
         and not the items passed.
         """
         args = args + tuple(kwargs.values())
-        if not self.is_global and await self.root_config.ignore.guild():
+        settings = await self.guild_settings()
+        if settings is None:
+            matcher = IgnoreMatcher(await self.root_config.ignore.all())
+        else:
+            matcher = settings.matcher
+        if not self.is_global and matcher.guild:
             return [self.guild]
 
-        ignored = []
-        for x in args:
-            if await self._check(x):
-                ignored.append(x)
-        return ignored
-
-    async def _check(self, item) -> bool:
-        if isinstance(item, discord.Member):
-            ignore_roles = await self.root_config.ignore.member_roles()
-            return any(
-                [
-                    item.bot,
-                    item.id in await self.root_config.ignore.members(),
-                    *[x.id in ignore_roles for x in item.roles],
-                ]
-            )
-        elif isinstance(item, discord.abc.GuildChannel):
-            ignore = await self.root_config.ignore.channels()
-            # noinspection PyUnresolvedReferences
-            return any([item.id in ignore, getattr(item.category, "id", None) in ignore])
-        elif isinstance(item, discord.Role):
-            return item.id in await self.root_config.ignore.roles()
-        elif isinstance(item, discord.VoiceState):
-            return getattr(item.channel, "id", None) in await self.root_config.ignore.channels()
-        elif isinstance(item, discord.Message):
-            return any([await self._check(item.author), await self._check(item.channel)])
-
-        return False
+        return [x for x in args if matcher.matches(x)]
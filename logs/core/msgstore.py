@@ -0,0 +1,162 @@
+import json
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import discord
+
+__all__ = ("StoredMessage", "MessageStore", "message_store")
+
+# Total amount of bytes the store may hold across all channels
+MAX_BYTES = 8 * 1024 * 1024
+# Amount of messages kept per channel
+MAX_PER_CHANNEL = 1000
+# Payloads smaller than this aren't worth compressing
+COMPRESS_THRESHOLD = 96
+
+
+class StoredMessage:
+    """Lightweight copy of the data we log about a message"""
+
+    __slots__ = ("id", "channel_id", "author_id", "content", "attachments")
+
+    def __init__(
+        self,
+        id: int,
+        channel_id: int,
+        author_id: int,
+        content: str,
+        attachments: List[Tuple[str, str]],
+    ):
+        self.id = id
+        self.channel_id = channel_id
+        self.author_id = author_id
+        self.content = content
+        # list of (filename, url) pairs
+        self.attachments = attachments
+
+    def __repr__(self):
+        return "<StoredMessage id={0.id} channel_id={0.channel_id} author_id={0.author_id}>".format(
+            self
+        )
+
+    @property
+    def created_at(self) -> datetime:
+        return discord.utils.snowflake_time(self.id)
+
+    @classmethod
+    def from_message(cls, message: discord.Message) -> "StoredMessage":
+        return cls(
+            id=message.id,
+            channel_id=message.channel.id,
+            author_id=message.author.id,
+            content=message.content,
+            attachments=[(x.filename, x.url) for x in message.attachments],
+        )
+
+    def pack(self) -> bytes:
+        payload = json.dumps(
+            [self.author_id, self.content, self.attachments], separators=(",", ":")
+        ).encode()
+        if len(payload) < COMPRESS_THRESHOLD:
+            return b"r" + payload
+        return b"z" + zlib.compress(payload)
+
+    @classmethod
+    def unpack(cls, message_id: int, channel_id: int, data: bytes) -> "StoredMessage":
+        payload = data[1:] if data[:1] == b"r" else zlib.decompress(data[1:])
+        author_id, content, attachments = json.loads(payload.decode())
+        return cls(
+            id=message_id,
+            channel_id=channel_id,
+            author_id=author_id,
+            content=content,
+            attachments=[tuple(x) for x in attachments],
+        )
+
+
+class MessageStore:
+    """Bounded store of recent message content
+
+    This allows logging deletions of messages that have fallen out of discord.py's
+    message cache, without holding onto full Message objects. Messages are kept in
+    a ring buffer per channel, and the oldest messages across every channel are evicted
+    first once the store exceeds its total byte budget.
+    """
+
+    def __init__(self, max_bytes: int = MAX_BYTES, max_per_channel: int = MAX_PER_CHANNEL):
+        self.max_bytes = max_bytes
+        self.max_per_channel = max_per_channel
+        self.size = 0
+        self._channels: Dict[int, "OrderedDict[int, bytes]"] = {}
+        # global insertion order of message_id -> channel_id, used for eviction
+        self._order: "OrderedDict[int, int]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._order)
+
+    def __contains__(self, message_id: int):
+        return message_id in self._order
+
+    def __repr__(self):
+        return "<MessageStore messages={} channels={} size={}>".format(
+            len(self), len(self._channels), self.size
+        )
+
+    def add(self, message: discord.Message) -> None:
+        """Store the given message, or update it if it's already stored"""
+        channel = self._channels.setdefault(message.channel.id, OrderedDict())
+        if message.id in channel:
+            self.size -= len(channel[message.id])
+        data = channel[message.id] = StoredMessage.from_message(message).pack()
+        self._order[message.id] = message.channel.id
+        self.size += len(data)
+
+        while len(channel) > self.max_per_channel:
+            self._evict(next(iter(channel)), message.channel.id)
+        while self.size > self.max_bytes and self._order:
+            message_id, channel_id = next(iter(self._order.items()))
+            self._evict(message_id, channel_id)
+
+    def update(self, message: discord.Message) -> None:
+        """Update the stored content of a message if it's currently stored"""
+        if message.id in self._order:
+            self.add(message)
+
+    def _evict(self, message_id: int, channel_id: int) -> None:
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            return
+        data = channel.pop(message_id, None)
+        if not channel:
+            del self._channels[channel_id]
+        self._order.pop(message_id, None)
+        if data is not None:
+            self.size -= len(data)
+
+    def get(self, message_id: int) -> Optional[StoredMessage]:
+        channel_id = self._order.get(message_id)
+        if channel_id is None:
+            return None
+        return StoredMessage.unpack(message_id, channel_id, self._channels[channel_id][message_id])
+
+    def pop(self, message_id: int) -> Optional[StoredMessage]:
+        """Retrieve and remove a message from the store"""
+        message = self.get(message_id)
+        if message is not None:
+            self._evict(message_id, message.channel_id)
+        return message
+
+    def pop_many(self, message_ids: Iterable[int]) -> List[StoredMessage]:
+        """Retrieve and remove all of the given messages that are stored, sorted by age"""
+        messages = [self.pop(x) for x in sorted(message_ids)]
+        return [x for x in messages if x is not None]
+
+    def clear(self) -> None:
+        self._channels.clear()
+        self._order.clear()
+        self.size = 0
+
+
+message_store = MessageStore()
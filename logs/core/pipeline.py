@@ -0,0 +1,210 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import discord
+
+from logs.core.log import log
+
+__all__ = ("EventRecord", "Pipeline", "find_guild")
+
+# Default amount of workers events are processed by
+DEFAULT_WORKERS = 4
+# Maximum amount of events waiting to be processed, split evenly across all workers
+MAX_PENDING = 2000
+# Smoothing factor used for the average queue wait time
+_EMA_ALPHA = 0.05
+
+try:
+    _current_task = asyncio.current_task
+except AttributeError:  # Python 3.6
+    _current_task = asyncio.Task.current_task
+
+
+def find_guild(*args) -> Optional[discord.Guild]:
+    """Extract a guild object from the given event arguments"""
+    for arg in args:
+        if isinstance(arg, discord.Guild):
+            return arg
+        guild = getattr(arg, "guild", None)
+        if guild is not None:
+            return guild
+    return None
+
+
+class EventRecord:
+    """A received listener event that's waiting to be processed"""
+
+    __slots__ = ("module", "event", "args", "kwargs", "guild", "received", "received_at")
+
+    def __init__(self, module: str, event: str, args: tuple, kwargs: dict, guild: discord.Guild):
+        self.module = module
+        self.event = event
+        self.args = args
+        self.kwargs = kwargs
+        self.guild = guild
+        self.received = time.monotonic()
+        # wall clock time, for comparing against timestamps from Discord
+        self.received_at = datetime.utcnow()
+
+    def __repr__(self):
+        return "<EventRecord module={0.module!r} event={0.event!r} guild={0.guild!r}>".format(self)
+
+
+class Pipeline:
+    """Event ingestion pipeline
+
+    Listeners only submit lightweight event records, which are then processed by a fixed
+    pool of workers. Each guild is always handled by the same worker, which guarantees that
+    events from a single guild are processed in the order they were received.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[..., Awaitable[Any]],
+        *,
+        workers: int = DEFAULT_WORKERS,
+        max_pending: int = MAX_PENDING
+    ):
+        self.handler = handler
+        self.max_pending = max_pending
+        self._workers = max(1, workers)
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        # the event each worker is currently processing
+        self._current: Dict[asyncio.Task, EventRecord] = {}
+        self.stats: Dict[str, float] = {
+            "submitted": 0,
+            "processed": 0,
+            "dropped": 0,
+            "errors": 0,
+            "avg_wait": 0.0,
+            "max_wait": 0.0,
+        }
+
+    def __repr__(self):
+        return "<Pipeline workers={} pending={}>".format(self.workers, self.pending)
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    @property
+    def pending(self) -> int:
+        return sum(x.qsize() for x in self._queues)
+
+    def start(
+        self, loop: asyncio.AbstractEventLoop = None, *, after: List[asyncio.Task] = None
+    ) -> None:
+        """Start the workers
+
+        If `after` is given, the workers only start processing events once every task
+        in it is done.
+        """
+        if self.running:
+            return
+        loop = loop or asyncio.get_event_loop()
+        maxsize = max(1, self.max_pending // self._workers)
+        self._queues = [asyncio.Queue(maxsize=maxsize) for _ in range(self._workers)]
+        self._tasks = [loop.create_task(self._worker(queue, after)) for queue in self._queues]
+        log.debug("started event pipeline with {} workers".format(self._workers))
+
+    def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._queues = []
+
+    async def resize(self, workers: int) -> None:
+        """Change the amount of workers
+
+        Any events waiting to be processed are moved over to the new workers' queues,
+        and the old workers exit after finishing the event they're currently processing.
+        A guild may end up on a different worker, so the new workers hold off until every
+        old worker has exited, to keep events from overtaking one that's still in progress.
+        """
+        workers = max(1, workers)
+        if workers == self._workers and self.running:
+            return
+        old, old_tasks = self._queues, self._tasks
+        self._tasks, self._queues = [], []
+        self._workers = workers
+        self.start(after=old_tasks)
+        for queue in old:
+            while not queue.empty():
+                record = queue.get_nowait()
+                try:
+                    self._queue_for(record.guild).put_nowait(record)
+                except asyncio.QueueFull:
+                    self.stats["dropped"] += 1
+            # let the old workers finish whatever event they're currently processing
+            queue.put_nowait(None)
+
+    def current(self) -> Optional[EventRecord]:
+        """Returns the event being processed by the calling worker, if called from one"""
+        return self._current.get(_current_task())
+
+    def _queue_for(self, guild: discord.Guild) -> asyncio.Queue:
+        return self._queues[guild.id % len(self._queues)]
+
+    def submit(self, module: str, event: str, *args, **kwargs) -> bool:
+        """Submit an event to be logged
+
+        Returns False if the event was dropped, either due to the pipeline not running,
+        the event not having an associated guild, or the guild's worker being backed up.
+        """
+        guild = kwargs.pop("use_guild", None) or find_guild(*args, *kwargs.values())
+        if guild is None or not self.running:
+            return False
+        queue = self._queue_for(guild)
+        if queue.full():
+            self.stats["dropped"] += 1
+            return False
+        queue.put_nowait(EventRecord(module, event, args, kwargs, guild))
+        self.stats["submitted"] += 1
+        return True
+
+    async def _worker(self, queue: asyncio.Queue, after: List[asyncio.Task] = None):
+        task = _current_task()
+        if after:
+            await asyncio.wait(after)
+        while True:
+            record: Optional[EventRecord] = await queue.get()
+            if record is None:
+                return
+            wait = time.monotonic() - record.received
+            self.stats["avg_wait"] += (wait - self.stats["avg_wait"]) * _EMA_ALPHA
+            self.stats["max_wait"] = max(self.stats["max_wait"], wait)
+            self._current[task] = record
+            try:
+                await self.handler(
+                    record.module,
+                    record.event,
+                    *record.args,
+                    use_guild=record.guild,
+                    **record.kwargs
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["errors"] += 1
+                log.exception("Failed to log event {!r}".format(record), exc_info=e)
+            finally:
+                self._current.pop(task, None)
+                self.stats["processed"] += 1
+
+    def lag(self) -> float:
+        """Returns how long in seconds the oldest pending event has been waiting for"""
+        now = time.monotonic()
+        oldest = 0.0
+        for queue in self._queues:
+            # noinspection PyProtectedMember,PyUnresolvedReferences
+            items = getattr(queue, "_queue", None)
+            if items:
+                oldest = max(oldest, now - items[0].received)
+        return oldest
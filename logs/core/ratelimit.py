@@ -0,0 +1,239 @@
+import asyncio
+import math
+import time
+from typing import Dict, List, Optional
+
+import discord
+
+from logs.core.i18n import i18n
+from logs.core.log import log
+from logs.core.logentry import LogEntry
+
+__all__ = (
+    "TokenBucket",
+    "GuildThrottle",
+    "clear_throttles",
+    "configure_limits",
+    "get_throttle",
+    "throttled_guilds",
+)
+
+# How often servers over their rate limit are sent a summary of the events that weren't shown
+SUMMARY_INTERVAL = 60.0
+# Sampling never lets through more than one in this many events once a server is throttled
+MIN_SAMPLE_EVERY = 2
+
+# Events per second, and the amount of events that can be logged in a burst, allowed per server
+# and per module in each server; these are replaced by `configure_limits` on cog load
+limits = {"guild_rate": 10.0, "guild_burst": 100, "module_rate": 5.0, "module_burst": 50}
+
+_throttles: Dict[int, "GuildThrottle"] = {}
+# Idle throttles are only pruned once this many exist, so the cost of pruning is amortized
+_prune_at = 1000
+
+
+class TokenBucket:
+    """Token bucket that refills at a constant rate, up to its capacity"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def __repr__(self):
+        return "<TokenBucket rate={0.rate!r} capacity={0.capacity!r} tokens={0.tokens:.1f}>".format(
+            self
+        )
+
+    def refill(self, now: float) -> float:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    @property
+    def is_full(self) -> bool:
+        return self.refill(time.monotonic()) >= self.capacity
+
+
+class GuildThrottle:
+    """Rate limit state for a single server
+
+    Every logged event takes a token from both the server's bucket and its module's bucket.
+    Once either is empty, the server is throttled, and only a sample of its events are logged;
+    the sample rate adapts to how far over its rate limit the server is. Every module that had
+    events suppressed is sent a summary of how many weren't shown once per `SUMMARY_INTERVAL`.
+    """
+
+    def __init__(self, guild: discord.Guild):
+        self.guild = guild
+        self.bucket = TokenBucket(limits["guild_rate"], limits["guild_burst"])
+        self.modules: Dict[str, TokenBucket] = {}
+        # Events suppressed per module since the last summary
+        self.suppressed: Dict[str, int] = {}
+        self.throttled_since: Optional[float] = None
+        self.sample_every = MIN_SAMPLE_EVERY
+        self.stats = {"allowed": 0, "sampled": 0, "suppressed": 0}
+        self._skipped = 0
+        self._window_start = time.monotonic()
+        self._window_events = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def __repr__(self):
+        return "<GuildThrottle guild={0.guild!r} throttled={0.throttled!r}>".format(self)
+
+    @property
+    def throttled(self) -> bool:
+        return self.throttled_since is not None
+
+    @property
+    def is_idle(self) -> bool:
+        return (
+            not self.throttled
+            and self.bucket.is_full
+            and all(x.is_full for x in self.modules.values())
+        )
+
+    def _module_bucket(self, module: str) -> TokenBucket:
+        bucket = self.modules.get(module)
+        if bucket is None:
+            bucket = self.modules[module] = TokenBucket(
+                limits["module_rate"], limits["module_burst"]
+            )
+        return bucket
+
+    def allow(self, module: str, guild: discord.Guild = None) -> bool:
+        """Check if an event for the given module should be logged, and consume its tokens"""
+        if guild is not None:
+            # avoid holding onto a stale guild object for summaries
+            self.guild = guild
+        now = time.monotonic()
+        self._window_events += 1
+        bucket = self._module_bucket(module)
+        if self.bucket.refill(now) >= 1 and bucket.refill(now) >= 1:
+            self.bucket.tokens -= 1
+            bucket.tokens -= 1
+            self.stats["allowed"] += 1
+            return True
+
+        if self.throttled_since is None:
+            self.throttled_since = now
+            # only measure how far over the limit we are from the point we went over it
+            self._window_start, self._window_events = now, 1
+            log.debug("{!r} exceeded its log rate limit; sampling events".format(self.guild))
+        if self._timer is None:
+            self._timer = asyncio.get_event_loop().call_later(SUMMARY_INTERVAL, self._summarize)
+
+        # log every nth event, where n is how many times over its rate limit the server is
+        observed = self._window_events / max(1.0, now - self._window_start)
+        rate = min(self.bucket.rate, bucket.rate)
+        self.sample_every = max(MIN_SAMPLE_EVERY, math.ceil(observed / rate))
+        self._skipped += 1
+        if self._skipped >= self.sample_every:
+            self._skipped = 0
+            self.stats["sampled"] += 1
+            return True
+        self.suppressed[module] = self.suppressed.get(module, 0) + 1
+        self.stats["suppressed"] += 1
+        return False
+
+    def _summarize(self) -> None:
+        self._timer = None
+        self._window_start = time.monotonic()
+        self._window_events = 0
+        suppressed, self.suppressed = self.suppressed, {}
+        if not suppressed:
+            # nothing was suppressed over an entire interval, so we're no longer throttled
+            log.debug("{!r} is no longer over its log rate limit".format(self.guild))
+            self.throttled_since = None
+            self.sample_every = MIN_SAMPLE_EVERY
+            return
+        self._timer = asyncio.get_event_loop().call_later(SUMMARY_INTERVAL, self._summarize)
+        for module, count in suppressed.items():
+            asyncio.get_event_loop().create_task(self._send_summary(module, count))
+
+    async def _send_summary(self, module_name: str, count: int) -> None:
+        from logs.core.module import get_module
+
+        try:
+            module = get_module(module_name, self.guild)
+        except KeyError:
+            # the module was unregistered in the meantime
+            return
+        entry = LogEntry(
+            module,
+            colour=discord.Colour.orange(),
+            require_fields=False,
+            description=i18n(
+                "**{count}** {module} events were not shown in the last {seconds} seconds, "
+                "as this server is over its log rate limit. Only about one in every {every} "
+                "events is being logged until activity slows down."
+            ).format(
+                count=count,
+                module=module.friendly_name.lower(),
+                seconds=int(SUMMARY_INTERVAL),
+                every=self.sample_every,
+            ),
+        ).set_author(name=i18n("Log Entries Not Shown"), icon_url=module.icon_uri())
+        try:
+            await module.dispatch(entry, event="throttled")
+        except Exception as e:
+            log.exception("Failed to send rate limit summary", exc_info=e)
+
+    def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+def get_throttle(guild: discord.Guild) -> GuildThrottle:
+    """Get the rate limit state for the given server"""
+    global _prune_at
+    throttle = _throttles.get(guild.id)
+    if throttle is None:
+        if len(_throttles) >= _prune_at:
+            # a throttle with full buckets is no different from a fresh one
+            for guild_id in [k for k, v in _throttles.items() if v.is_idle]:
+                del _throttles[guild_id]
+            _prune_at = max(1000, len(_throttles) * 2)
+        throttle = _throttles[guild.id] = GuildThrottle(guild)
+    return throttle
+
+
+def throttled_guilds() -> List[GuildThrottle]:
+    """Returns every server that's currently over its log rate limit, most suppressed first"""
+    return sorted(
+        (x for x in _throttles.values() if x.throttled),
+        key=lambda x: x.stats["suppressed"],
+        reverse=True,
+    )
+
+
+def configure_limits(
+    *,
+    guild_rate: float = None,
+    guild_burst: int = None,
+    module_rate: float = None,
+    module_burst: int = None
+) -> None:
+    """Change the rate limits applied to every server
+
+    Any existing rate limit state is dropped, and rebuilt with the new limits on demand.
+    """
+    for key, value in (
+        ("guild_rate", guild_rate),
+        ("guild_burst", guild_burst),
+        ("module_rate", module_rate),
+        ("module_burst", module_burst),
+    ):
+        if value is not None:
+            limits[key] = value
+    clear_throttles()
+
+
+def clear_throttles() -> None:
+    for throttle in _throttles.values():
+        throttle.close()
+    _throttles.clear()
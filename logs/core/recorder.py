@@ -0,0 +1,244 @@
+"""Listener event recorder
+
+Records the arguments of every listener event the cog receives as compact JSONL, which can
+then be replayed offline with `python -m logs.replay`. Only the attributes the cog actually
+uses are kept, but recordings still contain message content and member names, and should be
+handled as carefully as the logs themselves.
+"""
+
+import asyncio
+import functools
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, List, Optional, Union
+
+import discord
+from discord.raw_models import RawBulkMessageDeleteEvent, RawMessageDeleteEvent
+
+from logs.core.log import log
+
+__all__ = (
+    "EventRecorder",
+    "get_recorder",
+    "recorded",
+    "serialize",
+    "start_recording",
+    "stop_recording",
+)
+
+# How often buffered events are written to disk
+FLUSH_INTERVAL = 5.0
+# Buffered events are written immediately once this many are waiting
+FLUSH_SIZE = 1000
+
+_recorder: Optional["EventRecorder"] = None
+
+
+def _timestamp(dt: Optional[datetime]) -> Optional[float]:
+    # discord.py returns naive UTC datetimes, which `datetime.timestamp` would treat as local
+    return None if dt is None else (dt - datetime(1970, 1, 1)).total_seconds()
+
+
+def _id(obj) -> Optional[int]:
+    return getattr(obj, "id", None)
+
+
+def serialize(obj) -> Any:
+    """Convert a listener event argument into a JSON serializable value"""
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return [serialize(x) for x in obj]
+    if isinstance(obj, discord.Member):
+        return {
+            "type": "member",
+            "id": obj.id,
+            "guild": obj.guild.id,
+            "name": obj.name,
+            "discriminator": obj.discriminator,
+            "nick": obj.nick,
+            "bot": obj.bot,
+            "avatar": obj.avatar,
+            "roles": [x.id for x in obj.roles if not x.is_default()],
+            "joined_at": _timestamp(obj.joined_at),
+            "created_at": _timestamp(obj.created_at),
+        }
+    if isinstance(obj, discord.abc.User):
+        return {
+            "type": "user",
+            "id": obj.id,
+            "name": obj.name,
+            "discriminator": obj.discriminator,
+            "bot": obj.bot,
+            "avatar": obj.avatar,
+            "created_at": _timestamp(obj.created_at),
+        }
+    if isinstance(obj, discord.Message):
+        return {
+            "type": "message",
+            "id": obj.id,
+            "guild": _id(obj.guild),
+            "channel": obj.channel.id,
+            "author": serialize(obj.author),
+            "content": obj.content,
+            "attachments": [[x.filename, x.url] for x in obj.attachments],
+            "created_at": _timestamp(obj.created_at),
+        }
+    if isinstance(obj, discord.Role):
+        return {
+            "type": "role",
+            "id": obj.id,
+            "guild": obj.guild.id,
+            "name": obj.name,
+            "position": obj.position,
+            "colour": obj.colour.value,
+            "permissions": obj.permissions.value,
+            "hoist": obj.hoist,
+            "mentionable": obj.mentionable,
+        }
+    if isinstance(obj, discord.abc.GuildChannel):
+        return {
+            "type": "channel",
+            "kind": type(obj).__name__,
+            "id": obj.id,
+            "guild": obj.guild.id,
+            "name": obj.name,
+            "position": obj.position,
+            "category": getattr(obj, "category_id", None),
+            "topic": getattr(obj, "topic", None),
+            "bitrate": getattr(obj, "bitrate", None),
+            "user_limit": getattr(obj, "user_limit", None),
+        }
+    if isinstance(obj, discord.VoiceState):
+        return {
+            "type": "voice_state",
+            "channel": _id(obj.channel),
+            "self_mute": obj.self_mute,
+            "self_deaf": obj.self_deaf,
+            "mute": obj.mute,
+            "deaf": obj.deaf,
+        }
+    if isinstance(obj, discord.Guild):
+        return {
+            "type": "guild",
+            "id": obj.id,
+            "name": obj.name,
+            "owner": obj.owner_id,
+            "mfa_level": obj.mfa_level,
+            "afk_channel": _id(obj.afk_channel),
+            "afk_timeout": obj.afk_timeout,
+            "region": str(obj.region),
+            "explicit_content_filter": str(obj.explicit_content_filter),
+            "unavailable": obj.unavailable,
+        }
+    if isinstance(obj, RawMessageDeleteEvent):
+        return {
+            "type": "raw_delete",
+            "id": obj.message_id,
+            "channel": obj.channel_id,
+            "cached": serialize(obj.cached_message),
+        }
+    if isinstance(obj, RawBulkMessageDeleteEvent):
+        return {"type": "raw_bulk_delete", "ids": list(obj.message_ids), "channel": obj.channel_id}
+    return {"type": "unknown", "repr": repr(obj)}
+
+
+class EventRecorder:
+    """Buffers serialized listener events, and appends them to a JSONL file"""
+
+    def __init__(self, path: Union[str, Path], *, limit: int = None):
+        self.path = Path(path)
+        self.limit = limit
+        self.count = 0
+        self.started = time.monotonic()
+        self._buffer: List[str] = []
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def __repr__(self):
+        return "<EventRecorder path={!r} count={}>".format(str(self.path), self.count)
+
+    @property
+    def done(self) -> bool:
+        return self.limit is not None and self.count >= self.limit
+
+    def record(self, event: str, *args) -> None:
+        if self.done:
+            return
+        self._buffer.append(
+            json.dumps(
+                {
+                    "t": round(time.monotonic() - self.started, 4),
+                    "e": event,
+                    "a": [serialize(x) for x in args],
+                },
+                separators=(",", ":"),
+            )
+        )
+        self.count += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_event_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        started = time.monotonic()
+        while (
+            len(self._buffer) < FLUSH_SIZE
+            and not self.done
+            and time.monotonic() - started < FLUSH_INTERVAL
+        ):
+            await asyncio.sleep(0.1)
+        await self.flush()
+
+    def _write(self, lines: List[str]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    async def flush(self) -> None:
+        async with self._lock:
+            lines, self._buffer = self._buffer, []
+            if lines:
+                await asyncio.get_event_loop().run_in_executor(None, self._write, lines)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        await self.flush()
+
+
+def get_recorder() -> Optional[EventRecorder]:
+    return _recorder
+
+
+def start_recording(path: Union[str, Path], *, limit: int = None) -> EventRecorder:
+    global _recorder
+    _recorder = EventRecorder(path, limit=limit)
+    log.info("Recording listener events to {}".format(path))
+    return _recorder
+
+
+async def stop_recording() -> Optional[EventRecorder]:
+    """Stop the current recording, and return the recorder that was used for it"""
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is not None:
+        await recorder.close()
+    return recorder
+
+
+def recorded(func):
+    """Record every call to the decorated listener while a recording is running"""
+    event = func.__name__[3:] if func.__name__.startswith("on_") else func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(self, *args):
+        if _recorder is not None:
+            try:
+                _recorder.record(event, *args)
+            except Exception as e:
+                log.exception("Failed to record event {}".format(event), exc_info=e)
+        return await func(self, *args)
+
+    return wrapper
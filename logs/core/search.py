@@ -0,0 +1,127 @@
+import re
+import time
+from typing import Dict, List, Optional, Sequence
+
+from cog_shared.swift_libs import FutureTime
+
+from logs.core.archive import Archive, ArchiveRecord, index_tokens
+
+__all__ = ("SearchQuery", "SearchPages", "parse_query", "parse_time")
+
+# Matches either a `key:value` filter, a quoted phrase, or a single bare word.
+# Filter values may also be quoted, such as `member:"some member"`.
+_QUERY_RE = re.compile(
+    r'(?P<key>\w+):(?:"(?P<qvalue>[^"]*)"|(?P<value>\S+))|"(?P<phrase>[^"]*)"|(?P<word>\S+)'
+)
+FILTER_KEYS = ("member", "module", "event", "since", "until")
+
+
+class SearchQuery:
+    """Parsed log search query
+
+    Filter values are kept as the raw strings that were given, with the exception of
+    `since` and `until`, which are converted to UNIX timestamps.
+    """
+
+    def __init__(self):
+        self.member: Optional[str] = None
+        self.module: Optional[str] = None
+        self.event: Optional[str] = None
+        self.since: Optional[float] = None
+        self.until: Optional[float] = None
+        self.words: List[str] = []
+        self.phrases: List[str] = []
+
+    def __repr__(self):
+        return (
+            "<SearchQuery member={0.member!r} module={0.module!r} event={0.event!r} "
+            "since={0.since!r} until={0.until!r} words={0.words!r} phrases={0.phrases!r}>"
+        ).format(self)
+
+    def __bool__(self):
+        return any(
+            [self.member, self.module, self.event, self.since, self.until, self.words, self.phrases]
+        )
+
+
+def parse_time(value: str) -> float:
+    """Convert a relative duration, such as `3d`, into a UNIX timestamp that far in the past"""
+    seconds = FutureTime.get_seconds(value)
+    if seconds is None:
+        raise ValueError(value)
+    return time.time() - seconds
+
+
+def parse_query(text: str) -> SearchQuery:
+    """Parse a search query string
+
+    Raises
+    -------
+    ValueError
+        Raised if a `since` or `until` filter has an invalid duration
+    """
+    query = SearchQuery()
+    for match in _QUERY_RE.finditer(text):
+        key = (match.group("key") or "").lower()
+        if key in FILTER_KEYS:
+            value = match.group("qvalue") if match.group("value") is None else match.group("value")
+            if key in ("since", "until"):
+                setattr(query, key, parse_time(value))
+            elif key in ("module", "event"):
+                setattr(query, key, value.lower())
+            else:
+                setattr(query, key, value)
+            continue
+
+        # anything that isn't a known filter is treated as a plain search term
+        term = match.group("phrase") if match.group("phrase") is not None else match.group(0)
+        tokens = index_tokens(term)
+        query.words.extend(x for x in tokens if x not in query.words)
+        # quoted phrases and terms with punctuation are also checked as literal substrings,
+        # as the token index only tells us which words an entry contains
+        if term.strip() and tokens != {term.lower()}:
+            query.phrases.append(term)
+    return query
+
+
+class SearchPages(Sequence):
+    """Lazily loaded search result pages for use with PaginatedMenu
+
+    Pages are retrieved with keyset pagination as they're requested, and this sequence only
+    ever reports one more page than has been loaded so far, until the last page is reached.
+    """
+
+    def __init__(self, archive: Archive, guild_id: int, *, per_page: int = 10, **filters):
+        self.archive = archive
+        self.guild_id = guild_id
+        self.per_page = per_page
+        self.filters = filters
+        # the `before_id` cursor for each page; the first page has no cursor
+        self._cursors: List[Optional[int]] = [None]
+        self._pages: Dict[int, List[ArchiveRecord]] = {}
+        self.exhausted = False
+
+    def __len__(self):
+        return len(self._cursors)
+
+    def __getitem__(self, item: int) -> int:
+        # the menu converter is expected to call `fetch` with the returned page index
+        if not 0 <= item < len(self._cursors):
+            raise IndexError(item)
+        return item
+
+    async def fetch(self, page: int) -> List[ArchiveRecord]:
+        if page in self._pages:
+            return self._pages[page]
+        # one extra result is requested to know if there's another page after this one
+        results = await self.archive.query(
+            self.guild_id, before_id=self._cursors[page], limit=self.per_page + 1, **self.filters
+        )
+        has_more = len(results) > self.per_page
+        results = results[: self.per_page]
+        self._pages[page] = results
+        if has_more and page == len(self._cursors) - 1:
+            self._cursors.append(results[-1].id)
+        elif not has_more:
+            self.exhausted = True
+        return results
@@ -0,0 +1,204 @@
+from typing import Any, Dict, FrozenSet, Optional, Union
+
+import discord
+
+from logs.core.config import config
+from logs.core.log import log
+
+__all__ = ("GuildSettings", "IgnoreMatcher", "get_settings", "invalidate")
+
+_cache: Dict[int, "GuildSettings"] = {}
+# Matchers are kept separately from settings snapshots, as they only have to be rebuilt
+# when the guild's ignore lists change, and not on every module setting change
+_matchers: Dict[int, "IgnoreMatcher"] = {}
+# Bumped on every invalidation, so a snapshot that was being loaded while the settings
+# were changed underneath it is never stored in the cache
+_generations: Dict[int, int] = {}
+_global_generation = 0
+
+
+class IgnoreMatcher:
+    """Compiled form of a guild's ignore lists
+
+    Every check is done with either a set membership test or a single set intersection,
+    instead of walking the raw Config lists.
+    """
+
+    __slots__ = ("guild", "members", "member_roles", "channels", "roles")
+
+    def __init__(self, ignore: Dict[str, Any]):
+        self.guild: bool = bool(ignore.get("guild", False))
+        self.members: FrozenSet[int] = frozenset(ignore.get("members", []))
+        self.member_roles: FrozenSet[int] = frozenset(ignore.get("member_roles", []))
+        self.channels: FrozenSet[int] = frozenset(ignore.get("channels", []))
+        self.roles: FrozenSet[int] = frozenset(ignore.get("roles", []))
+
+    def __repr__(self):
+        return (
+            "<IgnoreMatcher guild={0.guild!r} members={1} member_roles={2} channels={3} "
+            "roles={4}>".format(
+                self,
+                len(self.members),
+                len(self.member_roles),
+                len(self.channels),
+                len(self.roles),
+            )
+        )
+
+    def member(self, member: discord.Member) -> bool:
+        if member.bot or member.id in self.members:
+            return True
+        if not self.member_roles:
+            return False
+        # Member.roles builds and sorts a list of Role objects on every access, while the
+        # underlying snowflake list is all that's needed for an intersection
+        role_ids = getattr(member, "_roles", None)
+        if role_ids is None:
+            role_ids = [x.id for x in member.roles]
+        return not self.member_roles.isdisjoint(role_ids)
+
+    def channel(self, channel: discord.abc.GuildChannel) -> bool:
+        if not self.channels:
+            return False
+        return not self.channels.isdisjoint((channel.id, getattr(channel, "category_id", None)))
+
+    def role(self, role: discord.Role) -> bool:
+        return role.id in self.roles
+
+    def voice_state(self, state: discord.VoiceState) -> bool:
+        return getattr(state.channel, "id", None) in self.channels
+
+    def message(self, message: discord.Message) -> bool:
+        author = message.author
+        return (isinstance(author, discord.Member) and self.member(author)) or self.channel(
+            message.channel
+        )
+
+    def matches(self, item) -> bool:
+        """Check if the given item is ignored"""
+        if isinstance(item, discord.Member):
+            return self.member(item)
+        elif isinstance(item, discord.abc.GuildChannel):
+            return self.channel(item)
+        elif isinstance(item, discord.Role):
+            return self.role(item)
+        elif isinstance(item, discord.VoiceState):
+            return self.voice_state(item)
+        elif isinstance(item, discord.Message):
+            return self.message(item)
+        return False
+
+
+class GuildSettings:
+    """In-memory snapshot of a guild's log settings
+
+    Snapshots are built from a single Config read, and are kept until they're invalidated by
+    a settings change. Nothing in this class should ever be modified directly; update the
+    appropriate Config values and call `invalidate` instead.
+    """
+
+    __slots__ = ("guild_id", "modules", "ignore", "archive", "attachments")
+
+    def __init__(self, guild_id: int, data: Dict[str, Any]):
+        self.guild_id = guild_id
+        self.ignore: Dict[str, Any] = data.get("ignore", {})
+        self.archive: Dict[str, Any] = data.get("archive", {})
+        self.attachments: Dict[str, Any] = data.get("attachments", {})
+        self.modules: Dict[str, Dict[str, Any]] = {
+            k: v
+            for k, v in data.items()
+            if k not in ("ignore", "archive", "attachments") and isinstance(v, dict)
+        }
+
+    def __repr__(self):
+        return "<GuildSettings guild_id={!r} modules={!r}>".format(
+            self.guild_id, list(self.modules.keys())
+        )
+
+    def get(self, module: str, *opts: str, default=None) -> Any:
+        """Retrieve a module option value
+
+        Sub-dict options are given as separate arguments, the same as
+        with `Module.get_config_value`.
+        """
+        value = self.modules.get(module, {})
+        for opt in opts:
+            if not isinstance(value, dict) or opt not in value:
+                return default
+            value = value[opt]
+        return value
+
+    def destination(self, module: str) -> Optional[int]:
+        """Returns the log channel ID for the given module"""
+        return self.get(module, "_log_channel")
+
+    def webhook(self, module: str) -> Optional[str]:
+        """Returns the webhook URL the given module sends through, if any"""
+        return self.get(module, "_webhook")
+
+    def compact(self, module: str) -> bool:
+        """Returns True if the given module uses the compact text log format"""
+        return bool(self.get(module, "_compact", default=False))
+
+    @property
+    def attachment_budget(self) -> int:
+        """Returns the amount of bytes of attachments that may be cached, or 0 if disabled"""
+        if not self.attachments.get("enabled", False):
+            return 0
+        return int(self.attachments.get("budget", 0) * 1024 * 1024)
+
+    @property
+    def matcher(self) -> IgnoreMatcher:
+        """Returns the compiled ignore matcher for the current guild"""
+        matcher = _matchers.get(self.guild_id)
+        if matcher is None:
+            matcher = IgnoreMatcher(self.ignore)
+            # don't keep matchers built from a snapshot that was invalidated while loading
+            if _cache.get(self.guild_id) is self:
+                _matchers[self.guild_id] = matcher
+        return matcher
+
+
+async def get_settings(guild: discord.Guild) -> GuildSettings:
+    """Get the settings snapshot for the given guild
+
+    This only reads from Config if the guild doesn't already have a cached snapshot.
+    """
+    settings = _cache.get(guild.id)
+    if settings is not None:
+        return settings
+
+    generation = (_global_generation, _generations.get(guild.id, 0))
+    settings = GuildSettings(guild.id, await config.guild(guild).all())
+    if (_global_generation, _generations.get(guild.id, 0)) == generation:
+        _cache[guild.id] = settings
+    return settings
+
+
+def invalidate(guild: Union[discord.Guild, int, None] = None, *, ignore: bool = True) -> None:
+    """Drop the cached settings snapshot for the given guild
+
+    If no guild is given, all cached snapshots are dropped.
+
+    Parameters
+    -----------
+    guild: Union[discord.Guild, int, None]
+        The guild to invalidate the settings of
+    ignore: bool
+        Whether or not the guild's ignore lists were changed. If this is False, the guild's
+        compiled ignore matcher is kept instead of being rebuilt.
+    """
+    global _global_generation
+    if guild is None:
+        log.debug("Invalidating all cached guild settings")
+        _global_generation += 1
+        _cache.clear()
+        if ignore:
+            _matchers.clear()
+        return
+
+    guild_id = getattr(guild, "id", guild)
+    _generations[guild_id] = _generations.get(guild_id, 0) + 1
+    _cache.pop(guild_id, None)
+    if ignore:
+        _matchers.pop(guild_id, None)
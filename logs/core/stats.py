@@ -0,0 +1,129 @@
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+__all__ = (
+    "Histogram",
+    "OUTCOMES",
+    "by_event",
+    "counters",
+    "histograms",
+    "incr",
+    "observe",
+    "record_entries",
+    "reset",
+    "timed",
+)
+
+# Every outcome an event can be counted under; an event is always counted as received,
+# and then under at most one of ignored, filtered, coalesced or throttled. Filtered events
+# are those that didn't produce a log entry due to the module's options, and coalesced events
+# were collected to be logged together with others in a single entry later on. The remaining
+# outcomes count the log entries that events produced, rather than the events themselves.
+OUTCOMES = (
+    "received",
+    "ignored",
+    "filtered",
+    "coalesced",
+    "throttled",
+    "sent",
+    "failed",
+    "summarized",
+    "dropped",
+)
+# Upper bounds in seconds of each histogram bucket; anything slower goes into a final bucket
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+counters: Dict[Tuple[str, str, str], int] = defaultdict(int)
+
+
+class Histogram:
+    """Fixed bucket latency histogram
+
+    Recording a value is a single bisect and increment, which is cheap enough to do
+    for every event. Percentiles are approximated by the upper bound of the bucket
+    they fall in.
+    """
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def __repr__(self):
+        return "<Histogram count={0.count} mean={0.mean!r}>".format(self)
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, pct: float) -> float:
+        if not self.count:
+            return 0.0
+        target = self.count * pct
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(BUCKETS[idx], self.max) if idx < len(BUCKETS) else self.max
+        return self.max
+
+
+histograms: Dict[str, Histogram] = {
+    # retrieving a guild's settings snapshot at the start of Module.log
+    "settings": Histogram(),
+    # calling a module's parser function to build its log entries
+    "build": Histogram(),
+    # sending a single batch of log entries to a log channel
+    "send": Histogram(),
+}
+
+
+def incr(module: str, event: Optional[str], outcome: str, amount: int = 1) -> None:
+    counters[(module, str(event), outcome)] += amount
+
+
+def record_entries(entries: Iterable, outcome: str) -> None:
+    """Count log entries that were sent, failed to send, or were dropped"""
+    for entry in entries:
+        counters[(entry.module.name, str(entry.event), outcome)] += 1
+
+
+def observe(name: str, seconds: float) -> None:
+    histograms[name].observe(seconds)
+
+
+@contextmanager
+def timed(name: str):
+    """Record how long the wrapped block took in the given histogram"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histograms[name].observe(time.perf_counter() - start)
+
+
+def by_event() -> List[Tuple[str, str, Dict[str, int]]]:
+    """Returns every counter grouped by module and event, sorted by module and event name"""
+    grouped: Dict[Tuple[str, str], Dict[str, int]] = defaultdict(dict)
+    for (module, event, outcome), value in counters.items():
+        grouped[(module, event)][outcome] = value
+    return [(module, event, values) for (module, event), values in sorted(grouped.items())]
+
+
+def reset() -> None:
+    counters.clear()
+    for name in histograms:
+        histograms[name] = Histogram()
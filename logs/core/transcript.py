@@ -0,0 +1,73 @@
+import gzip
+import io
+from functools import partial
+from typing import Callable, Dict, IO, Iterable, Iterator, List
+
+import discord
+
+from logs.core.msgstore import StoredMessage
+
+__all__ = ("build_transcript",)
+
+# Transcripts larger than this are gzip'd before being uploaded; bulk deletions are capped at
+# 100 messages, so the largest transcripts are around 200 KB, or more with non-ASCII content
+GZIP_THRESHOLD = 64 * 1024
+
+
+def _transcript_lines(messages: Iterable[StoredMessage], authors: Dict[int, str]) -> Iterator[str]:
+    for message in messages:
+        header = "[{ts}] {author} ({id}): ".format(
+            ts=message.created_at.strftime("%Y-%m-%d %H:%M:%S UTC"),
+            author=authors.get(message.author_id, "Unknown user"),
+            id=message.author_id,
+        )
+        # continuation lines are indented to line up with the start of the message content
+        content = ("\n" + " " * len(header)).join((message.content or "").splitlines())
+        yield header + content + "\n"
+        for filename, url in message.attachments:
+            yield "{}  attachment: {} <{}>\n".format(" " * len(header), filename, url)
+
+
+def _write_transcript(
+    messages: List[StoredMessage], authors: Dict[int, str], filename: str
+) -> discord.File:
+    fp = io.BytesIO()
+    out: IO[bytes] = fp
+    for line in _transcript_lines(messages, authors):
+        out.write(line.encode("utf-8"))
+        if out is fp and fp.tell() > GZIP_THRESHOLD:
+            # compress the rest of the transcript as it's written, starting with what we
+            # already have, so the uncompressed transcript is never held in full
+            compressed = io.BytesIO()
+            out = gzip.GzipFile(filename=filename, mode="wb", fileobj=compressed)
+            out.write(fp.getbuffer())
+            fp.close()
+            fp = compressed
+            filename += ".gz"
+    if out is not fp:
+        out.close()
+
+    fp.seek(0)
+    return discord.File(fp, filename=filename)
+
+
+def build_transcript(
+    bot, channel: discord.TextChannel, messages: List[StoredMessage]
+) -> Callable[[], discord.File]:
+    """Prepare a plain text transcript of the given messages
+
+    This returns a callable that writes the transcript, meant to be passed to
+    `LogEntry.attach_generated`; it's written line by line in a worker thread on every attempt
+    at sending the entry it's attached to, and is compressed as it's written once it grows
+    past `GZIP_THRESHOLD`.
+    """
+    # Resolve author names here instead of in the worker thread, as guild member
+    # state should only ever be touched from the event loop
+    authors = {}
+    for author_id in {x.author_id for x in messages}:
+        member = channel.guild.get_member(author_id) or bot.get_user(author_id)
+        if member is not None:
+            authors[author_id] = str(member)
+
+    filename = "deleted-messages-{}-{}.txt".format(channel.name, messages[-1].id)
+    return partial(_write_transcript, messages, authors, filename)
@@ -0,0 +1,101 @@
+from typing import List, Optional, Set
+
+import aiohttp
+import discord
+
+from logs.core.log import log
+
+__all__ = (
+    "close_session",
+    "get_or_create_webhook",
+    "get_session",
+    "is_dead",
+    "mark_dead",
+    "send_webhook",
+    "webhook_url",
+)
+
+WEBHOOK_NAME = "Logs"
+
+_session: Optional[aiohttp.ClientSession] = None
+# Webhooks that were deleted out from under us; these are never used again
+_dead: Set[str] = set()
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Returns the HTTP session shared by all webhook sends"""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=20, keepalive_timeout=60)
+        )
+    return _session
+
+
+async def close_session() -> None:
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+def webhook_url(webhook: discord.Webhook) -> str:
+    return "https://discordapp.com/api/webhooks/{0.id}/{0.token}".format(webhook)
+
+
+def is_dead(url: str) -> bool:
+    return url in _dead
+
+
+def mark_dead(url: str) -> None:
+    log.debug("webhook {} was removed; falling back to normal sends".format(url.split("/")[-2]))
+    _dead.add(url)
+
+
+async def get_or_create_webhook(channel: discord.TextChannel) -> discord.Webhook:
+    """Retrieve a webhook we previously created in the given channel, or create a new one
+
+    Raises
+    -------
+    discord.Forbidden
+        Raised if we don't have permission to manage webhooks in the given channel
+    """
+    me = channel.guild.me
+    for webhook in await channel.webhooks():
+        # webhooks created by other users don't have a token we can use
+        if getattr(webhook.user, "id", None) == me.id and webhook.token:
+            _dead.discard(webhook_url(webhook))
+            return webhook
+    return await channel.create_webhook(name=WEBHOOK_NAME)
+
+
+async def send_webhook(
+    url: str,
+    embeds: List[discord.Embed] = None,
+    *,
+    content: str = None,
+    files: List[discord.File] = None,
+    username: str = None,
+    avatar_url: str = None
+) -> None:
+    """Send up to 10 embeds, or a plain text message, in a single webhook message
+
+    Raises
+    -------
+    discord.NotFound
+        Raised if the webhook was deleted; it's marked as dead before this is raised
+    discord.HTTPException
+        Raised if the send failed for any other reason
+    """
+    webhook = discord.Webhook.from_url(url, adapter=discord.AsyncWebhookAdapter(get_session()))
+    try:
+        await webhook.send(
+            content,
+            embeds=embeds or None,
+            files=files or None,
+            username=username,
+            avatar_url=avatar_url,
+        )
+    except discord.NotFound:
+        mark_dead(url)
+        raise
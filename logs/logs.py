@@ -1,14 +1,18 @@
+import asyncio
 import contextlib
-from typing import List, Type
+import time
+from typing import List, Set, Type
 
 import discord
-from discord.raw_models import RawBulkMessageDeleteEvent
+from discord.raw_models import RawBulkMessageDeleteEvent, RawMessageDeleteEvent
 from redbot.core import checks, commands
 from redbot.core.bot import Red
+from redbot.core.data_manager import cog_data_path
 from redbot.core.i18n import cog_i18n
-from redbot.core.utils.chat_formatting import bold, info, inline, warning
+from redbot.core.utils.chat_formatting import bold, box, info, inline, pagify, warning
 
 from cog_shared.swift_libs import (
+    FutureTime,
     confirm,
     PaginatedMenu,
     cmd_group,
@@ -18,10 +22,22 @@ from cog_shared.swift_libs import (
     prompt,
     Page,
     PostAction,
+    trim_to,
 )
-from logs.core import Module, get_module, i18n, log_event, config
-from logs.core.module import load, log, unload
+from logs.core import Module, get_module, get_settings, i18n, submit_event, config, invalidate
+from logs.core.archive import ExportProgress, apply_retention, get_archive
+from logs.core.attachments import get_attachment_cache
+from logs.core.delivery import delivery_stats
+from logs.core.log import log
+from logs.core.msgstore import message_store
+from logs.core import stats
+from logs.core.ratelimit import configure_limits, limits, throttled_guilds
+from logs.core.recorder import get_recorder, recorded, start_recording, stop_recording
+from logs.core.search import SearchPages, parse_query, parse_time
+from logs.core.webhooks import get_or_create_webhook, webhook_url
+from logs.core.module import get_pipeline, load, unload
 from logs.modules import DummyModule, modules as all_modules
+from logs.modules.member import MemberModule
 
 
 def ignore_handler(
@@ -59,10 +75,9 @@ def ignore_handler(
                     await ctx.send(warning(i18n("That item is not currently being ignored")))
                     return
                 ignored.remove(item)
-            log.debug(
-                "{} {!r} to/from {!r} {} ignore list".format(name, new_item, ctx.guild, conf_opt)
-            )
-            await ctx.tick()
+        invalidate(ctx.guild)
+        log.debug("{} {!r} to/from {!r} {} ignore list".format(name, new_item, ctx.guild, conf_opt))
+        await ctx.tick()
 
     if conf_opt == "guild":
         # noinspection PyUnusedLocal
@@ -72,6 +87,7 @@ def ignore_handler(
                 toggle = not await DummyModule().config.guild(ctx.guild).ignore.guild()
             # noinspection PyTypeChecker
             await DummyModule().config.guild(ctx.guild).ignore.guild.set(toggle)
+            invalidate(ctx.guild)
             await ctx.send(
                 tick(
                     i18n("Now ignoring the current server")
@@ -113,10 +129,34 @@ class Logs:
     def __init__(self, bot: Red):
         self.bot = bot
         load(self.bot)
+        self._init_task = self.bot.loop.create_task(self._configure_pipeline())
+        self._archive_task = self.bot.loop.create_task(self._archive_maintenance())
+        # guilds with an archive export currently running
+        self._exports: Set[int] = set()
 
     def __unload(self):
+        self._init_task.cancel()
+        self._archive_task.cancel()
+        self.bot.loop.create_task(stop_recording())
         unload()
 
+    async def _configure_pipeline(self):
+        await get_pipeline().resize(await config.workers())
+        configure_limits(**await config.rate_limit())
+
+    async def _archive_maintenance(self):
+        await self.bot.wait_until_ready()
+        while True:
+            archive = get_archive()
+            if archive is not None:
+                try:
+                    deleted = await apply_retention(archive.archive, await config.all_guilds())
+                except Exception as e:
+                    log.exception("Failed to apply archive retention", exc_info=e)
+                else:
+                    log.debug("removed {} expired archive entries".format(deleted))
+            await asyncio.sleep(3600)
+
     @commands.group(name="logset")
     @commands.guild_only()
     @checks.guildowner_or_permissions(administrator=True)
@@ -191,7 +231,7 @@ class Logs:
 
             elif result == "channel":
                 try:
-                    channel = commands.TextChannelConverter().convert(
+                    channel = await commands.TextChannelConverter().convert(
                         ctx,
                         (
                             await prompt(
@@ -207,9 +247,7 @@ class Logs:
                 else:
                     if channel is None:
                         continue
-                    await module.module_config.set_raw(
-                        "_log_channel", value=getattr(channel, "id", None)
-                    )
+                    await module.set_destination(channel)
 
     @logset.command(name="channel")
     async def logset_channel(
@@ -223,7 +261,12 @@ class Logs:
         if channel and not channel.permissions_for(ctx.guild.me).send_messages:
             await ctx.send(warning(i18n("I'm not able to send messages in that channel")))
             return
-        await module.module_config.set_raw("_log_channel", value=getattr(channel, "id", None))
+        await module.set_destination(channel)
+        if channel is None:
+            await module.set_webhook(None)
+        elif await module.webhook_url() is not None:
+            # move the module's webhook over to the new log channel
+            await self._setup_webhook(ctx, module, channel)
         if channel:
             await ctx.send(
                 tick(
@@ -241,6 +284,83 @@ class Logs:
                 )
             )
 
+    @logset.command(name="webhook")
+    async def logset_webhook(self, ctx: commands.Context, module: str, toggle: bool = None):
+        """Toggle sending a module's log entries through a webhook
+
+        Webhooks can send up to 10 log entries per message, and aren't rate limited
+        together with anything else the bot sends in the log channel.
+        """
+        module = await retrieve_module(ctx, module)
+        if toggle is None:
+            toggle = await module.webhook_url() is None
+        if not toggle:
+            await module.set_webhook(None)
+            await ctx.send(
+                tick(
+                    i18n("Module **{}** will no longer log through a webhook.").format(
+                        module.friendly_name
+                    )
+                )
+            )
+            return
+
+        channel = await module.log_destination()
+        if channel is None:
+            await ctx.send(
+                warning(
+                    i18n("Module **{}** doesn't have a log channel.").format(module.friendly_name)
+                )
+            )
+            return
+        if await self._setup_webhook(ctx, module, channel):
+            await ctx.send(
+                tick(
+                    i18n("Module **{}** will now log through a webhook.").format(
+                        module.friendly_name
+                    )
+                )
+            )
+
+    @logset.command(name="compact")
+    async def logset_compact(self, ctx: commands.Context, module: str, toggle: bool = None):
+        """Toggle logging a module's entries in a compact text format
+
+        Instead of an embed per entry, each entry is shown as a single line, with lines
+        being packed into as few messages as possible.
+        """
+        module = await retrieve_module(ctx, module)
+        if toggle is None:
+            toggle = not await module.uses_compact()
+        await module.set_compact(toggle)
+        await ctx.send(
+            tick(
+                i18n("Module **{}** will now log in the compact text format.")
+                if toggle
+                else i18n("Module **{}** will now log with embeds.")
+            ).format(module.friendly_name)
+        )
+
+    async def _setup_webhook(
+        self, ctx: commands.Context, module: Module, channel: discord.TextChannel
+    ) -> bool:
+        """Create or reuse a webhook in the given channel for the given module"""
+        try:
+            webhook = await get_or_create_webhook(channel)
+        except discord.Forbidden:
+            await module.set_webhook(None)
+            await ctx.send(
+                warning(
+                    i18n(
+                        "I need the Manage Webhooks permission in {channel} to log through a "
+                        "webhook; log entries for module **{module}** will be sent normally."
+                    ).format(channel=channel.mention, module=module.friendly_name)
+                )
+            )
+            return False
+        await module.set_webhook(webhook_url(webhook))
+        return True
+
     @logset.command(name="modules", aliases=["list"])
     async def logset_modules(self, ctx: commands.Context):
         """List all available modules"""
@@ -275,10 +395,518 @@ class Logs:
             ctx, content=warning(i18n("Are you sure you want to reset this server's log settings?"))
         ):
             await config.guild(ctx.guild).clear()
+            invalidate(ctx.guild)
             await ctx.send(tick(i18n("Server log settings have been reset.")))
         else:
             await ctx.send(i18n("Okay then."))
 
+    @logset.command(name="archive")
+    async def logset_archive(self, ctx: commands.Context, toggle: bool = None):
+        """Toggle if log entries are archived for later searching
+
+        Archiving is disabled by default.
+        """
+        if toggle is None:
+            toggle = not await config.guild(ctx.guild).archive.enabled()
+        await config.guild(ctx.guild).archive.enabled.set(toggle)
+        invalidate(ctx.guild, ignore=False)
+        await ctx.send(
+            tick(
+                i18n("Log entries will now be archived.")
+                if toggle
+                else i18n("Log entries will no longer be archived.")
+            )
+        )
+
+    @logset.command(name="retention")
+    async def logset_retention(self, ctx: commands.Context, days: int = None):
+        """Get or set how many days archived log entries are kept for
+
+        Setting this to 0 keeps archived log entries forever.
+        """
+        if days is None:
+            days = await config.guild(ctx.guild).archive.retention()
+            await ctx.send(
+                info(
+                    i18n("Archived log entries are kept for {} days.").format(days)
+                    if days
+                    else i18n("Archived log entries are kept forever.")
+                )
+            )
+            return
+        if days < 0:
+            raise commands.BadArgument
+        await config.guild(ctx.guild).archive.retention.set(days)
+        await ctx.send(
+            tick(
+                i18n("Archived log entries will now be kept for {} days.").format(days)
+                if days
+                else i18n("Archived log entries will now be kept forever.")
+            )
+        )
+
+    @logset.command(name="export")
+    async def logset_export(self, ctx: commands.Context, since: str, *modules: str):
+        """Export this server's archived log entries
+
+        Entries newer than `since`, and optionally older than `until`, are exported to a
+        gzip compressed file with one JSON object per line. Both are given as durations,
+        such as `30d`. Any modules given limit the export to entries from those modules.
+
+        Exports that are too large to upload are saved to the bot's data folder instead.
+
+        Usage: `[p]logset export <since> [until] [modules...]`
+        Example: `[p]logset export 30d 7d message member`
+        """
+        archive = get_archive()
+        if archive is None:
+            await ctx.send(warning(i18n("The log archive is currently unavailable.")))
+            return
+        if ctx.guild.id in self._exports:
+            await ctx.send(warning(i18n("An export is already running for this server.")))
+            return
+
+        until = None
+        try:
+            since = parse_time(since)
+            if modules and FutureTime.get_seconds(modules[0]) is not None:
+                until, modules = parse_time(modules[0]), modules[1:]
+        except ValueError as e:
+            await ctx.send(warning(i18n("`{}` is not a valid duration.").format(str(e))))
+            return
+        modules = [x.lower() for x in modules]
+        if any(x not in all_modules for x in modules):
+            await ctx.send(warning(i18n("That log module doesn't exist.")))
+            return
+
+        path = (
+            cog_data_path(raw_name="Logs")
+            / "exports"
+            / "{}-{}.ndjson.gz".format(ctx.guild.id, int(time.time()))
+        )
+        progress = ExportProgress()
+        message = await ctx.send(
+            info(i18n("Exporting archived log entries\N{HORIZONTAL ELLIPSIS}"))
+        )
+        self._exports.add(ctx.guild.id)
+        try:
+            # include anything that's still waiting to be written
+            await archive.flush()
+            task = asyncio.ensure_future(
+                archive.archive.export(
+                    ctx.guild.id,
+                    path,
+                    since=since,
+                    until=until,
+                    modules=modules,
+                    progress=progress,
+                )
+            )
+            while not task.done():
+                await asyncio.wait([task], timeout=5)
+                if not task.done() and progress.total is not None:
+                    await message.edit(
+                        content=info(
+                            i18n(
+                                "Exporting archived log entries\N{HORIZONTAL ELLIPSIS} "
+                                "{exported}/{total} ({percent:.0f}%)"
+                            ).format(
+                                exported=progress.exported,
+                                total=progress.total,
+                                percent=progress.percent,
+                            )
+                        )
+                    )
+            count = task.result()
+        except Exception as e:
+            log.exception(
+                "Failed to export archived entries for {!r}".format(ctx.guild), exc_info=e
+            )
+            await message.edit(content=warning(i18n("Failed to export archived log entries.")))
+            with contextlib.suppress(OSError):
+                path.unlink()
+            return
+        finally:
+            self._exports.discard(ctx.guild.id)
+
+        if not count:
+            with contextlib.suppress(OSError):
+                path.unlink()
+            await message.edit(content=info(i18n("No archived log entries matched.")))
+            return
+
+        size = path.stat().st_size
+        if size <= getattr(ctx.guild, "filesize_limit", 8 * 1024 * 1024):
+            try:
+                with path.open("rb") as f:
+                    await ctx.send(
+                        content=tick(i18n("Exported {} archived log entries.").format(count)),
+                        file=discord.File(f, filename=path.name),
+                    )
+            except discord.HTTPException:
+                pass
+            else:
+                with contextlib.suppress(discord.HTTPException):
+                    await message.delete()
+                path.unlink()
+                return
+
+        await message.edit(
+            content=tick(
+                i18n(
+                    "Exported {count} archived log entries, but the export is too large to "
+                    "upload. It has been saved to `exports/{name}` in the bot's data folder."
+                ).format(count=count, name=path.name)
+            )
+        )
+
+    @logset.command(name="attachments")
+    async def logset_attachments(self, ctx: commands.Context, toggle: bool = None):
+        """Toggle saving attachments so they can be re-uploaded in message deletion logs
+
+        Attachments stop being available as soon as the message they were sent with is
+        deleted. With this enabled, attachments in channels that aren't ignored are saved
+        in the background, up to the server's attachment budget.
+        """
+        if toggle is None:
+            toggle = not await config.guild(ctx.guild).attachments.enabled()
+        await config.guild(ctx.guild).attachments.enabled.set(toggle)
+        invalidate(ctx.guild, ignore=False)
+        await ctx.send(
+            tick(
+                i18n("Attachments will now be saved for message deletion logs.")
+                if toggle
+                else i18n("Attachments will no longer be saved for message deletion logs.")
+            )
+        )
+
+    @logset.command(name="attachmentbudget")
+    @checks.is_owner()
+    async def logset_attachmentbudget(self, ctx: commands.Context, megabytes: int = None):
+        """Get or set how many megabytes of attachments may be saved for this server
+
+        The least recently used attachments are removed once this is exceeded.
+        """
+        if megabytes is None:
+            budget = await config.guild(ctx.guild).attachments.budget()
+            cache = get_attachment_cache()
+            used = cache.usage(ctx.guild.id) / 1024 / 1024 if cache is not None else 0
+            await ctx.send(
+                info(
+                    i18n(
+                        "This server may save up to {budget} MB of attachments, "
+                        "and is currently using {used:.1f} MB."
+                    ).format(budget=budget, used=used)
+                )
+            )
+            return
+        if megabytes < 1:
+            raise commands.BadArgument
+        await config.guild(ctx.guild).attachments.budget.set(megabytes)
+        invalidate(ctx.guild, ignore=False)
+        await ctx.send(
+            tick(i18n("This server may now save up to {} MB of attachments.").format(megabytes))
+        )
+
+    @logset.command(name="queues", hidden=True)
+    @checks.is_owner()
+    async def logset_queues(self, ctx: commands.Context):
+        """Show event pipeline and log delivery queue statistics"""
+        pipeline = get_pipeline()
+        ingest = {
+            **pipeline.stats,
+            "workers": pipeline.workers,
+            "pending": pipeline.pending,
+            "lag": pipeline.lag(),
+        }
+
+        def fmt_stats(stats: dict):
+            return "\n".join(
+                "{:<14}{}".format(
+                    key.replace("_", " ").capitalize() + ":",
+                    "{:.3f}s".format(value) if isinstance(value, float) else value,
+                )
+                for key, value in sorted(stats.items())
+            )
+
+        sections = [("Ingestion", ingest), ("Delivery", delivery_stats())]
+        archive = get_archive()
+        if archive is not None:
+            sections.append(("Archive", {**archive.stats, "pending": len(archive)}))
+        cache = get_attachment_cache()
+        if cache is not None:
+            sections.append(
+                (
+                    "Attachments",
+                    {
+                        **cache.stats,
+                        "pending": cache.pending,
+                        "messages": len(cache),
+                        "bytes": cache.size,
+                    },
+                )
+            )
+        await ctx.send(
+            box("\n\n".join("{}\n{}".format(name, fmt_stats(stats)) for name, stats in sections))
+        )
+
+    @logset.command(name="ratelimit", hidden=True)
+    @checks.is_owner()
+    async def logset_ratelimit(
+        self, ctx: commands.Context, scope: str = None, rate: float = None, burst: int = None
+    ):
+        """Get or set the log rate limits applied to every server
+
+        `scope` is either `server` or `module`; `rate` is the amount of events per second that
+        can be logged, and `burst` is how many events can be logged at once before the rate
+        limit kicks in.
+
+        Servers over their limit only have a sample of their events logged, along with
+        periodic summaries of how many events weren't shown.
+        """
+        if scope is None or rate is None:
+            await ctx.send(
+                info(
+                    i18n(
+                        "Servers can log up to {guild_rate} events per second, in bursts of up "
+                        "to {guild_burst} events.\nEach module in a server can log up to "
+                        "{module_rate} events per second, in bursts of up to {module_burst} "
+                        "events."
+                    ).format(**limits)
+                )
+            )
+            return
+        scope = {"server": "guild", "guild": "guild", "module": "module"}.get(scope.lower())
+        if scope is None or rate <= 0 or (burst is not None and burst < 1):
+            raise commands.BadArgument
+        async with config.rate_limit() as rate_limit:
+            rate_limit["{}_rate".format(scope)] = rate
+            if burst is not None:
+                rate_limit["{}_burst".format(scope)] = burst
+            configure_limits(**rate_limit)
+        await ctx.tick()
+
+    @logset.command(name="throttled", hidden=True)
+    @checks.is_owner()
+    async def logset_throttled(self, ctx: commands.Context):
+        """List servers that are currently over their log rate limit"""
+        throttles = throttled_guilds()
+        if not throttles:
+            await ctx.send(info(i18n("No servers are currently over their log rate limit.")))
+            return
+        now = time.monotonic()
+        lines = [
+            "{:<24}{:>12}{:>10}{:>10}{:>8}{:>8}".format(
+                "Server", "Suppressed", "Sampled", "Allowed", "1 in", "Since"
+            )
+        ]
+        for throttle in throttles:
+            lines.append(
+                "{:<24}{suppressed:>12}{sampled:>10}{allowed:>10}{:>8}{:>7.0f}s".format(
+                    trim_to(str(throttle.guild), 23),
+                    throttle.sample_every,
+                    now - throttle.throttled_since,
+                    **throttle.stats
+                )
+            )
+        for page in pagify("\n".join(lines), page_length=1980):
+            await ctx.send(box(page))
+
+    @logset.command(name="stats", hidden=True)
+    @checks.is_owner()
+    async def logset_stats(self, ctx: commands.Context, reset: bool = False):
+        """Show per-module event counters and latency statistics
+
+        Counters and latencies are collected from when the cog was loaded, or since the last
+        time they were reset with `[p]logset stats yes`.
+        """
+        if reset:
+            stats.reset()
+            await ctx.send(tick(i18n("Log statistics have been reset.")))
+            return
+
+        lines = [
+            "{:<9}{:<13}".format("Module", "Event")
+            + "".join("{:>11}".format(x.capitalize()) for x in stats.OUTCOMES)
+        ]
+        for module, event, counters in stats.by_event():
+            lines.append(
+                "{:<9}{:<13}".format(module, trim_to(event, 12))
+                + "".join("{:>11}".format(counters.get(x, 0)) for x in stats.OUTCOMES)
+            )
+        if len(lines) == 1:
+            lines.append(i18n("No events have been received yet."))
+
+        lines.extend(
+            [
+                "",
+                "{:<9}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}".format(
+                    "Latency", "Count", "Mean", "p50", "p95", "p99", "Max"
+                ),
+            ]
+        )
+        for name, histogram in stats.histograms.items():
+            lines.append(
+                "{:<9}{:>10}".format(name.capitalize(), histogram.count)
+                + "".join(
+                    "{:>8.1f}ms".format(x * 1000)
+                    for x in (
+                        histogram.mean,
+                        histogram.percentile(0.5),
+                        histogram.percentile(0.95),
+                        histogram.percentile(0.99),
+                        histogram.max,
+                    )
+                )
+            )
+        for page in pagify("\n".join(lines), page_length=1980):
+            await ctx.send(box(page))
+
+    @logset.command(name="workers", hidden=True)
+    @checks.is_owner()
+    async def logset_workers(self, ctx: commands.Context, amount: int = None):
+        """Get or set the amount of event processing workers
+
+        Events from a single server are always processed by the same worker,
+        so this only affects how many servers can be processed concurrently.
+        """
+        if amount is None:
+            await ctx.send(
+                info(
+                    i18n("Events are currently processed by {} workers.").format(
+                        get_pipeline().workers
+                    )
+                )
+            )
+            return
+        if not 1 <= amount <= 32:
+            await ctx.send(warning(i18n("The amount of workers must be between 1 and 32.")))
+            return
+        await config.workers.set(amount)
+        await get_pipeline().resize(amount)
+        await ctx.send(tick(i18n("Events will now be processed by {} workers.").format(amount)))
+
+    @commands.group(name="logs")
+    @commands.guild_only()
+    @checks.admin_or_permissions(view_audit_log=True)
+    async def logs_group(self, ctx: commands.Context):
+        """Browse archived log entries"""
+        await cmd_help(ctx)
+
+    @logs_group.command(name="search")
+    async def logs_search(self, ctx: commands.Context, *, query: str):
+        """Search this server's archived log entries
+
+        Any words given are searched for in the content of log entries, and quoted words
+        are matched as an exact phrase.
+
+        Available filters:
+        **member:** — only show entries about the given member
+        **module:** — only show entries from the given log module
+        **event:** — only show entries for the given event, such as `delete`
+        **since:** / **until:** — only show entries newer or older than a duration
+
+        Example: `[p]logs search member:@Someone module:message since:3d "some words"`
+        """
+        archive = get_archive()
+        if archive is None:
+            await ctx.send(warning(i18n("The log archive is currently unavailable.")))
+            return
+
+        try:
+            parsed = parse_query(query)
+        except ValueError as e:
+            await ctx.send(warning(i18n("`{}` is not a valid duration.").format(str(e))))
+            return
+        if not parsed:
+            await ctx.send_help()
+            return
+
+        member_id = None
+        if parsed.member is not None:
+            try:
+                member_id = (await commands.MemberConverter().convert(ctx, parsed.member)).id
+            except commands.BadArgument:
+                # allow searching for members who have since left by their ID
+                if not parsed.member.isdigit():
+                    await ctx.send(warning(i18n("I couldn't find that member.")))
+                    return
+                member_id = int(parsed.member)
+        if parsed.module is not None and parsed.module not in all_modules:
+            await ctx.send(warning(i18n("That log module doesn't exist.")))
+            return
+
+        pages = SearchPages(
+            archive.archive,
+            ctx.guild.id,
+            member_id=member_id,
+            module=parsed.module,
+            event=parsed.event,
+            since=parsed.since,
+            until=parsed.until,
+            words=parsed.words,
+            phrases=parsed.phrases,
+        )
+        if not await pages.fetch(0):
+            await ctx.send(info(i18n("No archived log entries matched your search.")))
+            return
+
+        async def converter(pg: Page):
+            lines = [
+                "`{ts}` **{module} {event}** — {content}".format(
+                    ts=x.created_at.strftime("%Y-%m-%d %H:%M"),
+                    module=x.module,
+                    event=str(x.event).replace("_", " "),
+                    content=trim_to(" ".join(x.content.split()) or i18n("No content"), 140),
+                )
+                for x in await pages.fetch(pg.data)
+            ]
+            footer = (
+                i18n("Page {current} out of {total}")
+                if pages.exhausted
+                else i18n("Page {current} out of {total}+")
+            ).format(current=pg.current, total=len(pages))
+            return "{}\n\n{}".format("\n".join(lines), footer)
+
+        await PaginatedMenu(ctx=ctx, pages=pages, converter=converter).prompt()
+
+    @logset.command(name="record", hidden=True)
+    @checks.is_owner()
+    async def logset_record(self, ctx: commands.Context, limit: int = None):
+        """Start or stop recording received events
+
+        Recordings are saved to the cog's data folder, and can be replayed offline with
+        `python -m logs.replay <file>` to profile the cog against real event streams.
+
+        **Recordings contain message content and member names from every server
+        the bot is in.**
+        """
+        recorder = get_recorder()
+        if recorder is not None:
+            await stop_recording()
+            await ctx.send(
+                tick(
+                    i18n("Recorded {count} events to `{path}`.").format(
+                        count=recorder.count, path=recorder.path
+                    )
+                )
+            )
+            return
+
+        path = (
+            cog_data_path(raw_name="Logs")
+            / "recordings"
+            / "events-{}.jsonl".format(ctx.message.created_at.strftime("%Y%m%d-%H%M%S"))
+        )
+        start_recording(path, limit=limit)
+        await ctx.send(
+            tick(
+                i18n("Now recording events to `{path}`. Run this command again to stop.").format(
+                    path=path
+                )
+            )
+        )
+
     ####################
     #   Ignore Mgnt    #
     ####################
@@ -389,57 +1017,119 @@ class Logs:
     #    Listeners    #
     ###################
 
+    @recorded
+    async def on_message(self, message: discord.Message):
+        if getattr(message, "guild", None) is None or message.author.bot:
+            return
+        settings = await get_settings(message.guild)
+        if settings.destination("message") is None or not any(
+            [settings.get("message", "delete"), settings.get("message", "bulkdelete")]
+        ):
+            return
+        message_store.add(message)
+        cache = get_attachment_cache()
+        if (
+            message.attachments
+            and cache is not None
+            and settings.attachment_budget
+            and settings.get("message", "delete")
+            and not settings.matcher.matches(message)
+        ):
+            cache.put(message, settings.attachment_budget)
+
+    @recorded
     async def on_message_delete(self, message: discord.Message):
         if not hasattr(message, "guild") or message.guild is None:
             return
-        await log_event("message", "delete", message)
+        message_store.pop(message.id)
+        submit_event("message", "delete", message)
+
+    @recorded
+    async def on_raw_message_delete(self, payload: RawMessageDeleteEvent):
+        # messages that were still in discord.py's cache are logged by on_message_delete,
+        # which pops them from the message store itself; discord.py removes the message from
+        # its cache before this listener runs, so cached_message is the only reliable way
+        # to tell the two apart
+        if payload.cached_message is not None:
+            return
+        message = message_store.pop(payload.message_id)
+        channel: discord.TextChannel = self.bot.get_channel(payload.channel_id)
+        if message is None or getattr(channel, "guild", None) is None:
+            return
+        author = channel.guild.get_member(message.author_id)
+        submit_event("message", "raw_delete", channel, message, author)
 
+    @recorded
     async def on_message_edit(self, before: discord.Message, after: discord.Message):
         if not hasattr(after, "guild") or after.guild is None:
             return
-        await log_event("message", "edit", before, after)
+        message_store.update(after)
+        cache = get_attachment_cache()
+        if cache is not None:
+            cache.touch(after.id)
+        submit_event("message", "edit", before, after)
 
+    @recorded
     async def on_raw_bulk_message_delete(self, payload: RawBulkMessageDeleteEvent):
+        messages = message_store.pop_many(payload.message_ids)
+        cache = get_attachment_cache()
+        if cache is not None:
+            # transcripts only link to attachments, so there's no use in keeping these around
+            cache.discard(payload.message_ids)
         channel: discord.TextChannel = self.bot.get_channel(payload.channel_id)
         if not hasattr(channel, "guild") or channel.guild is None:
             return
-        await log_event("message", "bulk_delete", channel, payload.message_ids)
+        submit_event("message", "bulk_delete", channel, payload.message_ids, messages)
 
+    @recorded
     async def on_member_join(self, member: discord.Member):
-        await log_event("member", "join", member)
+        submit_event("member", "join", member)
 
+    @recorded
     async def on_member_leave(self, member: discord.Member):
-        await log_event("member", "leave", member)
+        submit_event("member", "leave", member)
 
+    @recorded
     async def on_member_update(self, before: discord.Member, after: discord.Member):
-        await log_event("member", "update", before, after)
+        # the vast majority of member updates are presence changes, which we don't log
+        if not MemberModule.has_tracked_changes(before, after):
+            return
+        submit_event("member", "update", before, after)
 
+    @recorded
     async def on_guild_channel_create(self, channel: discord.abc.GuildChannel):
-        await log_event("channel", "create", channel)
+        submit_event("channel", "create", channel)
 
+    @recorded
     async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
-        await log_event("channel", "delete", channel)
+        submit_event("channel", "delete", channel)
 
+    @recorded
     async def on_guild_channel_update(
         self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel
     ):
-        await log_event("channel", "update", before, after)
+        submit_event("channel", "update", before, after)
 
+    @recorded
     async def on_voice_state_update(
         self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState
     ):
         if not hasattr(member, "guild"):
             return
-        await log_event("voice", "update", before, after, member)
+        submit_event("voice", "update", before, after, member)
 
+    @recorded
     async def on_guild_role_create(self, role: discord.Role):
-        await log_event("role", "create", role)
+        submit_event("role", "create", role)
 
+    @recorded
     async def on_guild_role_delete(self, role: discord.Role):
-        await log_event("role", "delete", role)
+        submit_event("role", "delete", role)
 
+    @recorded
     async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
-        await log_event("role", "update", before, after)
+        submit_event("role", "update", before, after)
 
+    @recorded
     async def on_guild_update(self, before: discord.Guild, after: discord.Guild):
-        await log_event("guild", "update", before, after)
+        submit_event("guild", "update", before, after)
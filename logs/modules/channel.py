@@ -1,12 +1,19 @@
+from typing import List, Optional, Tuple
+
 import discord
 
 from logs.core import Module, LogEntry, i18n
+from logs.core.coalesce import COALESCED, Coalescer, describe_moves, net_moves
+
+# How long position changes are collected for before being logged as a single entry
+REORDER_DELAY = 2.0
 
 
 class ChannelModule(Module):
     name = "channel"
     friendly_name = i18n("Channel")
     description = i18n("Channel creation, deletion, and update logging")
+    compact_icon = "\N{CARD INDEX DIVIDERS}"
     settings = {
         "create": i18n("Channel creations"),
         "delete": i18n("Channel deletions"),
@@ -19,6 +26,48 @@ class ChannelModule(Module):
             "userlimit": i18n("Channel user limit changes"),
         },
     }
+    tracked_attributes = {
+        "update": {
+            "name": ("update", "name"),
+            "category_id": ("update", "category"),
+            "position": ("update", "position"),
+            "topic": ("update", "topic"),
+            "bitrate": ("update", "bitrate"),
+            "user_limit": ("update", "userlimit"),
+        }
+    }
+
+    _reorders: Optional[Coalescer] = None
+
+    @classmethod
+    def register(cls):
+        cls._reorders = Coalescer(cls._log_reorder, delay=REORDER_DELAY, max_items=500)
+
+    @classmethod
+    def unregister(cls):
+        if cls._reorders is not None:
+            cls._reorders.close()
+            cls._reorders = None
+
+    @classmethod
+    async def _log_reorder(
+        cls,
+        guild_id: int,
+        changes: List[Tuple[discord.abc.GuildChannel, discord.abc.GuildChannel]],
+    ):
+        module = cls(changes[-1][1].guild)
+        moves = net_moves(changes, "position")
+        if not moves:
+            return
+        embed = LogEntry(
+            module,
+            colour=discord.Color.blurple(),
+            require_fields=False,
+            description=i18n("{count} channels were moved:\n\n{moves}").format(
+                count=len(moves), moves=describe_moves(moves)
+            ),
+        ).set_author(name=i18n("Channels Reordered"), icon_url=module.icon_uri())
+        await module.log_coalesced(embed, event="reorder")
 
     async def create(self, channel: discord.abc.GuildChannel):
         # noinspection PyUnresolvedReferences
@@ -32,6 +81,7 @@ class ChannelModule(Module):
                 )
                 .set_author(name=i18n("Channel Created"), icon_url=self.icon_uri())
                 .set_footer(text=i18n("Channel ID: {}").format(channel.id))
+                .add_audit_info(self.audit_entry(discord.AuditLogAction.channel_create, channel.id))
             )
             if await self.is_opt_enabled("create")
             else None
@@ -51,12 +101,22 @@ class ChannelModule(Module):
                 )
                 .set_author(name=i18n("Channel Deleted"), icon_url=self.icon_uri())
                 .set_footer(text=i18n("Channel ID: {}").format(channel.id))
+                .add_audit_info(self.audit_entry(discord.AuditLogAction.channel_delete, channel.id))
             )
             if await self.is_opt_enabled("delete")
             else None
         )
 
     async def update(self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+        # Moving a single channel causes an update for every channel whose position shifted,
+        # so position-only updates are collected and logged together as a single entry
+        changed = self.changed_attributes("update", before, after)
+        if changed == ["position"] and self._reorders is not None:
+            if not await self.is_opt_enabled("update", "position"):
+                return None
+            self._reorders.add(self.guild.id, (before, after))
+            return COALESCED
+
         embed = (
             LogEntry(
                 self,
@@ -68,34 +128,21 @@ class ChannelModule(Module):
         )
 
         checks = [
-            {
-                "name": i18n("Name"),
-                # yes, pycharm, a guild channel does have a name attribute
-                "before": getattr(before, "name"),
-                "after": getattr(after, "name"),
-                "config_opt": ("update", "name"),
-            },
+            {"name": i18n("Name"), "value": "name", "config_opt": ("update", "name")},
             {
                 "name": i18n("Category"),
-                "before": before.category,
-                "after": after.category,
+                "value": "category",
                 "converter": lambda x: getattr(x, "mention", i18n("None")),
                 "config_opt": ("update", "category"),
             },
-            {
-                "name": i18n("Position"),
-                "before": before.position,
-                "after": after.position,
-                "config_opt": ("update", "position"),
-            },
+            {"name": i18n("Position"), "value": "position", "config_opt": ("update", "position")},
         ]
 
         if isinstance(before, discord.TextChannel) and isinstance(after, discord.TextChannel):
             checks += [
                 {
                     "name": i18n("Channel Topic"),
-                    "before": before.topic,
-                    "after": after.topic,
+                    "value": "topic",
                     "diff": True,
                     "config_opt": ("update", "topic"),
                 }
@@ -105,17 +152,18 @@ class ChannelModule(Module):
             checks += [
                 {
                     "name": i18n("User Limit"),
-                    "before": before.user_limit,
-                    "after": after.user_limit,
+                    "value": "user_limit",
                     "config_opt": ("update", "userlimit"),
                 },
                 {
                     "name": i18n("Bitrate"),
-                    "before": before.bitrate,
-                    "after": after.bitrate,
-                    "converter": lambda x: "{} kbps".format(x[:4]),
+                    "value": "bitrate",
+                    "converter": lambda x: "{} kbps".format(x // 1000),
                     "config_opt": ("update", "bitrate"),
                 },
             ]
 
-        return await embed.add_multiple_changed(before, after, checks)
+        await embed.add_multiple_changed(before, after, checks)
+        if embed.fields:
+            embed.add_audit_info(self.audit_entry(discord.AuditLogAction.channel_update, after.id))
+        return embed
@@ -11,6 +11,7 @@ class GuildModule(Module):
     name = "guild"
     friendly_name = i18n("Server")
     description = i18n("Server update logging")
+    compact_icon = "\N{HOUSE BUILDING}"
     settings = {
         "2fa": i18n("Administration two-factor authentication requirement"),
         "afk": {
@@ -22,6 +23,17 @@ class GuildModule(Module):
         "region": i18n("Voice server region"),
         "filter": i18n("Explicit content filter"),
     }
+    tracked_attributes = {
+        "update": {
+            "name": ("name",),
+            "owner_id": ("owner",),
+            "mfa_level": ("2fa",),
+            "afk_channel": ("afk", "channel"),
+            "afk_timeout": ("afk", "timeout"),
+            "region": ("region",),
+            "explicit_content_filter": ("filter",),
+        }
+    }
 
     async def update(self, before: discord.Guild, after: discord.Guild):
         if any([before.unavailable, after.unavailable]):
@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import FrozenSet
 
 import discord
 
@@ -13,6 +14,7 @@ class MemberModule(Module):
     name = "member"
     friendly_name = i18n("Member")
     description = i18n("Member joining, leaving, and update logging")
+    compact_icon = "\N{BUST IN SILHOUETTE}"
     settings = {
         "join": i18n("Member joining"),
         "leave": i18n("Member leaving"),
@@ -23,6 +25,55 @@ class MemberModule(Module):
             "roles": i18n("Member role changes"),
         },
     }
+    tracked_attributes = {
+        "update": {
+            "name": ("update", "name"),
+            "discriminator": ("update", "discriminator"),
+            "nick": ("update", "nickname"),
+            "roles": ("update", "roles"),
+        }
+    }
+
+    @staticmethod
+    def _role_ids(member: discord.Member) -> FrozenSet[int]:
+        # Member.roles builds and sorts a list of Role objects on every access,
+        # which is far more work than we need to compare them
+        role_ids = getattr(member, "_roles", None)
+        if role_ids is None:
+            role_ids = [x.id for x in member.roles]
+        return frozenset(role_ids)
+
+    @classmethod
+    def has_tracked_changes(cls, before: discord.Member, after: discord.Member) -> bool:
+        """Check if a member update changed anything this module logs
+
+        discord.py dispatches member updates for every status and activity change,
+        which vastly outnumber the updates we care about. This is intended to be called
+        before anything else is done with the event, and only costs a few attribute
+        comparisons for presence-only updates.
+        """
+        if (before.name, before.discriminator, before.nick) != (
+            after.name,
+            after.discriminator,
+            after.nick,
+        ):
+            return True
+        return cls._role_ids(before) != cls._role_ids(after)
+
+    async def can_log(self, fn_name: str, *args) -> bool:
+        if fn_name != "update":
+            return await super().can_log(fn_name, *args)
+        before, after = args[:2]
+        settings = await self.guild_settings()
+        for attr, opt in self.tracked_attributes["update"].items():
+            if settings is not None and not settings.get(self.name, *opt):
+                continue
+            if attr == "roles":
+                if self._role_ids(before) != self._role_ids(after):
+                    return True
+            elif getattr(before, attr) != getattr(after, attr):
+                return True
+        return False
 
     @classmethod
     def register(cls):
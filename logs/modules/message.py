@@ -1,22 +1,49 @@
-from typing import List
+from typing import List, Optional, Union
 
 import discord
 
 from redbot.core.utils.chat_formatting import inline
 
 from logs.core import Module, LogEntry, i18n
+from logs.core.attachments import get_attachment_cache
+from logs.core.compact import mention_name, render_line
+from logs.core.msgstore import StoredMessage
+from logs.core.transcript import build_transcript
 
 
 class MessageModule(Module):
     name = "message"
     friendly_name = i18n("Message")
     description = i18n("Message edit and deletion logging")
+    compact_icon = "\N{SPEECH BALLOON}"
     settings = {
         "edit": i18n("Message edits"),
         "delete": i18n("Message deletions"),
         "bulkdelete": i18n("Bulk message deletions"),
     }
 
+    def compact_line(self, entry: LogEntry) -> str:
+        if entry.event not in ("edit", "delete", "raw_delete"):
+            return render_line(entry, icon=self.compact_icon, guild=self.guild)
+        # the author and channel fields are folded into the summary
+        fmt = dict(
+            member=mention_name(self.guild, "@", entry.member_id),
+            channel=mention_name(self.guild, "#", entry.channel_id),
+        )
+        if entry.event == "edit":
+            icon = "\N{PENCIL}\N{VARIATION SELECTOR-16}"
+            summary = i18n("{member} edited a message in {channel}").format(**fmt)
+        else:
+            icon = "\N{WASTEBASKET}\N{VARIATION SELECTOR-16}"
+            summary = i18n("{member}'s message in {channel} was deleted").format(**fmt)
+        return render_line(
+            entry,
+            icon=icon,
+            guild=self.guild,
+            summary=summary,
+            exclude=[i18n("Message Author"), i18n("Channel")],
+        )
+
     async def edit(self, before: discord.Message, after: discord.Message):
         if after.author.bot:
             return None
@@ -49,58 +76,115 @@ class MessageModule(Module):
 
         return embed
 
-    async def delete(self, message: discord.Message):
+    def _deletion_entry(
+        self,
+        *,
+        message_id: int,
+        author: Union[discord.abc.User, int],
+        channel: discord.TextChannel,
+        content: str,
+        attachments: List[str],
+    ) -> LogEntry:
+        author_id = getattr(author, "id", author)
         return (
-            (
-                LogEntry(
-                    self, colour=discord.Colour.red(), ignore_fields=["Message Author", "Channel"]
-                )
-                .set_author(name=i18n("Message Deleted"), icon_url=self.icon_uri(message.author))
-                .set_footer(text=i18n("Message ID: {}").format(message.id))
-                .add_field(
-                    name=i18n("Message Author"),
-                    inline=True,
-                    value="{message.author.mention} ({message.author.id})".format(message=message),
-                )
-                .add_field(
-                    name=i18n("Channel"),
-                    inline=True,
-                    value="{message.channel.mention} ({message.channel.id})".format(
-                        message=message
-                    ),
-                )
-                .add_field(
-                    name=i18n("Content"),
-                    value=message.content or inline(i18n("No message content")),
-                )
-                # due to how LogEntry.add_field works, this will only display if value is not None
-                .add_field(
-                    name=i18n("Attachments"),
-                    value=(
-                        "\n".join([f"<{x.url}>" for x in message.attachments])
-                        if message.attachments
-                        else None
-                    ),
-                )
+            LogEntry(self, colour=discord.Colour.red(), ignore_fields=["Message Author", "Channel"])
+            .set_author(
+                name=i18n("Message Deleted"),
+                icon_url=self.icon_uri(author if isinstance(author, discord.abc.User) else None),
+            )
+            .set_footer(text=i18n("Message ID: {}").format(message_id))
+            .add_field(
+                name=i18n("Message Author"),
+                inline=True,
+                value="<@{id}> ({id})".format(id=author_id),
+            )
+            .add_field(
+                name=i18n("Channel"),
+                inline=True,
+                value="{channel.mention} ({channel.id})".format(channel=channel),
             )
-            if all([await self.is_opt_enabled("delete"), not message.author.bot])
-            else None
+            .add_field(name=i18n("Content"), value=content or inline(i18n("No message content")))
+            # due to how LogEntry.add_field works, this will only display if value is not None
+            .add_field(
+                name=i18n("Attachments"),
+                value="\n".join([f"<{x}>" for x in attachments]) if attachments else None,
+            )
+        )
+
+    def _deleted_by(self, author_id: int, channel: discord.TextChannel):
+        # Discord only creates audit log entries for messages deleted by someone other
+        # than their author, so anything we don't find here was most likely self-deleted
+        return self.audit_entry(
+            discord.AuditLogAction.message_delete, author_id, channel_id=channel.id
         )
 
-    async def bulk_delete(self, channel: discord.TextChannel, message_ids: List[int]):
-        if not message_ids:
+    @staticmethod
+    async def _attach_cached(entry: LogEntry, message_id: int) -> LogEntry:
+        # re-upload any attachments we managed to save before the message was deleted
+        cache = get_attachment_cache()
+        if cache is not None:
+            for filename, data in await cache.pop(message_id):
+                entry.attach_file(filename, data)
+        return entry
+
+    async def delete(self, message: discord.Message):
+        if message.author.bot or not await self.is_opt_enabled("delete"):
             return None
-        return (
-            (
-                LogEntry(
-                    self,
-                    colour=discord.Colour.dark_red(),
-                    description=i18n("{count} messages were deleted from {channel}").format(
-                        count=len(message_ids), channel=channel.mention
-                    ),
-                    require_fields=False,
-                ).set_author(name=i18n("Message Bulk Deletion"), icon_url=self.icon_uri())
-            )
-            if await self.is_opt_enabled("bulkdelete")
-            else None
+        entry = self._deletion_entry(
+            message_id=message.id,
+            author=message.author,
+            channel=message.channel,
+            content=message.content,
+            attachments=[x.url for x in message.attachments],
+        ).add_audit_info(
+            self._deleted_by(message.author.id, message.channel), name=i18n("Deleted By")
         )
+        return await self._attach_cached(entry, message.id)
+
+    async def raw_delete(
+        self,
+        channel: discord.TextChannel,
+        message: StoredMessage,
+        author: Optional[discord.Member] = None,
+    ):
+        """Log the deletion of a message that isn't in discord.py's message cache"""
+        if not await self.is_opt_enabled("delete"):
+            return None
+        entry = self._deletion_entry(
+            message_id=message.id,
+            author=author or message.author_id,
+            channel=channel,
+            content=message.content,
+            attachments=[url for _, url in message.attachments],
+        ).add_audit_info(self._deleted_by(message.author_id, channel), name=i18n("Deleted By"))
+        return await self._attach_cached(entry, message.id)
+
+    async def bulk_delete(
+        self,
+        channel: discord.TextChannel,
+        message_ids: List[int],
+        messages: List[StoredMessage] = None,
+    ):
+        if not message_ids or not await self.is_opt_enabled("bulkdelete"):
+            return None
+
+        embed = LogEntry(
+            self,
+            colour=discord.Colour.dark_red(),
+            description=i18n("{count} messages were deleted from {channel}").format(
+                count=len(message_ids), channel=channel.mention
+            ),
+            require_fields=False,
+        ).set_author(name=i18n("Message Bulk Deletion"), icon_url=self.icon_uri())
+        embed.add_audit_info(
+            self.audit_entry(discord.AuditLogAction.message_bulk_delete, channel.id),
+            name=i18n("Deleted By"),
+        )
+
+        if messages:
+            embed.description += "\n\n" + i18n(
+                "A transcript of {count} recovered messages is attached."
+            ).format(count=len(messages))
+            embed.attach_generated(build_transcript(self.bot, channel, messages))
+
+        return embed
@@ -1,14 +1,21 @@
+from typing import List, Optional, Tuple
+
 import discord
 
 from logs.core import Module, LogEntry, i18n
+from logs.core.coalesce import COALESCED, Coalescer, describe_moves, net_moves
 
 from cog_shared.swift_libs.formatting import permissions
 
+# How long position changes are collected for before being logged as a single entry
+REORDER_DELAY = 2.0
+
 
 class RoleModule(Module):
     name = "role"
     friendly_name = i18n("Role")
     description = i18n("Role creation, deletion and update logging")
+    compact_icon = "\N{LABEL}"
     settings = {
         "create": i18n("Role creations"),
         "delete": i18n("Role deletions"),
@@ -21,6 +28,44 @@ class RoleModule(Module):
             "position": i18n("A roles position in the role hierarchy"),
         },
     }
+    tracked_attributes = {
+        "update": {
+            "name": ("update", "name"),
+            "mentionable": ("update", "mentionable"),
+            "hoist": ("update", "hoist"),
+            "colour": ("update", "colour"),
+            "permissions": ("update", "permissions"),
+            "position": ("update", "position"),
+        }
+    }
+
+    _reorders: Optional[Coalescer] = None
+
+    @classmethod
+    def register(cls):
+        cls._reorders = Coalescer(cls._log_reorder, delay=REORDER_DELAY, max_items=500)
+
+    @classmethod
+    def unregister(cls):
+        if cls._reorders is not None:
+            cls._reorders.close()
+            cls._reorders = None
+
+    @classmethod
+    async def _log_reorder(cls, guild_id: int, changes: List[Tuple[discord.Role, discord.Role]]):
+        module = cls(changes[-1][1].guild)
+        moves = net_moves(changes, "position")
+        if not moves:
+            return
+        embed = LogEntry(
+            module,
+            colour=discord.Colour.blurple(),
+            require_fields=False,
+            description=i18n("{count} roles were moved:\n\n{moves}").format(
+                count=len(moves), moves=describe_moves(moves)
+            ),
+        ).set_author(name=i18n("Roles Reordered"), icon_url=module.icon_uri())
+        await module.log_coalesced(embed, event="reorder")
 
     async def create(self, role: discord.Role):
         if not await self.is_opt_enabled("create"):
@@ -57,7 +102,7 @@ class RoleModule(Module):
             inline=False,
         )
 
-        return embed
+        return embed.add_audit_info(self.audit_entry(discord.AuditLogAction.role_create, role.id))
 
     async def delete(self, role: discord.Role):
         if not await self.is_opt_enabled("delete"):
@@ -72,9 +117,19 @@ class RoleModule(Module):
             )
             .set_author(name=i18n("Role Deleted"), icon_url=self.icon_uri())
             .set_footer(text=i18n("Role ID: {}").format(role.id))
+            .add_audit_info(self.audit_entry(discord.AuditLogAction.role_delete, role.id))
         )
 
     async def update(self, before: discord.Role, after: discord.Role):
+        # Moving a single role causes an update for every role whose position shifted,
+        # so position-only updates are collected and logged together as a single entry
+        changed = self.changed_attributes("update", before, after)
+        if changed == ["position"] and self._reorders is not None:
+            if not await self.is_opt_enabled("update", "position"):
+                return None
+            self._reorders.add(self.guild.id, (before, after))
+            return COALESCED
+
         embed = LogEntry(
             self,
             colour=discord.Colour.blurple(),
@@ -83,7 +138,7 @@ class RoleModule(Module):
         embed.set_author(name=i18n("Role Updated"), icon_url=self.icon_uri())
         embed.set_footer(text=i18n("Role ID: {}").format(after.id))
 
-        return await embed.add_multiple_changed(
+        await embed.add_multiple_changed(
             before,
             after,
             [
@@ -118,3 +173,8 @@ class RoleModule(Module):
                 },
             ],
         )
+
+        # only look up who made the change if there's anything to show in the first place
+        if embed.fields:
+            embed.add_audit_info(self.audit_entry(discord.AuditLogAction.role_update, after.id))
+        return embed
@@ -1,34 +1,116 @@
+from typing import List, Optional, Tuple
+
 import discord
 
 from logs.core import Module, LogEntry, i18n
+from logs.core.coalesce import COALESCED, Coalescer
+
+# How long a member's voice state changes are collected for before being logged together
+TRANSITION_DELAY = 10.0
+# Bounds on the amount of members with pending changes, and pending changes per member
+MAX_MEMBERS = 1000
+MAX_TRANSITIONS = 25
+
+Transition = Tuple[discord.VoiceState, discord.VoiceState]
 
 
 class VoiceModule(Module):
     name = "voice"
     friendly_name = i18n("Voice")
     description = i18n("Voice status logging")
+    compact_icon = "\N{SPEAKER WITH THREE SOUND WAVES}"
     settings = {
         "channel": i18n("Channel joining, leaving, and switching"),
         "mute": {"self": i18n("Self mute"), "server": i18n("Server mute")},
         "deaf": {"self": i18n("Self deaf"), "server": i18n("Server deaf")},
     }
+    tracked_attributes = {
+        "update": {
+            "channel": ("channel",),
+            "self_mute": ("mute", "self"),
+            "mute": ("mute", "server"),
+            "self_deaf": ("deaf", "self"),
+            "deaf": ("deaf", "server"),
+        }
+    }
+
+    _transitions: Optional[Coalescer] = None
+
+    @classmethod
+    def register(cls):
+        cls._transitions = Coalescer(
+            cls._log_transitions,
+            delay=TRANSITION_DELAY,
+            max_keys=MAX_MEMBERS,
+            max_items=MAX_TRANSITIONS,
+        )
+
+    @classmethod
+    def unregister(cls):
+        if cls._transitions is not None:
+            cls._transitions.close()
+            cls._transitions = None
+
+    @classmethod
+    async def _log_transitions(
+        cls, key: Tuple[int, int], transitions: List[Tuple[discord.VoiceState, ...]]
+    ):
+        member: discord.Member = transitions[-1][2]
+        module = cls(member.guild)
+        entry = await module._build_entry(member, [(x[0], x[1]) for x in transitions])
+        await module.log_coalesced(entry, event="update", args=(member,))
 
     async def update(
         self, before: discord.VoiceState, after: discord.VoiceState, member: discord.Member
     ):
+        # Members joining, leaving, switching channels or toggling their mute in quick
+        # succession are logged as a single entry with the net change
+        if self._transitions is None:
+            return await self._build_entry(member, [(before, after)])
+        self._transitions.add((self.guild.id, member.id), (before, after, member))
+        return COALESCED
+
+    @staticmethod
+    def _channel_steps(transitions: List[Transition]) -> List[str]:
+        steps = []
+        for before, after in transitions:
+            if before.channel == after.channel:
+                continue
+            if before.channel is None:
+                steps.append(i18n("joined {}").format(after.channel.mention))
+            elif after.channel is None:
+                steps.append(i18n("left {}").format(before.channel.mention))
+            else:
+                steps.append(i18n("moved to {}").format(after.channel.mention))
+        return steps
+
+    async def _build_entry(self, member: discord.Member, transitions: List[Transition]):
+        first, last = transitions[0][0], transitions[-1][1]
         embed = LogEntry(self, colour=discord.Colour.greyple())
         embed.set_author(name="Member Voice State Updated", icon_url=self.icon_uri(member))
         embed.description = i18n("Member: {}").format(member.mention)
-        embed.set_footer(text=i18n("Member ID: {}").format(member.id))
-
-        return await embed.add_multiple_changed(
-            before,
-            after,
-            [
-                {"name": i18n("Channel"), "value": "channel", "config_opt": ("channel",)},
-                {"name": i18n("Self Mute"), "value": "self_mute", "config_opt": ("mute", "self")},
-                {"name": i18n("Server Mute"), "value": "mute", "config_opt": ("mute", "server")},
-                {"name": i18n("Self Deaf"), "value": "self_deaf", "config_opt": ("deaf", "self")},
-                {"name": i18n("Server Deaf"), "value": "deaf", "config_opt": ("deaf", "server")},
-            ],
-        )
+        if len(transitions) > 1:
+            embed.set_footer(
+                text=i18n("Member ID: {id} \N{BULLET} {count} transitions").format(
+                    id=member.id, count=len(transitions)
+                )
+            )
+        else:
+            embed.set_footer(text=i18n("Member ID: {}").format(member.id))
+
+        checks = [
+            {"name": i18n("Self Mute"), "value": "self_mute", "config_opt": ("mute", "self")},
+            {"name": i18n("Server Mute"), "value": "mute", "config_opt": ("mute", "server")},
+            {"name": i18n("Self Deaf"), "value": "self_deaf", "config_opt": ("deaf", "self")},
+            {"name": i18n("Server Deaf"), "value": "deaf", "config_opt": ("deaf", "server")},
+        ]
+        steps = self._channel_steps(transitions)
+        if len(steps) > 1:
+            if await self.is_opt_enabled("channel"):
+                embed.add_field(name=i18n("Channel"), value=", ".join(steps))
+        else:
+            checks.insert(
+                0, {"name": i18n("Channel"), "value": "channel", "config_opt": ("channel",)}
+            )
+
+        return await embed.add_multiple_changed(first, last, checks)
@@ -0,0 +1,511 @@
+"""Offline replay harness for event recordings
+
+Usage: python -m logs.replay <recording.jsonl> [--speed N] [--workers N] [--compact]
+
+Recordings are made with `[p]logset record`. Every recorded object is rebuilt as a lightweight
+stand-in for the real discord.py object, and fed through the cog's listeners with every module
+enabled and logging to a fake channel per server. Nothing is sent to Discord, and no existing
+Config data is read or written.
+
+By default, events are replayed as fast as possible; `--speed 1` replays them with their
+original timing, which gives a more realistic picture of how log entries are batched.
+`--compact` logs every module in the compact text format instead of with embeds.
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import discord
+from discord.raw_models import RawBulkMessageDeleteEvent, RawMessageDeleteEvent
+
+__all__ = ("World", "replay")
+
+_fake_types: Dict[tuple, type] = {}
+
+
+def fake(cls: type, **attrs):
+    """Create a stand-in for a discord.py object
+
+    The returned object passes `isinstance` checks for `cls`, but only has the attributes given;
+    any properties of `cls` with the same name are shadowed by them.
+    """
+    key = (cls, tuple(sorted(attrs)))
+    fake_cls = _fake_types.get(key)
+    if fake_cls is None:
+        fake_cls = _fake_types[key] = type("Fake" + cls.__name__, (cls,), dict.fromkeys(attrs))
+    obj = object.__new__(fake_cls)
+    obj.__dict__.update(attrs)
+    return obj
+
+
+def _avatar(*_, **__) -> str:
+    return "https://cdn.discordapp.com/embed/avatars/0.png"
+
+
+def _dt(ts: Optional[float]) -> Optional[datetime]:
+    return None if ts is None else datetime.utcfromtimestamp(ts)
+
+
+class LogChannel:
+    """Counts the messages that would have been sent to a server's log channel"""
+
+    def __init__(self, world: "World", channel_id: int, guild):
+        self.channel = fake(
+            discord.TextChannel,
+            id=channel_id,
+            guild=guild,
+            name="logs",
+            mention="<#{}>".format(channel_id),
+            send=self.send,
+            permissions_for=lambda *_: discord.Permissions.all(),
+        )
+        self.world = world
+        self.messages = 0
+        self.embeds = 0
+        self.files = 0
+
+    async def send(self, content=None, *, embed=None, files=None, **kwargs):
+        if embed is not None:
+            self.embeds += 1
+        self.messages += 1
+        self.files += len(files or [])
+
+
+class World:
+    """Rebuilds recorded objects, keeping track of every server, channel and role seen"""
+
+    def __init__(self):
+        self.guilds: Dict[int, Any] = {}
+        self.channels: Dict[int, Any] = {}
+        self.roles: Dict[int, Any] = {}
+        self.members: Dict[int, Dict[int, Any]] = defaultdict(dict)
+        self.users: Dict[int, Any] = {}
+        self.log_channels: Dict[int, LogChannel] = {}
+
+    def guild(self, guild_id: int, data: dict = None):
+        guild = self.guilds.get(guild_id)
+        if guild is None:
+            me = fake(
+                discord.Member,
+                id=0,
+                name="Logs",
+                display_name="Logs",
+                guild_permissions=discord.Permissions.none(),
+                avatar_url_as=_avatar,
+            )
+            guild = self.guilds[guild_id] = self._guild(guild_id, me=me)
+            # log channel IDs can't collide with any real snowflake
+            log_channel = LogChannel(self, len(self.log_channels) + 1, guild)
+            self.log_channels[guild_id] = log_channel
+            self.channels[log_channel.channel.id] = log_channel.channel
+        if data is None:
+            return guild
+        # server updates have distinct before and after objects
+        return self._guild(
+            guild_id,
+            me=guild.me,
+            name=data["name"],
+            owner_id=data["owner"],
+            owner=self.members[guild_id].get(data["owner"]),
+            mfa_level=data["mfa_level"],
+            afk_channel=self.channels.get(data["afk_channel"]),
+            afk_timeout=data["afk_timeout"],
+            region=data["region"],
+            explicit_content_filter=data["explicit_content_filter"],
+            unavailable=data["unavailable"],
+        )
+
+    def _guild(self, guild_id: int, **attrs):
+        members = self.members[guild_id]
+        attrs.setdefault("name", str(guild_id))
+        attrs.setdefault("unavailable", False)
+        return fake(
+            discord.Guild,
+            id=guild_id,
+            get_member=members.get,
+            get_channel=self.channels.get,
+            get_role=self.roles.get,
+            icon_url_as=_avatar,
+            **attrs
+        )
+
+    def build(self, data):
+        if isinstance(data, list):
+            return [self.build(x) for x in data]
+        if not isinstance(data, dict):
+            return data
+        return getattr(self, "_build_" + data["type"], lambda x: None)(data)
+
+    def _build_guild(self, data: dict):
+        return self.guild(data["id"], data)
+
+    def _role(self, role_id: int, guild):
+        role = self.roles.get(role_id)
+        if role is None:
+            role = self._build_role(
+                {
+                    "id": role_id,
+                    "guild": guild.id,
+                    "name": str(role_id),
+                    "position": 0,
+                    "colour": 0,
+                    "permissions": 0,
+                    "hoist": False,
+                    "mentionable": False,
+                }
+            )
+        return role
+
+    def _build_role(self, data: dict):
+        role = fake(
+            discord.Role,
+            id=data["id"],
+            guild=self.guild(data["guild"]),
+            name=data["name"],
+            mention="<@&{}>".format(data["id"]),
+            position=data["position"],
+            colour=discord.Colour(data["colour"]),
+            permissions=discord.Permissions(data["permissions"]),
+            hoist=data["hoist"],
+            mentionable=data["mentionable"],
+        )
+        self.roles[role.id] = role
+        return role
+
+    def _build_channel(self, data: dict):
+        guild = self.guild(data["guild"])
+        channel = fake(
+            getattr(discord, data["kind"], discord.TextChannel),
+            id=data["id"],
+            guild=guild,
+            name=data["name"],
+            mention="<#{}>".format(data["id"]),
+            position=data["position"],
+            category_id=data["category"],
+            category=self.channels.get(data["category"]),
+            topic=data["topic"],
+            bitrate=data["bitrate"],
+            user_limit=data["user_limit"],
+        )
+        self.channels[channel.id] = channel
+        return channel
+
+    def _build_user(self, data: dict):
+        user = fake(
+            discord.User,
+            id=data["id"],
+            name=data["name"],
+            discriminator=data["discriminator"],
+            display_name=data["name"],
+            mention="<@{}>".format(data["id"]),
+            bot=data["bot"],
+            avatar=data["avatar"],
+            avatar_url_as=_avatar,
+            created_at=_dt(data["created_at"]),
+        )
+        self.users[user.id] = user
+        return user
+
+    def _build_member(self, data: dict):
+        guild = self.guild(data["guild"])
+        member = fake(
+            discord.Member,
+            id=data["id"],
+            guild=guild,
+            name=data["name"],
+            discriminator=data["discriminator"],
+            nick=data["nick"],
+            display_name=data["nick"] or data["name"],
+            mention="<@{}>".format(data["id"]),
+            bot=data["bot"],
+            avatar=data["avatar"],
+            avatar_url_as=_avatar,
+            _roles=list(data["roles"]),
+            roles=[self._role(x, guild) for x in data["roles"]],
+            joined_at=_dt(data["joined_at"]),
+            created_at=_dt(data["created_at"]),
+        )
+        self.members[guild.id][member.id] = member
+        return member
+
+    def _build_voice_state(self, data: dict):
+        return fake(
+            discord.VoiceState,
+            channel=self.channels.get(data["channel"]),
+            self_mute=data["self_mute"],
+            self_deaf=data["self_deaf"],
+            mute=data["mute"],
+            deaf=data["deaf"],
+        )
+
+    def _build_message(self, data: dict):
+        guild = self.guild(data["guild"]) if data["guild"] is not None else None
+        channel = self.channels.get(data["channel"])
+        if channel is None and guild is not None:
+            channel = self._build_channel(
+                {
+                    "kind": "TextChannel",
+                    "id": data["channel"],
+                    "guild": guild.id,
+                    "name": str(data["channel"]),
+                    "position": 0,
+                    "category": None,
+                    "topic": None,
+                    "bitrate": None,
+                    "user_limit": None,
+                }
+            )
+        return fake(
+            discord.Message,
+            id=data["id"],
+            guild=guild,
+            channel=channel,
+            author=self.build(data["author"]),
+            content=data["content"],
+            attachments=[
+                fake(discord.Attachment, filename=filename, url=url)
+                for filename, url in data["attachments"]
+            ],
+            created_at=_dt(data["created_at"]),
+        )
+
+    def _build_raw_delete(self, data: dict):
+        return fake(
+            RawMessageDeleteEvent,
+            message_id=data["id"],
+            channel_id=data["channel"],
+            # recordings made before this was recorded are treated as cache misses
+            cached_message=self.build(data.get("cached")),
+        )
+
+    def _build_raw_bulk_delete(self, data: dict):
+        return fake(
+            RawBulkMessageDeleteEvent, message_ids=set(data["ids"]), channel_id=data["channel"]
+        )
+
+
+class FakeBot:
+    def __init__(self, world: World, loop: asyncio.AbstractEventLoop):
+        self.world = world
+        self.loop = loop
+        self.user = fake(discord.ClientUser, id=0, name="Logs", avatar_url_as=_avatar)
+
+    def get_channel(self, channel_id: int):
+        return self.world.channels.get(channel_id)
+
+    def get_guild(self, guild_id: int):
+        return self.world.guilds.get(guild_id)
+
+    def get_user(self, user_id: int):
+        return self.world.users.get(user_id)
+
+    async def wait_until_ready(self):
+        pass
+
+
+def _seed_settings(world: World, guild_id: int, *, compact: bool = False):
+    """Pre-seed the settings cache to log everything in the given server"""
+    from logs.core.config import root_defaults
+    from logs.core.settings import GuildSettings, _cache
+    from logs.core.utils import replace_dict_items
+    from logs.modules import modules
+
+    data = {**root_defaults, "archive": {"enabled": False, "retention": 0}}
+    for module in modules.values():
+        module = module(guild=None)
+        data[module.name] = {
+            **replace_dict_items(module.settings, True),
+            "_log_channel": world.log_channels[guild_id].channel.id,
+            "_webhook": None,
+            "_compact": compact,
+        }
+    _cache[guild_id] = GuildSettings(guild_id, data)
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+async def replay(
+    path: str, *, speed: float = 0, workers: int = 4, compact: bool = False, out=sys.stdout
+) -> dict:
+    from logs.core import coalesce, delivery
+    from logs.core.module import get_pipeline
+    from logs.logs import Logs
+    from logs.modules import modules
+
+    loop = asyncio.get_event_loop()
+    world = World()
+    cog = Logs(FakeBot(world, loop))
+    cog._archive_task.cancel()
+    await cog._init_task
+    pipeline = get_pipeline()
+    await pipeline.resize(workers)
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    handler = pipeline.handler
+
+    async def timed_handler(module: str, event: str, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await handler(module, event, *args, **kwargs)
+        finally:
+            latencies[module].append(time.perf_counter() - start)
+
+    pipeline.handler = timed_handler
+
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(x) for x in f if x.strip()]
+
+    seeded = set()
+    events = skipped = 0
+    started = time.perf_counter()
+    for record in records:
+        if speed:
+            delay = record["t"] / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        args = world.build(record["a"])
+        for guild_id in set(world.guilds) - seeded:
+            _seed_settings(world, guild_id, compact=compact)
+            seeded.add(guild_id)
+        listener = getattr(cog, "on_" + record["e"], None)
+        if listener is None or None in args:
+            skipped += 1
+            continue
+        await listener(*args)
+        events += 1
+        if not speed and events % 100 == 0:
+            # let workers catch up, as they would between gateway events
+            await asyncio.sleep(0)
+    ingested = time.perf_counter() - started
+
+    while pipeline.stats["processed"] < pipeline.stats["submitted"]:
+        await asyncio.sleep(0.01)
+    flushes = []
+    for module in modules.values():
+        for attr in vars(module).values():
+            if isinstance(attr, coalesce.Coalescer):
+                flushes += attr.flush_all()
+    if flushes:
+        await asyncio.wait(flushes)
+    batchers = list(delivery._batchers.values())
+    flushes = delivery.close_batchers()
+    if flushes:
+        await asyncio.wait(flushes)
+    elapsed = time.perf_counter() - started
+    cog._Logs__unload()
+
+    sent = defaultdict(int)
+    for batcher in batchers:
+        for key, value in batcher.stats.items():
+            sent[key] += value
+    report = {
+        "events": events,
+        "skipped": skipped,
+        "submitted": pipeline.stats["submitted"],
+        "dropped": pipeline.stats["dropped"],
+        "errors": pipeline.stats["errors"],
+        "ingest_seconds": ingested,
+        "total_seconds": elapsed,
+        "throughput": events / ingested if ingested else 0.0,
+        "messages": sum(x.messages for x in world.log_channels.values()),
+        "embeds": sum(x.embeds for x in world.log_channels.values()),
+        "files": sum(x.files for x in world.log_channels.values()),
+        "delivery": dict(sent),
+        "latency": {
+            module: {
+                "count": len(values),
+                "mean_ms": statistics.mean(values) * 1000,
+                "p50_ms": _percentile(values, 0.5) * 1000,
+                "p95_ms": _percentile(values, 0.95) * 1000,
+                "max_ms": max(values) * 1000,
+            }
+            for module, values in sorted(latencies.items())
+        },
+    }
+    _print_report(report, out)
+    return report
+
+
+def _print_report(report: dict, out) -> None:
+    print(
+        "Replayed {events} events ({skipped} skipped) in {ingest_seconds:.2f}s "
+        "\N{EM DASH} {throughput:.0f} events/s".format(**report),
+        file=out,
+    )
+    print(
+        "Pipeline: {submitted} submitted, {dropped} dropped, {errors} errors; "
+        "drained after {total_seconds:.2f}s".format(**report),
+        file=out,
+    )
+    print(
+        "Delivery: {messages} messages carrying {embeds} embeds and {files} files".format(**report),
+        file=out,
+    )
+    if report["delivery"]:
+        print(
+            "          "
+            + ", ".join("{} {}".format(v, k) for k, v in sorted(report["delivery"].items())),
+            file=out,
+        )
+    print(
+        "\n{:<10}{:>8}{:>10}{:>10}{:>10}{:>10}".format(
+            "module", "events", "mean", "p50", "p95", "max"
+        ),
+        file=out,
+    )
+    row = "{:<10}{count:>8}{mean_ms:>8.2f}ms{p50_ms:>8.2f}ms{p95_ms:>8.2f}ms{max_ms:>8.2f}ms"
+    for module, stats in report["latency"].items():
+        print(row.format(module, **stats), file=out)
+
+
+def _prepare_red(data_path: str) -> None:
+    # Config and cog_data_path both need Red's basic configuration to be loaded before the
+    # cog is imported; point it at a throwaway data directory
+    from redbot.core import data_manager
+
+    data_manager.basic_config = {
+        **getattr(data_manager, "basic_config_default", {}),
+        "DATA_PATH": data_path,
+        "STORAGE_TYPE": "JSON",
+        "STORAGE_DETAILS": {},
+    }
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m logs.replay", description=__doc__.split("\n")[0]
+    )
+    parser.add_argument("recording", help="Event recording made with [p]logset record")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=0,
+        help="Replay speed relative to the original recording; 0 replays as fast as possible",
+    )
+    parser.add_argument("--workers", type=int, default=4, help="Amount of pipeline workers")
+    parser.add_argument(
+        "--compact", action="store_true", help="Log in the compact text format instead of embeds"
+    )
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as data_path:
+        _prepare_red(data_path)
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(
+            replay(args.recording, speed=args.speed, workers=args.workers, compact=args.compact)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,93 @@
+import asyncio
+from collections import defaultdict
 from datetime import datetime
-from typing import List, Optional
+from random import choice
+from typing import Dict, List, Optional, Set
 
 import discord
 from redbot.core import commands
 from redbot.core import Config
 from redbot.core.bot import Red
+from redbot.core.config import Group
 from redbot.core.i18n import Translator
 
-__all__ = ("i18n", "conf", "Quote", "ensure_can_modify")
+from quotes import search
+
+__all__ = (
+    "i18n",
+    "conf",
+    "Quote",
+    "ensure_can_modify",
+    "get_quotes",
+    "load_quotes",
+    "migrate",
+    "quote_group",
+    "reset_migrations",
+)
 
 conf = Config.get_conf(
     cog_instance=None, cog_name="Quotes", identifier=441356724, force_registration=True
 )
-conf.register_guild(quotes=[])
+# `quotes` is the legacy storage format, a single list where each quote's ID is its position in it;
+# quotes are now stored one per key in the QUOTES custom group, and `next_id` is the ID the
+# next created quote is given, which is never reused, even after the quote it went to is deleted
+conf.register_guild(quotes=[], next_id=1)
 
 i18n = Translator("Quotes", __file__)
 
+# Guilds whose legacy quotes have been checked for migration since the cog was loaded
+_migrated: Set[int] = set()
+# Held while allocating quote IDs or migrating a guild's quotes
+_locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+
+def quote_group(guild: discord.Guild) -> Group:
+    return conf.custom("QUOTES", guild.id)
+
+
+async def migrate(guild: discord.Guild) -> int:
+    """Move any quotes in the guild's legacy list into keyed storage
+
+    Quotes keep their position in the list as their ID, offset by any quotes the guild
+    already has in keyed storage. Returns the amount of quotes that were migrated.
+    """
+    async with _locks[guild.id]:
+        if guild.id in _migrated:
+            return 0
+        legacy = await conf.guild(guild).quotes()
+        if legacy:
+            next_id = await conf.guild(guild).next_id()
+            quotes = await quote_group(guild)()
+            quotes.update({str(quote_id): data for quote_id, data in enumerate(legacy, next_id)})
+            await quote_group(guild).set(quotes)
+            await conf.guild(guild).next_id.set(next_id + len(legacy))
+            # only drop the legacy list once everything in it has been written
+            await conf.guild(guild).quotes.clear()
+        _migrated.add(guild.id)
+        return len(legacy)
+
+
+def reset_migrations() -> None:
+    """Re-check every guild for legacy quotes the next time their quotes are accessed"""
+    _migrated.clear()
+    # migrated quotes aren't added to search indexes, so they have to be rebuilt afterwards
+    search.clear_indexes()
+
+
+async def get_quotes(guild: discord.Guild) -> Group:
+    """Get the group the given guild's quotes are stored in, migrating them first if needed"""
+    if guild.id not in _migrated:
+        await migrate(guild)
+    return quote_group(guild)
+
+
+async def load_quotes(guild: discord.Guild) -> Dict[str, dict]:
+    """Read every quote in the given guild in a single Config read, keyed by their ID"""
+    # Reading the group itself merges the stored data into a copy of the group's defaults,
+    # which copies every quote a second time; the QUOTES group has no defaults to merge,
+    # so the raw data is read directly instead
+    return await (await get_quotes(guild)).get_raw(default=None) or {}
+
 
 async def ensure_can_modify(member: discord.Member, quote: "Quote"):
     # https://u.odinair.xyz/bBQzxMd.png
@@ -137,21 +209,37 @@ class Quote(commands.Converter):
 
     async def save(self):
         """Save any changes made to the current quote"""
-        async with conf.guild(self.guild).quotes() as quotes:
-            quotes[self.id - 1].update(self.as_dict)
+        await (await get_quotes(self.guild)).set_raw(str(self.id), value=self.as_dict)
+        index = search.get_index(self.guild.id)
+        if index is not None:
+            index.add(self.id, self.text)
 
     async def delete(self):
-        """Delete the current quote"""
-        async with conf.guild(self.guild).quotes() as quotes:
-            del quotes[self.id - 1]
+        """Delete the current quote
+
+        The quote's ID is not reused by any quotes created afterwards.
+        """
+        await (await get_quotes(self.guild)).clear_raw(str(self.id))
+        index = search.get_index(self.guild.id)
+        if index is not None:
+            index.remove(self.id)
 
     @classmethod
     async def get(cls, guild: discord.Guild, quote_id: int) -> Optional["Quote"]:
         """Retrieve a specific quote from a guild"""
-        quotes = list(await conf.guild(guild).quotes())
-        if 0 < len(quotes) >= quote_id:
-            return cls(guild=guild, id=quote_id, **quotes[quote_id - 1])
-        return None
+        data = await (await get_quotes(guild)).get_raw(str(quote_id), default=None)
+        if data is None:
+            return None
+        return cls(guild=guild, id=quote_id, **data)
+
+    @classmethod
+    async def random(cls, guild: discord.Guild) -> Optional["Quote"]:
+        """Retrieve a random quote from a guild"""
+        quotes = await load_quotes(guild)
+        if not quotes:
+            return None
+        quote_id = choice(list(quotes.keys()))
+        return cls(guild=guild, id=int(quote_id), **quotes[quote_id])
 
     @classmethod
     async def create(
@@ -164,18 +252,47 @@ class Quote(commands.Converter):
             "text": text,
             "timestamp": datetime.utcnow().timestamp(),
         }
-        async with conf.guild(guild).quotes() as quotes:
-            quotes.append(quote)
-        return cls(guild=guild, **quote, id=len(quotes))
+        quotes = await get_quotes(guild)
+        async with _locks[guild.id]:
+            quote_id = await conf.guild(guild).next_id()
+            # the ID is allocated before the quote is written, so it can never be handed out twice
+            await conf.guild(guild).next_id.set(quote_id + 1)
+        await quotes.set_raw(str(quote_id), value=quote)
+        index = search.get_index(guild.id)
+        if index is not None:
+            index.add(quote_id, text)
+        return cls(guild=guild, **quote, id=quote_id)
 
     @classmethod
     async def all_quotes(cls, guild: discord.Guild) -> List["Quote"]:
-        # FIXME: This is extremely unoptimized, and results in a noticeable delay
-        #        when getting the quote list in servers with around 150 or more quotes
-        quotes = []
-        for i in range(len(await conf.guild(guild).quotes())):
-            quotes.append(await cls.get(guild, quote_id=i + 1))
-        return quotes
+        """Retrieve every quote in a guild, ordered by their ID
+
+        The guild's quotes are only read from Config once, and members are only
+        looked up as they're accessed on each quote.
+        """
+        quotes = await load_quotes(guild)
+        return [
+            cls(guild=guild, id=quote_id, **quotes[str(quote_id)])
+            for quote_id in sorted(int(x) for x in quotes.keys())
+        ]
+
+    @classmethod
+    async def search(cls, guild: discord.Guild, query: str, *, limit: int = 10) -> List["Quote"]:
+        """Find the quotes in a guild that best match the given query, best match first
+
+        The guild's search index is built the first time it's searched, and is then kept
+        up to date as quotes are created, edited and deleted.
+        """
+
+        async def load():
+            return [(x.id, x.text) for x in await cls.all_quotes(guild)]
+
+        index = await search.ensure_index(guild.id, load)
+        # only the matched quotes are read from Config, rather than every quote in the guild
+        quotes = [
+            await cls.get(guild, quote_id) for quote_id, _ in index.search(query, limit=limit)
+        ]
+        return [x for x in quotes if x is not None]
 
     # noinspection PyMethodOverriding
     @staticmethod
@@ -1,5 +1,4 @@
 from pathlib import Path
-from random import randint
 
 import discord
 from redbot.core import checks, commands
@@ -17,8 +16,9 @@ from cog_shared.swift_libs import (
     to_lazy_translator,
     trim_to,
 )
+from quotes import search
 from quotes.editor import QuoteEditor
-from quotes.quote import Quote, conf, ensure_can_modify, i18n
+from quotes.quote import Quote, conf, ensure_can_modify, i18n, quote_group
 from quotes.v2_import import import_v2_data
 
 lazyi18n = to_lazy_translator(i18n)
@@ -40,6 +40,9 @@ class Quotes:
         self.config = conf
         Quote.bot = self.bot
 
+    def __unload(self):
+        search.clear_indexes()
+
     @commands.group(name="quote", aliases=["quotes"], invoke_without_command=True)
     @commands.guild_only()
     async def quote(self, ctx: commands.Context, quote: Quote = None):
@@ -48,11 +51,10 @@ class Quotes:
         If no quote is given, a random quote is retrieved instead.
         """
         if quote is None:
-            quotes = len(await self.config.guild(ctx.guild).quotes())
-            if not quotes:
+            quote = await Quote.random(ctx.guild)
+            if quote is None:
                 await ctx.send_help()
                 return
-            quote = await Quote.get(ctx.guild, randint(1, quotes))
 
         await ctx.send(embed=quote.embed)
 
@@ -109,7 +111,10 @@ class Quotes:
             await ctx.send(i18n("Operation cancelled."))
             return
 
-        await self.config.guild(ctx.guild).quotes.set([])
+        # quote IDs are intentionally left as-is, so old IDs never point at newly added quotes
+        await self.config.guild(ctx.guild).quotes.clear()
+        await quote_group(ctx.guild).clear()
+        search.drop_index(ctx.guild.id)
         await ctx.tick()
 
     @quote.command(hidden=True, name="v2_import")
@@ -176,6 +181,34 @@ class Quotes:
             tick(i18n("Attributed quote #{} to **{}**.").format(int(quote), str(author)))
         )
 
+    @quote.command(name="search")
+    async def quote_search(self, ctx: commands.Context, *, query: str):
+        """Search the quotes in the current guild
+
+        Quotes containing every word in your search are shown first, followed by
+        quotes that only contain some of them. Words of three or more letters also
+        match longer words they're a part of.
+        """
+        async with ctx.typing():
+            quotes = await Quote.search(ctx.guild, query, limit=10)
+
+        if not quotes:
+            await ctx.send(warning(i18n("I couldn't find any quotes matching your search.")))
+            return
+
+        embed = discord.Embed(
+            colour=ctx.me.colour,
+            title=i18n("Quote Search"),
+            description=i18n("Showing the {} best matches for **{}**").format(
+                len(quotes), trim_to(query, 200)
+            ),
+        )
+        for q in quotes:
+            embed.add_field(
+                name=i18n("Quote #{}").format(q.id), value=trim_to(q.text, 400), inline=False
+            )
+        await ctx.send(embed=embed)
+
     @quote.command(name="list")
     async def quote_list(self, ctx: commands.Context, per_page: int = 8):
         """List the quotes in the current guild
@@ -0,0 +1,290 @@
+import asyncio
+import heapq
+import math
+import re
+from collections import Counter, OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+__all__ = ("QuoteIndex", "clear_indexes", "drop_index", "ensure_index", "get_index", "tokenize")
+
+# Matches on part of a word only count for this fraction of a whole word match
+PARTIAL_WEIGHT = 0.5
+# BM25 tuning; how quickly repeated terms stop adding to a quote's score,
+# and how much longer quotes are penalized
+K1 = 1.2
+B = 0.75
+# Amount of recent search results kept per guild; these are dropped whenever a quote changes
+RESULT_CACHE_SIZE = 128
+
+_TOKEN_RE = re.compile(r"\w+")
+_indexes: Dict[int, "QuoteIndex"] = {}
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.casefold())
+
+
+def trigrams(token: str) -> Set[str]:
+    return {token[i : i + 3] for i in range(len(token) - 2)}
+
+
+class QuoteIndex:
+    """Inverted index over the quotes in a single guild
+
+    Each word maps to the quotes it appears in, and each trigram maps to the words it
+    appears in, which is used to find words that contain a partial query term without
+    having to look through every quote.
+
+    Changes made while the index is still being built are held back, and applied
+    once it's ready.
+    """
+
+    def __init__(self):
+        # word -> {quote id -> occurrences}
+        self.postings: Dict[str, Dict[int, int]] = {}
+        # trigram -> words containing it
+        self.trigrams: Dict[str, Set[str]] = {}
+        # quote id -> the distinct words in it, used to unlink it from postings when removed
+        self.words: Dict[int, Tuple[str, ...]] = {}
+        # quote id -> amount of words in it
+        self.lengths: Dict[int, int] = {}
+        self.total_length = 0
+        # word -> {quote id -> BM25 term score without IDF}, kept alongside postings so that
+        # searching for common words doesn't have to score every quote they're in from scratch
+        self.impacts: Dict[str, Dict[int, float]] = {}
+        # the average quote length the above scores were computed with; they're only recomputed
+        # once the actual average drifts far enough away from it to noticeably change rankings
+        self._average = 0.0
+        self._results: "OrderedDict[Tuple[str, int], List[Tuple[int, float]]]" = OrderedDict()
+        self.ready = False
+        self._ready = asyncio.Event()
+        self._backlog: List[Tuple[str, int, Optional[str]]] = []
+
+    def __repr__(self):
+        return "<QuoteIndex quotes={} words={}>".format(len(self), len(self.postings))
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def build(self, quotes: Iterable[Tuple[int, str]]) -> None:
+        for quote_id, text in quotes:
+            self._add(quote_id, text)
+        self._reweigh()
+
+    def _norm(self, quote_id: int) -> float:
+        return K1 * (1 - B + B * self.lengths[quote_id] / (self._average or 1))
+
+    def _reweigh(self) -> None:
+        """Recompute every quote's term scores against the current average quote length"""
+        self._average = self.total_length / len(self.lengths) if self.lengths else 0.0
+        self.impacts = {}
+        for word, postings in self.postings.items():
+            self.impacts[word] = {
+                quote_id: freq * (K1 + 1) / (freq + self._norm(quote_id))
+                for quote_id, freq in postings.items()
+            }
+
+    def finish(self) -> None:
+        """Mark the index as ready, and apply any changes made while it was being built"""
+        self.ready = True
+        self._ready.set()
+        backlog, self._backlog = self._backlog, []
+        for op, quote_id, text in backlog:
+            if op == "add":
+                self.add(quote_id, text)
+            else:
+                self.remove(quote_id)
+
+    def add(self, quote_id: int, text: str) -> None:
+        """Add a quote to the index, replacing it if it's already indexed"""
+        if not self.ready:
+            self._backlog.append(("add", quote_id, text))
+            return
+        self.remove(quote_id)
+        self._add(quote_id, text)
+
+    def remove(self, quote_id: int) -> None:
+        if not self.ready:
+            self._backlog.append(("remove", quote_id, None))
+            return
+        if quote_id not in self.lengths:
+            return
+        self.total_length -= self.lengths.pop(quote_id)
+        for word in self.words.pop(quote_id):
+            self._unlink(word, quote_id)
+
+    async def wait(self) -> None:
+        await self._ready.wait()
+
+    def _add(self, quote_id: int, text: str) -> None:
+        words = Counter(tokenize(text))
+        length = sum(words.values())
+        self.lengths[quote_id] = length
+        self.words[quote_id] = tuple(words)
+        self.total_length += length
+        self._results.clear()
+        norm = self._norm(quote_id)
+        for word, count in words.items():
+            postings = self.postings.get(word)
+            if postings is None:
+                postings = self.postings[word] = {}
+                for trigram in trigrams(word):
+                    self.trigrams.setdefault(trigram, set()).add(word)
+            postings[quote_id] = count
+            # while building, every score is computed at once when we're done instead
+            if self.ready:
+                self.impacts.setdefault(word, {})[quote_id] = count * (K1 + 1) / (count + norm)
+
+    def _unlink(self, word: str, quote_id: int) -> None:
+        self._results.clear()
+        postings = self.postings[word]
+        del postings[quote_id]
+        del self.impacts[word][quote_id]
+        if postings:
+            return
+        del self.postings[word]
+        del self.impacts[word]
+        for trigram in trigrams(word):
+            words = self.trigrams[trigram]
+            words.discard(word)
+            if not words:
+                del self.trigrams[trigram]
+
+    def _partial(self, term: str) -> List[str]:
+        """Find every indexed word that contains the given term, other than the term itself"""
+        if len(term) < 3:
+            return []
+        candidates = None
+        # intersect the smallest sets first, so we can stop early if there's nothing left
+        for words in sorted((self.trigrams.get(x, set()) for x in trigrams(term)), key=len):
+            candidates = set(words) if candidates is None else candidates & words
+            if not candidates:
+                return []
+        return [x for x in candidates if x != term and term in x]
+
+    def _score(
+        self, words: List[Tuple[str, float]], only: Dict[int, float] = None
+    ) -> Dict[int, float]:
+        """Score every quote containing any of the given words, or only the quotes in `only`
+
+        Each quote is scored by the best scoring word it contains.
+        """
+        count = len(self.lengths)
+        best: Dict[int, float] = {}
+        for word, weight in words:
+            impacts = self.impacts[word]
+            weight *= math.log(1 + (count - len(impacts) + 0.5) / (len(impacts) + 0.5))
+            if only is not None:
+                items = ((x, impacts[x]) for x in only if x in impacts)
+            elif not best:
+                best = {quote_id: weight * x for quote_id, x in impacts.items()}
+                continue
+            else:
+                items = impacts.items()
+            for quote_id, impact in items:
+                if weight * impact > best.get(quote_id, 0.0):
+                    best[quote_id] = weight * impact
+        return best
+
+    def search(self, query: str, *, limit: int = 10) -> List[Tuple[int, float]]:
+        """Find the quotes that best match the given query
+
+        Quotes are ranked first by how many query terms they match, and then by their
+        BM25 score, where words that only contain a query term count for less than the
+        term itself. Returns up to `limit` quote IDs with their scores, best match first.
+        """
+        terms = frozenset(tokenize(query))
+        if not terms or not self.lengths:
+            return []
+        key = (" ".join(sorted(terms)), limit)
+        if key in self._results:
+            self._results.move_to_end(key)
+            return self._results[key]
+
+        if abs(self.total_length / len(self.lengths) - self._average) > self._average * 0.1:
+            self._reweigh()
+
+        expanded = []
+        for term in terms:
+            words = [(term, 1.0)] if term in self.postings else []
+            words.extend((x, PARTIAL_WEIGHT * len(term) / len(x)) for x in self._partial(term))
+            if words:
+                expanded.append((sum(len(self.postings[x]) for x, _ in words), words))
+        # rarest terms first, so common terms can often be skipped entirely
+        expanded.sort(key=lambda x: x[0])
+
+        matched: Dict[int, int] = {}
+        scores: Dict[int, float] = {}
+        for idx, (_, words) in enumerate(expanded):
+            if len(expanded) == 1:
+                scores = self._score(words)
+                break
+            remaining = expanded[idx:]
+            if scores and len(scores) * len(remaining) < sum(x for x, _ in remaining):
+                # Quotes we haven't seen yet can match at most one term for each term that's
+                # left; if enough quotes we have seen are certain to match more terms than
+                # that, the remaining terms only have to be looked up for those quotes.
+                partial = [self._score(x, scores) for _, x in remaining]
+                final = {x: matched[x] + sum(x in p for p in partial) for x in scores}
+                if sum(1 for x in final.values() if x > len(remaining)) >= limit:
+                    for best in partial:
+                        for quote_id, score in best.items():
+                            scores[quote_id] += score
+                    matched = final
+                    break
+            for quote_id, score in self._score(words).items():
+                matched[quote_id] = matched.get(quote_id, 0) + 1
+                scores[quote_id] = scores.get(quote_id, 0.0) + score
+
+        if matched:
+            top = heapq.nlargest(limit, scores, key=lambda x: (matched[x], scores[x]))
+        else:
+            top = heapq.nlargest(limit, scores, key=scores.__getitem__)
+        results = self._results[key] = [(quote_id, scores[quote_id]) for quote_id in top]
+        if len(self._results) > RESULT_CACHE_SIZE:
+            self._results.popitem(last=False)
+        return results
+
+
+def get_index(guild_id: int) -> Optional[QuoteIndex]:
+    """Get the given guild's search index, if one has been built or is being built"""
+    return _indexes.get(guild_id)
+
+
+async def ensure_index(
+    guild_id: int, loader: Callable[[], Awaitable[Iterable[Tuple[int, str]]]]
+) -> QuoteIndex:
+    """Get the given guild's search index, building it first if it doesn't exist yet
+
+    `loader` should return every quote in the guild as ID and text pairs. The index is built
+    in an executor, so large guilds don't block the bot; any quotes changed in the meantime
+    are applied once it's done.
+    """
+    index = _indexes.get(guild_id)
+    if index is not None:
+        await index.wait()
+        if not index.ready:
+            # building it failed; try again ourselves
+            return await ensure_index(guild_id, loader)
+        return index
+    # the index is registered before the quotes are loaded, so that no change is missed
+    index = _indexes[guild_id] = QuoteIndex()
+    try:
+        quotes = list(await loader())
+        await asyncio.get_event_loop().run_in_executor(None, index.build, quotes)
+    except BaseException:
+        if _indexes.get(guild_id) is index:
+            del _indexes[guild_id]
+        index._ready.set()
+        raise
+    index.finish()
+    return index
+
+
+def drop_index(guild_id: int) -> None:
+    """Drop the given guild's search index, which is rebuilt the next time it's searched"""
+    _indexes.pop(guild_id, None)
+
+
+def clear_indexes() -> None:
+    _indexes.clear()
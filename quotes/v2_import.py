@@ -4,6 +4,8 @@ from pathlib import Path
 from redbot.core import Config
 from redbot.core.utils.data_converter import DataConverter
 
+from quotes.quote import reset_migrations
+
 
 def spec(v2data: dict):
     for guild_id in v2data.keys():
@@ -22,4 +24,7 @@ def spec(v2data: dict):
 
 
 async def import_v2_data(path: Path, config: Config):
+    # quotes are imported into the legacy list format, and are then moved into keyed storage
+    # after any quotes each guild already has the next time that guild's quotes are accessed
     await DataConverter(config).convert(path, spec)
+    reset_migrations()
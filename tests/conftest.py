@@ -0,0 +1,22 @@
+"""Shared setup for running the cogs outside of a bot
+
+The tests need Red and discord.py installed, as they would be for a bot. `cog_shared` is pointed
+at this repository, so `cog_shared.swift_libs` is imported from here, just as if it were
+symlinked into a bot's shared library directory.
+"""
+
+import sys
+import tempfile
+import types
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+if "cog_shared" not in sys.modules:
+    cog_shared = sys.modules["cog_shared"] = types.ModuleType("cog_shared")
+    cog_shared.__path__ = [str(ROOT)]
+
+from logs.replay import _prepare_red  # noqa: E402
+
+_prepare_red(tempfile.mkdtemp(prefix="swift-cogs-tests-"))
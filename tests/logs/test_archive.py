@@ -0,0 +1,31 @@
+import asyncio
+import time
+
+from logs.core.archive import ArchiveRecord, SQLiteArchive, apply_retention
+
+
+def record(guild_id: int, days_ago: float) -> ArchiveRecord:
+    return ArchiveRecord(
+        guild_id=guild_id,
+        module="message",
+        event="delete",
+        channel_id=None,
+        member_id=None,
+        timestamp=time.time() - days_ago * 86400,
+        content="deleted",
+        data={},
+    )
+
+
+def test_retention_covers_guilds_without_settings(tmp_path):
+    async def test():
+        archive = SQLiteArchive(tmp_path / "archive.sqlite3")
+        await archive.write([record(1, 60), record(2, 60), record(2, 1), record(3, 60)])
+        # guild 1 keeps its entries forever, and guild 2 has no settings stored anymore
+        guilds = {1: {"archive": {"retention": 0}}, 3: {"archive": {"retention": 90}}}
+        assert await apply_retention(archive, guilds) == 1
+        assert sorted(await archive.guild_ids()) == [1, 2, 3]
+        assert len(await archive.query(2)) == 1
+        await archive.close()
+
+    asyncio.get_event_loop().run_until_complete(test())
@@ -0,0 +1,165 @@
+import asyncio
+from types import SimpleNamespace
+
+from aiohttp import test_utils, web
+
+from logs.core.attachments import AttachmentCache
+
+MB = 1024 * 1024
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+class Server:
+    """Local stand-in for Discord's CDN, serving `/<name>/<size>` as `size` bytes
+
+    Bodies are streamed in 16 KiB chunks without a Content-Length; the last chunk is held
+    back until `release` is set.
+    """
+
+    def __init__(self):
+        app = web.Application()
+        app.router.add_get("/{name}/{size}", self.serve_file)
+        self.server = test_utils.TestServer(app)
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def serve_file(self, request: web.Request) -> web.StreamResponse:
+        size = int(request.match_info["size"])
+        body = request.match_info["name"].encode()[:1] * size
+        resp = web.StreamResponse()
+        resp.enable_chunked_encoding()
+        await resp.prepare(request)
+        chunks = [body[i : i + 16384] for i in range(0, size, 16384)]
+        for chunk in chunks[:-1]:
+            await resp.write(chunk)
+            await asyncio.sleep(0)
+        await self.release.wait()
+        if chunks:
+            await resp.write(chunks[-1])
+        await resp.write_eof()
+        return resp
+
+    async def __aenter__(self):
+        await self.server.start_server()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.server.close()
+
+    def message(self, guild_id: int, message_id: int, size: int, name: str = "a"):
+        attachment = SimpleNamespace(
+            id=message_id * 10,
+            size=size,
+            filename="{}.txt".format(name),
+            url=str(self.server.make_url("/{}/{}".format(name, size))),
+        )
+        return SimpleNamespace(
+            guild=SimpleNamespace(id=guild_id), id=message_id, attachments=[attachment]
+        )
+
+
+async def fetch(cache: AttachmentCache, message, budget: int = 1000) -> int:
+    queued = cache.put(message, budget)
+    await cache._queue.join()
+    return queued
+
+
+def test_download_and_pop(tmp_path):
+    async def test():
+        cache = AttachmentCache(tmp_path, workers=2)
+        async with Server() as server:
+            assert await fetch(cache, server.message(1, 1, 100, name="x")) == 1
+        assert 1 in cache and cache.usage(1) == 100
+        assert await cache.pop(1) == [("x.txt", b"x" * 100)]
+        assert 1 not in cache and cache.size == 0
+        await cache.close()
+        assert not cache.path.exists()
+
+    run(test())
+
+
+def test_large_attachments_are_read_fully(tmp_path):
+    async def test():
+        cache = AttachmentCache(tmp_path, workers=1, max_file_size=200 * 1024)
+        async with Server() as server:
+            assert await fetch(cache, server.message(1, 1, 150 * 1024, name="x"), MB) == 1
+            # larger than the limit, which can only be found out while reading it
+            message = server.message(1, 2, 250 * 1024)
+            message.attachments[0].size = 100
+            assert await fetch(cache, message, MB) == 1
+        assert await cache.pop(1) == [("x.txt", b"x" * 150 * 1024)]
+        assert 2 not in cache and cache.stats["skipped"] == 1
+        await cache.close()
+
+    run(test())
+
+
+def test_deleted_while_downloading(tmp_path):
+    async def test():
+        cache = AttachmentCache(tmp_path, workers=1)
+        async with Server() as server:
+            server.release.clear()
+            cache.put(server.message(1, 1, 100 * 1024), MB)
+            await asyncio.sleep(0.1)
+            assert await cache.pop(1) == []
+            server.release.set()
+            await cache._queue.join()
+        assert 1 not in cache and cache.size == 0 and cache.usage(1) == 0
+        await cache.close()
+
+    run(test())
+
+
+def test_guild_budget_evicts_least_recently_used(tmp_path):
+    async def test():
+        cache = AttachmentCache(tmp_path, workers=1)
+        async with Server() as server:
+            await fetch(cache, server.message(1, 1, 100), budget=250)
+            await fetch(cache, server.message(1, 2, 100), budget=250)
+            cache.touch(1)
+            await fetch(cache, server.message(1, 3, 100), budget=250)
+            # attachments that could never fit in the budget aren't downloaded at all
+            assert await fetch(cache, server.message(1, 4, 300), budget=250) == 0
+            # other servers have a budget of their own
+            await fetch(cache, server.message(2, 5, 200), budget=250)
+        assert [x for x in (1, 2, 3, 4, 5) if x in cache] == [1, 3, 5]
+        assert cache.usage(1) == 200 and cache.usage(2) == 200
+        assert cache.stats["evicted"] == 1 and cache.stats["skipped"] == 1
+        await cache.close()
+
+    run(test())
+
+
+def test_total_size_evicts_across_guilds(tmp_path):
+    async def test():
+        cache = AttachmentCache(tmp_path, workers=1, max_size=250)
+        async with Server() as server:
+            for guild_id in (1, 2, 3):
+                await fetch(cache, server.message(guild_id, guild_id, 100))
+        assert 1 not in cache and 2 in cache and 3 in cache
+        assert cache.size == 200
+        await cache.close()
+
+    run(test())
+
+
+def test_reload_keeps_new_cache_files(tmp_path):
+    async def test():
+        (tmp_path / "123").mkdir()
+        (tmp_path / "123" / "leftover.txt").write_bytes(b"old")
+        old = AttachmentCache(tmp_path, workers=1)
+        await old._cleanup
+        assert [x.name for x in tmp_path.iterdir()] == []
+        new = AttachmentCache(tmp_path, workers=1)
+        async with Server() as server:
+            await fetch(new, server.message(1, 1, 100))
+        await old.close()
+        await new._cleanup
+        assert [x.name for x in tmp_path.iterdir()] == [new.path.name]
+        assert await new.pop(1) == [("a.txt", b"a" * 100)]
+        await new.close()
+
+    run(test())
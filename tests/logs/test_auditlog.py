@@ -0,0 +1,106 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import discord
+import pytest
+
+from logs.core import auditlog
+from logs.core.auditlog import AuditLogCache
+
+DELETE = discord.AuditLogAction.message_delete
+
+
+class Guild:
+    id = 1
+
+    def __init__(self):
+        self.me = SimpleNamespace(guild_permissions=SimpleNamespace(view_audit_log=True))
+        self.entries = []
+
+    def audit_logs(self, limit):
+        entries = list(self.entries)
+
+        async def flatten():
+            return entries
+
+        return SimpleNamespace(flatten=flatten)
+
+
+def entry(entry_id: int, created_at: datetime, *, target: int = 5, count: int = 1):
+    return SimpleNamespace(
+        id=entry_id,
+        action=DELETE,
+        created_at=created_at,
+        target=SimpleNamespace(id=target),
+        extra=SimpleNamespace(channel=SimpleNamespace(id=2), count=count),
+    )
+
+
+@pytest.fixture(autouse=True)
+def no_fetch_delay(monkeypatch):
+    monkeypatch.setattr(auditlog, "FETCH_DELAY", 0)
+    monkeypatch.setattr(auditlog, "FETCH_INTERVAL", 0)
+
+
+def find(cache: AuditLogCache, event_time: datetime):
+    return asyncio.get_event_loop().run_until_complete(
+        cache.find(DELETE, 5, channel_id=2, event_time=event_time)
+    )
+
+
+def test_older_entries_are_not_matched():
+    # a moderator deleted one of this member's messages, and they later deleted their own
+    guild = Guild()
+    guild.entries = [entry(1, datetime.utcnow() - timedelta(seconds=30))]
+    assert find(AuditLogCache(guild), datetime.utcnow()) is None
+
+
+def test_newer_entries_are_matched():
+    guild = Guild()
+    event_time = datetime.utcnow()
+    guild.entries = [entry(1, event_time + timedelta(milliseconds=200))]
+    assert find(AuditLogCache(guild), event_time).id == 1
+
+
+def test_refetches_for_events_after_the_last_fetch():
+    guild = Guild()
+    cache = AuditLogCache(guild)
+    assert find(cache, datetime.utcnow() - timedelta(seconds=1)) is None
+    assert cache.requests == 1
+
+    event_time = datetime.utcnow() + timedelta(seconds=1)
+    guild.entries = [entry(1, event_time)]
+    assert find(cache, event_time).id == 1
+    assert cache.requests == 2
+
+
+def test_updated_entries_are_matched():
+    # repeated deletions by the same moderator update the existing entry's count
+    guild = Guild()
+    cache = AuditLogCache(guild)
+    created_at = datetime.utcnow() - timedelta(seconds=30)
+    guild.entries = [entry(1, created_at)]
+    assert find(cache, datetime.utcnow()) is None
+
+    event_time = datetime.utcnow() + timedelta(seconds=1)
+    guild.entries = [entry(1, created_at, count=2)]
+    assert find(cache, event_time).id == 1
+
+
+def test_misses_share_fetches(monkeypatch):
+    # members deleting their own messages never have a matching entry
+    monkeypatch.setattr(auditlog, "FETCH_INTERVAL", 0.6)
+    guild = Guild()
+    cache = AuditLogCache(guild)
+    loop = asyncio.get_event_loop()
+    event_time = datetime.utcnow() - timedelta(seconds=1)
+    lookups = [cache.find(DELETE, 5, channel_id=2, event_time=event_time) for _ in range(5)]
+    assert loop.run_until_complete(asyncio.gather(*lookups)) == [None] * 5
+    assert cache.requests == 1
+
+    # a miss right after a fetch has to wait for the next one
+    started = loop.time()
+    assert find(cache, datetime.utcnow()) is None
+    assert cache.requests == 2
+    assert loop.time() - started >= 0.5
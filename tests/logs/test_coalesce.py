@@ -0,0 +1,67 @@
+import asyncio
+import io
+import json
+from types import SimpleNamespace
+
+from logs.core import module, stats
+from logs.replay import replay
+
+MEMBER = {
+    "type": "member",
+    "id": 5,
+    "guild": 1,
+    "name": "user",
+    "discriminator": "0001",
+    "nick": None,
+    "bot": False,
+    "avatar": None,
+    "roles": [],
+    "joined_at": 0,
+    "created_at": 0,
+}
+
+
+def voice_state(self_mute: bool) -> dict:
+    return {
+        "type": "voice_state",
+        "channel": None,
+        "self_mute": self_mute,
+        "self_deaf": False,
+        "mute": False,
+        "deaf": False,
+    }
+
+
+def run(tmp_path, events) -> dict:
+    path = tmp_path / "recording.jsonl"
+    path.write_text("\n".join(json.dumps({"t": 0, "e": e, "a": a}) for e, a in events))
+    stats.reset()
+    asyncio.get_event_loop().run_until_complete(replay(str(path), out=io.StringIO()))
+    return {(m, e): counters for m, e, counters in stats.by_event()}
+
+
+def toggles(count: int) -> list:
+    return [
+        ("voice_state_update", [MEMBER, voice_state(bool(i % 2)), voice_state(not i % 2)])
+        for i in range(count)
+    ]
+
+
+def test_coalesced_events_are_counted(tmp_path):
+    counters = run(tmp_path, toggles(3))[("voice", "update")]
+    assert counters["received"] == 3 and counters["coalesced"] == 3
+    assert counters["sent"] == 1 and "filtered" not in counters
+
+
+def test_coalesced_entries_are_throttled(tmp_path, monkeypatch):
+    allowed = []
+
+    def allow(name, guild):
+        # allow the events themselves, but not the entry they're flushed into
+        allowed.append(len(allowed) < 2)
+        return allowed[-1]
+
+    monkeypatch.setattr(module, "get_throttle", lambda guild: SimpleNamespace(allow=allow))
+    counters = run(tmp_path, toggles(2))[("voice", "update")]
+    assert counters["coalesced"] == 2 and counters["throttled"] == 1
+    assert "sent" not in counters
@@ -0,0 +1,133 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+
+from logs.core import delivery
+from logs.core.delivery import Batcher, LineBatcher
+from logs.core.logentry import LogEntry
+
+MODULE = SimpleNamespace(name="message", compact_line=lambda entry: entry.description)
+WEBHOOK = "https://discordapp.com/api/webhooks/1/token"
+
+
+class Channel:
+    def __init__(self, broken: str = None):
+        me = SimpleNamespace(display_name="Red", avatar_url_as=lambda **_: "avatar.png")
+        self.guild = SimpleNamespace(me=me)
+        self.broken = broken
+        self.uploads = []
+        self.sent = []
+        self.embeds = []
+
+    async def send(self, content=None, *, embed=None, files=None):
+        text = embed.description if embed is not None else content
+        if text == self.broken:
+            raise ValueError("something unexpected")
+        # reading a file discord.py already closed raises ValueError
+        self.uploads.extend(f.fp.read() for f in files or [])
+        self.sent.append(text)
+        if embed is not None:
+            self.embeds.append(embed)
+
+
+async def failing_webhook(url, embeds=None, *, files=None, **kwargs):
+    # discord.py closes every file it's given, even if the request fails
+    for f in files or []:
+        f.close()
+    raise discord.HTTPException(SimpleNamespace(status=500, reason="Server Error"), "oops")
+
+
+def entry(description: str, attachment: bytes = None) -> LogEntry:
+    entry = LogEntry(MODULE, description=description, require_fields=False, event="delete")
+    if attachment is not None:
+        entry.attach_file("file.txt", attachment)
+    return entry
+
+
+def send(batcher: Batcher, *entries: LogEntry):
+    asyncio.get_event_loop().run_until_complete(batcher._send(list(entries)))
+
+
+def test_webhook_fallback_reuploads_files(monkeypatch):
+    monkeypatch.setattr(delivery, "send_webhook", failing_webhook)
+    channel = Channel()
+    batcher = Batcher(channel, WEBHOOK)
+    send(batcher, entry("deleted", b"contents"))
+    assert channel.uploads == [b"contents"]
+    assert batcher.stats["sent"] == 1
+
+
+def test_line_webhook_fallback_reuploads_files(monkeypatch):
+    monkeypatch.setattr(delivery, "send_webhook", failing_webhook)
+    channel = Channel()
+    batcher = LineBatcher(channel, WEBHOOK)
+    send(batcher, entry("deleted", b"contents"))
+    assert channel.uploads == [b"contents"]
+    assert batcher.stats["sent"] == 1
+
+
+def test_unexpected_error_only_fails_one_entry():
+    channel = Channel(broken="second")
+    batcher = Batcher(channel)
+    send(batcher, entry("first"), entry("second"), entry("third"))
+    assert channel.sent == ["first", "third"]
+    assert batcher.stats["sent"] == 2
+    assert batcher.stats["failed"] == 1
+
+
+async def lookup(delay: float):
+    await asyncio.sleep(delay)
+    return SimpleNamespace(user=SimpleNamespace(id=3, mention="<@3>"), reason=None)
+
+
+def test_audit_lookups_finish_before_sending():
+    channel = Channel()
+    batcher = Batcher(channel)
+    batcher.put(entry("deleted").add_audit_info(lookup(0.05), name="Deleted By"))
+    asyncio.get_event_loop().run_until_complete(batcher.flush())
+    batcher.close()
+    assert [x.name for x in channel.embeds[0].fields] == ["Deleted By"]
+
+
+def test_slow_audit_lookups_are_given_up_on(monkeypatch):
+    monkeypatch.setattr(delivery, "AUDIT_TIMEOUT", 0.05)
+    channel = Channel()
+    batcher = Batcher(channel)
+    batcher.put(entry("deleted").add_audit_info(lookup(5), name="Deleted By"))
+    asyncio.get_event_loop().run_until_complete(batcher.flush())
+    batcher.close()
+    assert channel.sent == ["deleted"] and channel.embeds[0].fields == []
+
+
+def test_only_sent_entries_are_archived(monkeypatch):
+    archived = []
+    monkeypatch.setattr(delivery, "get_archive", lambda: SimpleNamespace(put=archived.append))
+    channel = Channel(broken="broken")
+    batcher = Batcher(channel)
+    entries = [entry("sent"), entry("broken"), entry("not archived")]
+    entries[0].archive_guild_id = entries[1].archive_guild_id = 1
+    send(batcher, *entries)
+    assert [(x.guild_id, x.content) for x in archived] == [(1, "sent")]
+
+
+def test_flush_delay_only_applies_to_webhooks(monkeypatch):
+    webhook_sends = []
+
+    async def send_webhook(url, embeds=None, **kwargs):
+        webhook_sends.append(embeds)
+
+    monkeypatch.setattr(delivery, "send_webhook", send_webhook)
+
+    async def test():
+        channel = Channel()
+        direct, webhook = Batcher(channel), Batcher(channel, WEBHOOK)
+        direct.put(entry("direct"))
+        webhook.put(entry("webhook"))
+        await asyncio.sleep(0.1)
+        # webhook entries are held back so they can share a message with later entries
+        assert channel.sent == ["direct"] and webhook_sends == []
+        direct.close()
+        webhook.close()
+
+    asyncio.get_event_loop().run_until_complete(test())
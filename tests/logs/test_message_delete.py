@@ -0,0 +1,68 @@
+import asyncio
+import io
+import json
+
+from logs.replay import replay
+
+MEMBER = {
+    "type": "member",
+    "id": 5,
+    "guild": 1,
+    "name": "user",
+    "discriminator": "0001",
+    "nick": None,
+    "bot": False,
+    "avatar": None,
+    "roles": [],
+    "joined_at": 0,
+    "created_at": 0,
+}
+
+
+def message(message_id: int) -> dict:
+    return {
+        "type": "message",
+        "id": message_id,
+        "guild": 1,
+        "channel": 2,
+        "author": MEMBER,
+        "content": "message #{}".format(message_id),
+        "attachments": [],
+        "created_at": 0,
+    }
+
+
+def raw_delete(message_id: int, cached: bool) -> dict:
+    return {
+        "type": "raw_delete",
+        "id": message_id,
+        "channel": 2,
+        "cached": message(message_id) if cached else None,
+    }
+
+
+def run(tmp_path, events) -> dict:
+    path = tmp_path / "recording.jsonl"
+    path.write_text("\n".join(json.dumps({"t": 0, "e": e, "a": a}) for e, a in events))
+    return asyncio.get_event_loop().run_until_complete(replay(str(path), out=io.StringIO()))
+
+
+def test_cached_delete_is_logged_once(tmp_path):
+    # discord.py dispatches both events for messages that are in its cache
+    report = run(
+        tmp_path,
+        [
+            ("message", [message(10)]),
+            ("raw_message_delete", [raw_delete(10, cached=True)]),
+            ("message_delete", [message(10)]),
+        ],
+    )
+    assert report["embeds"] == 1
+
+
+def test_uncached_delete_is_logged_once(tmp_path):
+    report = run(
+        tmp_path,
+        [("message", [message(11)]), ("raw_message_delete", [raw_delete(11, cached=False)])],
+    )
+    assert report["embeds"] == 1
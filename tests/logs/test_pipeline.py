@@ -0,0 +1,34 @@
+import asyncio
+from types import SimpleNamespace
+
+from logs.core.pipeline import Pipeline
+
+
+def test_resize_keeps_guild_order():
+    async def test():
+        handled = []
+        release = asyncio.Event()
+
+        async def handler(module, event, *args, use_guild):
+            if event == "slow":
+                await release.wait()
+            handled.append(event)
+
+        pipeline = Pipeline(handler, workers=1)
+        pipeline.start()
+        guild = SimpleNamespace(id=1)
+        pipeline.submit("message", "slow", use_guild=guild)
+        await asyncio.sleep(0)
+        # the old worker is still busy with the first event when the second one comes in
+        await pipeline.resize(2)
+        pipeline.submit("message", "fast", use_guild=guild)
+        for _ in range(5):
+            await asyncio.sleep(0)
+        assert handled == []
+        release.set()
+        for _ in range(5):
+            await asyncio.sleep(0)
+        assert handled == ["slow", "fast"]
+        pipeline.stop()
+
+    asyncio.get_event_loop().run_until_complete(test())
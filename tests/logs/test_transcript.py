@@ -0,0 +1,54 @@
+import asyncio
+import gzip
+from types import SimpleNamespace
+
+
+from logs.core import transcript
+from logs.core.logentry import LogEntry
+from logs.core.msgstore import StoredMessage
+
+MODULE = SimpleNamespace(name="message")
+# 2019-01-01, as a snowflake
+BASE_ID = 529_500_000_000_000_000
+
+
+def build(count: int, length: int) -> LogEntry:
+    messages = [
+        StoredMessage(BASE_ID + (x << 22), 2, 5, "{:<{}}".format(x, length), [])
+        for x in range(count)
+    ]
+    channel = SimpleNamespace(name="general", guild=SimpleNamespace(get_member=lambda _: None))
+    bot = SimpleNamespace(get_user=lambda _: "user#0001")
+    entry = LogEntry(MODULE, description="deleted", require_fields=False)
+    return entry.attach_generated(transcript.build_transcript(bot, channel, messages))
+
+
+def make_files(entry: LogEntry):
+    return asyncio.get_event_loop().run_until_complete(entry.make_files())
+
+
+def test_small_transcript():
+    entry = build(2, 10)
+    (file,) = make_files(entry)
+    assert file.filename == "deleted-messages-general-{}.txt".format(BASE_ID + (1 << 22))
+    lines = file.fp.read().decode().splitlines()
+    assert len(lines) == 2
+    assert lines[0].startswith("[2019-") and "user#0001 (5): 0" in lines[0]
+
+
+def test_large_transcript_is_compressed():
+    # the largest a bulk deletion can get; 100 messages of 2000 characters each
+    entry = build(100, 2000)
+    (file,) = make_files(entry)
+    assert file.filename.endswith(".txt.gz")
+    text = gzip.decompress(file.fp.read()).decode()
+    assert len(text.splitlines()) == 100 and len(text) > transcript.GZIP_THRESHOLD
+
+
+def test_transcript_is_rewritten_for_every_attempt():
+    entry = build(100, 2000)
+    (first,) = make_files(entry)
+    first.fp.read()
+    (second,) = make_files(entry)
+    assert second.fp is not first.fp
+    assert gzip.decompress(second.fp.read()).count(b"\n") == 100